@@ -0,0 +1,6 @@
+"""
+kx – shared storage and analytics helpers for the Kings Cross pipeline.
+
+Scripts under scripts/ import this package; ops commands are exposed via
+`python -m kx <command>` (run from the repo root).
+"""
@@ -0,0 +1,334 @@
+"""
+Ops entry point:  python -m kx <command> [...]
+
+Commands:
+- compact       fold closed months of segment files into monthly archives
+- bench-codec   load/dump timings of the data files for stdlib json vs orjson
+- query         range / last-N / as-of lookups over history, observations, anomalies
+- backfill      replay the anomaly rules over the full log into a versioned anomaly set
+- episodes      anomaly episodes overlapping a time range (or rebuild them from the store)
+- yoy           year-over-year comparison of the Christmas / New Year season
+- coverage      how often actuals fell inside the published forecast bands, by horizon
+- backtest      rolling-origin backtest of the forecasters (MAE / RMSE / pinball by horizon and phase)
+"""
+
+import argparse
+import glob
+import sys
+
+
+def cmd_compact(args):
+    from .store import compact_all
+    res = compact_all()
+    total = sum(len(m) for m in res.values())
+    for name, months in res.items():
+        for month, n in months.items():
+            print(f"🗜️ {name}: compacted {n} segments into {month}.jsonl")
+    if not total:
+        print("Nothing to compact")
+
+
+def cmd_bench_codec(args):
+    from . import codec
+    paths = args.files or sorted(glob.glob("data/*.json") + glob.glob("data/history/*.json"))
+    rows = codec.benchmark(paths, repeat=args.repeat)
+    cols = [c for c in ("json_load", "orjson_load", "json_dump_pretty", "orjson_dump_pretty",
+                        "json_dump_compact", "orjson_dump_compact") if any(c in r for r in rows)]
+    print(f"backend in use: {codec.BACKEND}   (median of {args.repeat} runs, ms)")
+    print(f"{'file':<45}{'KB':>8}" + "".join(f"{c:>21}" for c in cols))
+    for r in rows:
+        print(f"{r['file']:<45}{r['kb']:>8}" + "".join(f"{r.get(c, float('nan')):>21.3f}" for c in cols))
+
+
+def _parse_when(s, end=False):
+    from .timeutil import parse_ts, DAY
+    ts = parse_ts(s)
+    if ts is None:
+        raise SystemExit(f"Bad date/time: {s}")
+    # a bare date as --to means "through the end of that day"
+    if end and len(s.strip()) == 10:
+        ts += DAY
+    return ts
+
+
+def _parse_where(items):
+    conds = []
+    for it in items or []:
+        if "=" not in it:
+            raise SystemExit(f"--where expects key=value, got: {it}")
+        k, v = it.split("=", 1)
+        conds.append((k.split("."), v))
+    if not conds:
+        return None
+
+    def where(rec):
+        for path, v in conds:
+            cur = rec
+            for k in path:
+                cur = cur.get(k) if isinstance(cur, dict) else None
+            if isinstance(cur, list):
+                if v not in [str(x) for x in cur]:
+                    return False
+            elif str(cur) != v:
+                return False
+        return True
+    return where
+
+
+def cmd_query(args):
+    from . import codec
+    from .query import query_range, query_last, query_as_of
+    where = _parse_where(args.where)
+    if args.as_of:
+        hit = query_as_of(args.store, _parse_when(args.as_of), where)
+        rows = [hit] if hit else []
+    elif args.last:
+        rows = query_last(args.store, args.last, where)
+    else:
+        lo = _parse_when(args.start) if args.start else None
+        hi = _parse_when(args.end, end=True) if args.end else None
+        rows = query_range(args.store, lo, hi, where)
+
+    if args.fields:
+        fields = args.fields.split(",")
+        rows = [{f: r.get(f) for f in fields} for r in rows]
+
+    out = sys.stdout.buffer
+    if args.json:
+        out.write(codec.dumps(rows, pretty=True) + b"\n")
+    else:
+        for r in rows:
+            out.write(codec.dumps(r) + b"\n")
+    print(f"{len(rows)} rows", file=sys.stderr)
+
+
+def cmd_backfill(args):
+    import time
+    from .anomaly import backfill
+    from .stream import iter_records
+    lo = _parse_when(args.start) if args.start else None
+    hi = _parse_when(args.end, end=True) if args.end else None
+    t0 = time.perf_counter()
+    m = backfill(iter_records(args.source, lo, hi), out_dir=args.out, source=args.source)
+    dt = time.perf_counter() - t0
+    print(f"✅ Anomaly set {m['version']}: {m['anomalies']} anomalies from {m['rows_replayed']} rows in {dt:.2f}s")
+    print(f"🧾 By type: {m['by_type']}")
+
+
+def cmd_episodes(args):
+    from . import codec
+    from .episodes import EPISODE_RETENTION, EpisodeLog, load_episodes
+    from .store import open_store
+    from .stream import iter_records
+    from .timeutil import iso
+    store = open_store("anomalies")
+    if args.rebuild:
+        log = EpisodeLog()
+        log.add_many(store.iter_records())
+        log.prune(log.last_ts - EPISODE_RETENTION)
+        log.save()
+        log.publish()
+        print(f"🧩 {len(log)} episodes since {iso(log.horizon) if log.horizon else 'the start'}", file=sys.stderr)
+    else:
+        log = load_episodes(bootstrap=store.iter_records(), last_ts=store.last_ts())
+    lo = _parse_when(args.start) if args.start else None
+    hi = _parse_when(args.end, end=True) if args.end else None
+    if lo is None or lo < log.horizon:
+        # before the retained log: merge the store up to `hi` (one pass)
+        log = EpisodeLog()
+        log.add_many(iter_records("anomalies", None, hi))
+    rows = log.overlapping(lo, hi, args.type)
+    out = sys.stdout.buffer
+    for e in rows:
+        out.write(codec.dumps(e) + b"\n")
+    print(f"{len(rows)} episodes", file=sys.stderr)
+
+
+def cmd_yoy(args):
+    import time
+    from .seasons import yoy_report, write_report
+    t0 = time.perf_counter()
+    rep = yoy_report(args.season, args.vs, source=args.source)
+    dt = time.perf_counter() - t0
+    if not rep["seasons"]:
+        print("No runs inside the season window yet")
+        return
+    season = args.season or max(int(s) for s in rep["seasons"])
+    path = write_report(rep, season, args.out)
+    print(f"📆 Seasons: {', '.join(rep['seasons'])} ({dt:.2f}s)")
+    for c in rep["comparisons"]:
+        print(f"   {c['season']} vs {c['vs']}: Δmean {c['mean_delta']}, volatility x{c['volatility_ratio']}, "
+              f"Δanomaly rate {c['anomaly_rate_delta']} over {c['slots_compared']} slots")
+    print(f"📄 Output: {path}")
+
+
+def cmd_coverage(args):
+    from . import codec
+    from .intervals import load_intervals
+    from .store import open_store
+    store = open_store("forecasts")
+    rep = load_intervals(bootstrap=store.iter_records(), last_ts=store.last_ts()).coverage_report()
+    if args.model:
+        rep = {k: v for k, v in rep.items() if k == args.model}
+    if args.json:
+        sys.stdout.buffer.write(codec.dumps(rep) + b"\n")
+        return
+    if not rep:
+        print("No forecasts scored yet")
+        return
+    for name, r in rep.items():
+        print(f"🎯 {name}: {r['inside']} of {r['n']} actuals inside the band (nominal {r['nominal']})")
+        print(f"   {'steps':<8}{'n':>7}{'below':>8}{'inside':>8}{'above':>8}")
+        for row in r["by_step"]:
+            print(f"   {row['steps']:<8}{row['n']:>7}{row['below']:>8.3f}{row['inside']:>8.3f}{row['above']:>8.3f}")
+
+
+def cmd_backtest(args):
+    import time
+    from .backtest import MODEL_NAMES, available_models, backtest, load_history, write_report
+    lo = _parse_when(args.start) if args.start else None
+    hi = _parse_when(args.end, end=True) if args.end else None
+    names = available_models(args.models.split(",") if args.models else MODEL_NAMES)
+    d = load_history(args.source, lo, hi)
+    t0 = time.perf_counter()
+    rep = backtest(d, names, hours=args.horizon, every=args.every, workers=args.workers)
+    dt = time.perf_counter() - t0
+    path = write_report(rep, args.out) if args.out else write_report(rep)
+    print(f"🧪 {rep['origins']} origins x {rep['horizon']}h, {len(names)} models, {rep['folds']} folds in {dt:.1f}s")
+    print(f"   {'model':<16}{'n':>8}{'MAE':>8}{'RMSE':>8}{'pinball':>9}")
+    for name in rep["ranking"]:
+        o = rep["models"][name]["overall"]
+        print(f"   {name:<16}{o['n']:>8}{o['mae']:>8.2f}{o['rmse']:>8.2f}{o['pinball']:>9.2f}")
+    print(f"📄 Output: {path}")
+
+
+def cmd_decompose(args):
+    import time
+    from .decompose import run, write
+    lo = _parse_when(args.start) if args.start else None
+    hi = _parse_when(args.end, end=True) if args.end else None
+    t0 = time.perf_counter()
+    rep = run(args.source, lo, hi)
+    dt = time.perf_counter() - t0
+    if rep is None:
+        print("No busyness values in range")
+        return
+    path = write(rep, args.out) if args.out else write(rep)
+    print(f"🌊 {rep['n']} hours from {rep['start']} ({rep['coverage']:.0%} observed) decomposed in {dt * 1000:.0f} ms")
+    print(f"   strength: {', '.join(f'{k} {v:.2f}' for k, v in rep['strength'].items())}; residual std {rep['residual_std']}")
+    print(f"   periods (h): {', '.join(str(p['period_hours']) for p in rep['periods'])}")
+    print(f"📄 Output: {path}")
+
+
+def cmd_tune_ridge(args):
+    import time
+    from .backtest import load_history
+    from .tune import FOLDS, LAMBDAS, tune, write_model
+    lo = _parse_when(args.start) if args.start else None
+    hi = _parse_when(args.end, end=True) if args.end else None
+    lambdas = [float(x) for x in args.lambdas.split(",")] if args.lambdas else LAMBDAS
+    d = load_history(args.source, lo, hi)
+    t0 = time.perf_counter()
+    model = tune(d, lambdas, folds=args.folds or FOLDS, workers=args.workers, source=args.source)
+    dt = time.perf_counter() - t0
+    if model is None:
+        print(f"Not enough runs to tune ({len(d['ts'])})")
+        return
+    t = model["tuning"]
+    print(f"🎛️ {len(t['results'])} feature subsets x {t['lambdas'][2]} lambdas, {t['folds']} folds, "
+          f"{model['n_samples']} runs in {dt:.2f}s")
+    print(f"   {'groups':<32}{'lambda':>9}{'MAE':>8}{'RMSE':>8}")
+    for r in t["results"]:
+        print(f"   {'+'.join(r['groups']) or 'base':<32}{r['lam']:>9.3g}{r['cv_mae']:>8.2f}{r['cv_rmse']:>8.2f}")
+    print(f"   untuned (base, lambda 0.35): MAE {t['cv_mae_untuned']:.2f}")
+    if args.dry_run:
+        return
+    path = write_model(model, args.out) if args.out else write_model(model)
+    print(f"📄 Output: {path}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m kx")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("compact", help="fold closed months into archive/YYYY-MM.jsonl")
+    sp.set_defaults(func=cmd_compact)
+
+    sp = sub.add_parser("bench-codec", help="time JSON load/dump of the data files per backend")
+    sp.add_argument("files", nargs="*", help="defaults to data/*.json and data/history/*.json")
+    sp.add_argument("--repeat", type=int, default=5)
+    sp.set_defaults(func=cmd_bench_codec)
+
+    sp = sub.add_parser("query", help="range / last-N / as-of queries over a store")
+    sp.add_argument("store", choices=["history", "observations", "anomalies"])
+    sp.add_argument("--from", dest="start", help="ISO date/time (inclusive)")
+    sp.add_argument("--to", dest="end", help="ISO date/time (exclusive; a bare date includes that day)")
+    sp.add_argument("--last", type=int, help="last N rows (after --where)")
+    sp.add_argument("--as-of", dest="as_of", help="latest row at or before this time")
+    sp.add_argument("--where", action="append", metavar="KEY=VALUE",
+                    help="filter, repeatable; dotted keys reach nested fields (signals.busyness=100)")
+    sp.add_argument("--fields", help="comma-separated fields to output")
+    sp.add_argument("--json", action="store_true", help="one JSON array instead of JSON lines")
+    sp.set_defaults(func=cmd_query)
+
+    sp = sub.add_parser("backfill", help="recompute anomalies over past observations")
+    sp.add_argument("--source", choices=["observations", "history"], default="observations")
+    sp.add_argument("--from", dest="start")
+    sp.add_argument("--to", dest="end")
+    sp.add_argument("--out", help="output dir (default data/anomaly_sets/<version>/<source>/)")
+    sp.set_defaults(func=cmd_backfill)
+
+    sp = sub.add_parser("episodes", help="anomaly episodes overlapping a time range")
+    sp.add_argument("--from", dest="start")
+    sp.add_argument("--to", dest="end")
+    sp.add_argument("--type", help="only this anomaly type")
+    sp.add_argument("--rebuild", action="store_true", help="recompute the episode log and data/anomaly_episodes.json from the anomaly store")
+    sp.set_defaults(func=cmd_episodes)
+
+    sp = sub.add_parser("yoy", help="compare seasons aligned by day relative to Christmas")
+    sp.add_argument("--season", type=int, help="season to report (year of its December; default latest)")
+    sp.add_argument("--vs", type=int, action="append", help="reference season, repeatable (default all earlier)")
+    sp.add_argument("--source", choices=["history", "observations"], default="history")
+    sp.add_argument("--out", help="insights file (default data/seasonal_insights_<season>.json)")
+    sp.set_defaults(func=cmd_yoy)
+
+    sp = sub.add_parser("coverage", help="forecast band coverage by horizon step")
+    sp.add_argument("--model", help="only this forecast model (heuristic, ridge, ...)")
+    sp.add_argument("--json", action="store_true")
+    sp.set_defaults(func=cmd_coverage)
+
+    sp = sub.add_parser("backtest", help="rolling-origin backtest of the busyness forecasters")
+    sp.add_argument("--models", help="comma-separated subset of heuristic,ridge,holt_winters,analog,moving_average,random_forest")
+    sp.add_argument("--horizon", type=int, default=24, help="hours ahead per origin (max 168)")
+    sp.add_argument("--every", type=int, default=1, help="use every n-th run as an origin")
+    sp.add_argument("--from", dest="start")
+    sp.add_argument("--to", dest="end")
+    sp.add_argument("--source", choices=["history", "observations"], default="history")
+    sp.add_argument("--workers", type=int, help="processes (default: all cores)")
+    sp.add_argument("--out", help="report file (default data/backtest_report.json)")
+    sp.set_defaults(func=cmd_backtest)
+
+    sp = sub.add_parser("decompose", help="trend / daily / weekly / residual decomposition of busyness")
+    sp.add_argument("--source", choices=["history", "observations"], default="history")
+    sp.add_argument("--from", dest="start")
+    sp.add_argument("--to", dest="end")
+    sp.add_argument("--out", help="artifact (default data/decomposition.json)")
+    sp.set_defaults(func=cmd_decompose)
+
+    sp = sub.add_parser("tune-ridge", help="CV search over ridge lambda x feature groups; writes the best model")
+    sp.add_argument("--source", choices=["history", "observations"], default="history")
+    sp.add_argument("--from", dest="start")
+    sp.add_argument("--to", dest="end")
+    sp.add_argument("--lambdas", help="comma-separated grid (default 25 values, 1e-3 .. 1e3)")
+    sp.add_argument("--folds", type=int, help="time-series CV folds (default 5)")
+    sp.add_argument("--workers", type=int, help="processes (default: serial unless the search is large)")
+    sp.add_argument("--dry-run", action="store_true", help="print the results, keep the current model")
+    sp.add_argument("--out", help="model file (default data/models/busyness_model.json)")
+    sp.set_defaults(func=cmd_tune_ridge)
+
+    args = p.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
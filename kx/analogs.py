@@ -0,0 +1,187 @@
+"""
+Analog (similar-day) forecaster: k nearest past situations over daily profiles.
+
+The history store is put on an hourly grid; every hour t with a mostly complete
+trailing day becomes an analog state encoded as
+- the trailing 24h busyness profile (the "day" ending at t)
+- temperature, transport stress and events at t
+- holiday phase (one-hot) and London local hour / weekday (cyclic)
+standardised per column, with the profile block scaled to weigh PROFILE_WEIGHT
+in total. Neighbours are found by brute force in NumPy (one distance pass and an
+argpartition): about 1 ms for a year of hourly states, no scikit-learn needed
+(the workflow does not install it, and a KD-tree gains little in ~36
+dimensions). A `before` cutoff (backtests) is a prefix of the t-sorted states.
+The index is built per process (~50 ms for a year), so there is nothing to
+cache between hourly runs. The forecast is the distance-weighted mean of what
+followed each analog (hours t+1 .. t+H), P10 / P90 across the analogs.
+
+Rare situations (NYE, a stadium event during a line suspension) borrow the
+days that looked like them rather than an average over everything.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from . import calendar_table as cal
+from . import forecast as forecast_engine
+from .columns import columns
+from .resample import fill, to_grid
+from .timeutil import HOUR, PHASES, iso
+
+FIELDS = ("busyness", "temperature", "transport_stress", "events_count")
+PROFILE_HOURS = 24
+MIN_PROFILE_HOURS = 18   # a state needs this many observed hours in its trailing day
+FILL_HOURS = 3           # forward-fill gaps up to this long on the grid
+PROFILE_WEIGHT = 3.0
+K = 10
+
+
+def hourly_grid(d: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Hourly means of each field; short gaps forward-filled, longer ones NaN."""
+    g = to_grid(d["ts"], {f: d[f] for f in FIELDS})
+    out = {"ts": g["ts"], "observed": g["observed"]}
+    for f in FIELDS:
+        out[f] = fill(g[f], FILL_HOURS, method="ffill")
+    return out
+
+
+def _encode(grid: Dict[str, np.ndarray], t: np.ndarray):
+    """Raw (unscaled) state vectors for grid hours t; rows with too little profile are flagged."""
+    lags = t[:, None] - np.arange(PROFILE_HOURS)[None, ::-1]
+    prof = np.where(lags >= 0, grid["busyness"][np.clip(lags, 0, None)], np.nan)
+    ok = (~np.isnan(prof)).sum(axis=1) >= MIN_PROFILE_HOURS
+    mean = np.nanmean(np.where(ok[:, None], prof, 0.0), axis=1)
+    prof = np.where(np.isnan(prof), mean[:, None], prof)
+
+    c = cal.rows(grid["ts"][t])
+    hour, dow = c["local_hour"].astype(float), c["local_dow"].astype(float)
+    exog = np.column_stack([
+        np.nan_to_num(grid["temperature"][t], nan=10.0),
+        np.nan_to_num(grid["transport_stress"][t]),
+        np.nan_to_num(grid["events_count"][t]),
+    ])
+    phase = np.eye(len(PHASES))[c["phase"]] * 3.0  # a phase mismatch costs ~ a few std's
+    cyc = np.column_stack([np.sin(2 * np.pi * hour / 24), np.cos(2 * np.pi * hour / 24),
+                           np.sin(2 * np.pi * dow / 7), np.cos(2 * np.pi * dow / 7)])
+    return prof, exog, phase, cyc, ok
+
+
+def _nan_quantiles(a: np.ndarray, qs) -> List[np.ndarray]:
+    """np.nanpercentile(a, axis=0) (linear) without its per-column Python loop; all-NaN columns give NaN."""
+    s = np.sort(a, axis=0)  # NaN sorts last
+    cnt = (~np.isnan(a)).sum(axis=0)
+    last = np.maximum(cnt - 1, 0)
+    cols = np.arange(a.shape[1])
+    out = []
+    for q in qs:
+        pos = last * q
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, last)
+        v = s[lo, cols] + (s[hi, cols] - s[lo, cols]) * (pos - lo)
+        out.append(np.where(cnt > 0, v, np.nan))
+    return out
+
+
+class AnalogIndex:
+    def __init__(self, grid: Dict[str, np.ndarray], fit_before: Optional[int] = None):
+        self.grid = grid
+        t = np.arange(len(grid["ts"]))
+        prof, exog, phase, cyc, ok = _encode(grid, t)
+        ok &= ~np.isnan(grid["busyness"])
+        self.t = t[ok]
+        self._raw = (prof[ok], exog[ok], phase[ok], cyc[ok])
+        self.fit(fit_before)
+
+    def fit(self, before: Optional[int] = None):
+        """Standardise with the statistics of the states before grid hour `before` (all if None),
+        so a backtest origin's distances do not depend on data after it."""
+        prof, exog = self._raw[0], self._raw[1]
+        m = len(self.t) if before is None else int(np.searchsorted(self.t, before))
+        if m:
+            self.p_mu, self.p_sd = prof[:m].mean(), max(prof[:m].std(), 1.0)
+            self.e_mu, self.e_sd = exog[:m].mean(axis=0), np.maximum(exog[:m].std(axis=0), 1e-6)
+        else:
+            self.p_mu, self.p_sd = 0.0, 1.0
+            self.e_mu, self.e_sd = np.zeros(exog.shape[1]), np.ones(exog.shape[1])
+        self.fitted_before = before
+        self.X = self._scale(*self._raw)
+
+    def _scale(self, prof, exog, phase, cyc) -> np.ndarray:
+        prof = (prof - self.p_mu) / self.p_sd * (PROFILE_WEIGHT / np.sqrt(PROFILE_HOURS))
+        exog = (exog - self.e_mu) / self.e_sd
+        return np.hstack([prof, exog, phase, cyc])
+
+    def __len__(self):
+        return len(self.X)
+
+    def encode(self, t: int) -> Optional[np.ndarray]:
+        prof, exog, phase, cyc, ok = _encode(self.grid, np.array([t]))
+        return self._scale(prof, exog, phase, cyc)[0] if ok[0] else None
+
+    def query(self, x: np.ndarray, k: int = K, before: Optional[int] = None):
+        """(grid hours, distances) of the k nearest states; `before` limits them to states with t < before."""
+        n = len(self.X) if before is None else int(np.searchsorted(self.t, before))
+        k = min(k, n)
+        if k == 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        # states are in t order, so the first n are the ones before `before`
+        dist = np.sqrt(((self.X[:n] - x) ** 2).sum(axis=1))
+        nn = np.argpartition(dist, k - 1)[:k]
+        nn = nn[np.argsort(dist[nn])]
+        return self.t[nn], dist[nn]
+
+    def forecast(self, t: int, hours: int = forecast_engine.HORIZON, k: int = K,
+                 now_ts: Optional[int] = None, x: Optional[np.ndarray] = None, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Forecast after grid hour t from what followed its analogs; None without analogs."""
+        x = self.encode(t) if x is None else x
+        if x is None:
+            return None
+        limit = t + 1 if before is None else before
+        nn, dist = self.query(x, k + 1, before=limit)
+        keep = nn != t
+        nn, dist = nn[keep][:k], dist[keep][:k]
+        if not len(nn):
+            return None
+        steps = nn[:, None] + np.arange(1, hours + 1)[None, :]
+        y = self.grid["busyness"]
+        fut = np.where(steps < min(len(y), limit), y[np.clip(steps, 0, len(y) - 1)], np.nan)
+        w = 1.0 / (dist + 1e-3)
+        wm = np.where(np.isnan(fut), 0.0, w[:, None])
+        has = wm.sum(axis=0) > 0
+        with np.errstate(invalid="ignore"):
+            point = np.where(has, (wm * np.nan_to_num(fut)).sum(axis=0) / np.maximum(wm.sum(axis=0), 1e-12), np.nan)
+            p10, p90 = _nan_quantiles(np.where(has[None, :], fut, 0.0), (0.1, 0.9))
+        # steps no analog can see (short history) fall back to the analogs' overall mean
+        fallback = np.nanmean(fut) if np.isfinite(fut).any() else float(np.nanmean(y))
+        point = np.where(np.isnan(point), fallback, point)
+        p10 = np.where(np.isnan(p10), point, p10)
+        p90 = np.where(np.isnan(p90), point, p90)
+
+        start = int(now_ts) if now_ts is not None else int(self.grid["ts"][t])
+        ts = forecast_engine.horizon_ts(start, hours)
+        rush = np.isin(cal.rows(ts)["local_hour"], list(cal.RUSH_HOURS))
+        fc = forecast_engine.pack(ts, point, np.zeros(hours), rush, "analog", "medium" if len(nn) >= k else "low")
+        fc["low"] = np.clip(np.minimum(p10, point), 0, 100).astype(int).tolist()
+        fc["high"] = np.clip(np.maximum(p90, point), 0, 100).astype(int).tolist()
+        fc["analogs"] = [{"time": iso(int(self.grid["ts"][i])), "distance": round(float(d), 3)} for i, d in zip(nn, dist)]
+        return fc
+
+
+def build_index(source: str = "history", lo: Optional[int] = None, hi: Optional[int] = None) -> Optional[AnalogIndex]:
+    d = columns(source, list(FIELDS), lo, hi)
+    if not len(d["ts"]):
+        return None
+    return AnalogIndex(hourly_grid(d))
+
+
+def analog_forecast(now_ts: int, index: Optional[AnalogIndex] = None, hours: int = forecast_engine.HORIZON) -> Optional[Dict[str, Any]]:
+    """Forecast for the grid hour containing now_ts (which must be in the index's grid)."""
+    index = index or build_index()
+    if index is None or not len(index):
+        return None
+    t = int(now_ts // HOUR - index.grid["ts"][0] // HOUR)
+    if not 0 <= t < len(index.grid["ts"]):
+        return None
+    return index.forecast(t, hours, now_ts=now_ts)
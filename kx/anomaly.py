@@ -0,0 +1,699 @@
+"""
+Anomaly rules (taxonomy v1) shared by the live pipeline and the batch backfill.
+
+detect() scores one run given its signals, the seasonal baseline for that
+hour and the rolling busyness window (demand anomalies). Windowed rules look at
+clock hours on a regular grid (kx.resample), not at the last N rows: cron
+skips hours and sometimes runs twice in one. RollingDetectors adds
+the timing and signal-mismatch types from state that is updated once per run:
+- a 24-slot tracker of today's hourly peaks plus an expected-peak table per
+  weekday / holiday phase (shifted_peak, missing_peak)
+- a recursive least-squares fit of busyness-above-baseline on the signals;
+  its prior residual tells when observed demand disagrees with what the
+  transport / weather / event signals imply (*_demand_mismatch)
+- CUSUM + Bayesian online change-point detectors (kx.changepoint) on the
+  baseline-standardised busyness and on that residual (regime_shift, with the
+  estimated start of the new regime)
+
+AnomalyEngine wraps both with the rolling state (window, recent anomaly types,
+baseline) so a whole log can be replayed in one linear pass:
+
+    python -m kx backfill                      # replay the observations store
+    python -m kx backfill --from 2025-12-20 --to 2026-01-07
+
+Backfills are written as versioned sets under data/anomaly_sets/<version>/<source>/
+(anomalies.jsonl, episodes.json, manifest.json), where the version combines
+RULES_VERSION with a hash of THRESHOLDS.
+"""
+
+from __future__ import annotations
+import os, hashlib, datetime
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from . import codec
+from .baseline import SeasonalBaseline, HALF_LIFE_DAYS
+from .changepoint import RegimeShifts, CUSUM_K, CUSUM_H, HAZARD, MIN_RUN
+from .episodes import EpisodeLog
+from .paths import DATA_DIR, MODELS_DIR
+from .resample import recent as recent_grid
+from .timeutil import DAY, epoch_of, iso, hour_of_day, day_of_week
+
+RULES_VERSION = "v1"
+SETS_DIR = os.path.join(DATA_DIR, "anomaly_sets")
+STATE_FILE = os.path.join(MODELS_DIR, "anomaly_state.json")
+
+THRESHOLDS = {
+    "z_peak": 2.0,
+    "z_high": 3.0,
+    "transport_stress": 16,
+    "events": 2,
+    "prolonged_hours": 3,
+    "volatile_hours": 4,
+    "volatile_range": 22,
+    "persistence_window": 6,
+    # timing
+    "peak_min_days": 3,        # expected-peak table weight before timing rules fire
+    "peak_min_hours": 12,      # hours a day must cover to count as observed
+    "peak_shift_hours": 3,
+    "peak_grace_hours": 2,     # missing_peak is checked this long after the expected hour
+    "peak_drop_z": 2.0,
+    # signal mismatch
+    "mismatch_min_runs": 48,
+    "mismatch_z": 2.0,
+    "mismatch_effect": 3.0,    # busyness points a signal must imply to be "active"
+    # regime shifts (kx.changepoint)
+    "regime_cusum_k": CUSUM_K,
+    "regime_cusum_h": CUSUM_H,
+    "regime_hazard": HAZARD,
+    "regime_min_run": MIN_RUN,
+}
+
+WINDOW = 4 * (THRESHOLDS["volatile_hours"] + 1)  # runs kept; covers the longest window at 15-min runs
+PERSISTENCE_WINDOW = THRESHOLDS["persistence_window"]
+
+
+def clamp(x, lo, hi):
+    return max(lo, min(hi, x))
+
+
+def rules_version() -> str:
+    h = hashlib.sha1(codec.dumps(THRESHOLDS)).hexdigest()[:8]
+    return f"{RULES_VERSION}-{h}"
+
+
+# ---------------- helpers ----------------
+
+def anomaly_confidence(base=0.55, agreements=0, penalties=0):
+    c = base + 0.08 * agreements - 0.10 * penalties
+    return clamp(c, 0.40, 0.95)
+
+
+class RecentTypes:
+    """The last `window` anomaly types with a per-type count, so persistence is a lookup."""
+
+    def __init__(self, types: Iterable[str] = (), window: int = PERSISTENCE_WINDOW):
+        self.types: Deque[str] = deque(maxlen=window)
+        self.counts: Dict[str, int] = {}
+        for t in types:
+            self.append(t)
+
+    def append(self, typ: str):
+        if len(self.types) == self.types.maxlen:
+            old = self.types[0]
+            self.counts[old] -= 1
+        self.types.append(typ)
+        self.counts[typ] = self.counts.get(typ, 0) + 1
+
+    def extend(self, types: Iterable[str]):
+        for t in types:
+            self.append(t)
+
+    def count(self, typ: str) -> int:
+        return self.counts.get(typ, 0)
+
+    def __iter__(self):
+        return iter(self.types)
+
+    def __len__(self):
+        return len(self.types)
+
+
+def anomaly_persistence(recent_types: List[str] | RecentTypes, typ: str, window: int = PERSISTENCE_WINDOW) -> str:
+    if isinstance(recent_types, RecentTypes):
+        n = recent_types.count(typ)
+    else:
+        n = sum(1 for t in recent_types[-window:] if t == typ)
+    if n >= 4:
+        return "established"
+    if n >= 2:
+        return "emerging"
+    return "transient"
+
+
+def drivers_for(sig: Dict[str, Any], phase: str):
+    drivers = []
+    agreements = 0
+    if phase != "normal":
+        drivers.append(f"holiday_phase:{phase}")
+        agreements += 1
+    if (sig.get("transport_stress") or 0) >= THRESHOLDS["transport_stress"]:
+        drivers.append("transport_disruption")
+        agreements += 1
+    if (sig.get("events_count") or 0) >= THRESHOLDS["events"]:
+        drivers.append("events")
+        agreements += 1
+    cond = sig.get("weather_condition")
+    if cond and str(cond).lower() in ("clear", "clouds"):
+        drivers.append("fair_weather")
+        agreements += 1
+    return drivers, agreements
+
+
+def make_anomaly(timestamp, ts, typ, severity, confidence, explanation, drivers, recent_types) -> Dict[str, Any]:
+    a = {
+        "timestamp": timestamp,
+        "ts": ts,
+        "type": typ,
+        "severity": severity,
+        "confidence": round(float(confidence), 2),
+        "persistence": anomaly_persistence(recent_types, typ),
+        "explanation": explanation,
+        "drivers": list(drivers),
+    }
+    recent_types.append(typ)
+    return a
+
+
+# ---------------- rules ----------------
+
+def detect(
+    *,
+    timestamp: str,
+    sig: Dict[str, Any],
+    phase: str,
+    b_avg: float,
+    b_std: float,
+    window: List[Tuple[int, float]],
+    recent_types: List[str] | RecentTypes,
+    ts: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Anomalies for one run. `window` holds the latest (epoch, busyness) runs,
+    current run last; `recent_types` the types of previously recorded anomalies
+    and is extended in place so persistence counts earlier hits of the same run.
+    """
+    out: List[Dict[str, Any]] = []
+    busyness = sig.get("busyness")
+    if not isinstance(busyness, (int, float)):
+        return out
+    if ts is None:
+        ts = epoch_of({"timestamp": timestamp})
+    z = (busyness - b_avg) / max(b_std, 1)
+    drivers, agreements = drivers_for(sig, phase)
+    penalties = 0
+
+    def add(typ, severity, confidence, explanation):
+        out.append(make_anomaly(timestamp, ts, typ, severity, confidence, explanation, drivers, recent_types))
+
+    # Demand anomalies
+    if z >= THRESHOLDS["z_peak"]:
+        sev = "high" if z >= THRESHOLDS["z_high"] else "medium"
+        add("unexpected_peak", sev, anomaly_confidence(0.58, agreements=agreements, penalties=penalties),
+            f"Demand is significantly above baseline for this hour (z≈{z:.1f}).")
+
+    if z <= -THRESHOLDS["z_peak"]:
+        sev = "high" if z <= -THRESHOLDS["z_high"] else "medium"
+        add("suppressed_demand", sev, anomaly_confidence(0.56, agreements=max(agreements-1, 0), penalties=penalties+1),
+            f"Demand is significantly below baseline for this hour (z≈{z:.1f}).")
+
+    runs = [(t, v) for t, v in window if t is not None and isinstance(v, (int, float))]
+    w_ts, w_val = [t for t, _ in runs], [v for _, v in runs]
+
+    # Prolonged peak: every run in each of the last N clock hours >= (baseline centre + spread);
+    # an hour without a run breaks the streak
+    n = THRESHOLDS["prolonged_hours"]
+    if runs:
+        low = recent_grid(w_ts, w_val, ts, n, agg="min")["value"]
+        if not np.isnan(low).any() and (low >= b_avg + b_std).all():
+            add("prolonged_peak", "medium", anomaly_confidence(0.62, agreements=agreements+1, penalties=penalties),
+                f"Demand has stayed elevated for the last {n} hours, longer than baseline norm.")
+
+    # Volatile demand: range of the runs in the last N clock hours is large; every hour needs a run
+    # and there must be history from before the window
+    n = THRESHOLDS["volatile_hours"]
+    if runs:
+        hi = recent_grid(w_ts, w_val, ts, n, agg="max")
+        lo = recent_grid(w_ts, w_val, ts, n, agg="min")["value"]
+        if (min(w_ts) < hi["ts"][0] and not np.isnan(lo).any()
+                and np.max(hi["value"]) - np.min(lo) >= THRESHOLDS["volatile_range"]):
+            add("volatile_demand", "low", anomaly_confidence(0.55, agreements=max(agreements-1, 0), penalties=penalties+1),
+                f"Demand fluctuated sharply within the last {n} hours.")
+
+    return out
+
+
+# ---------------- timing: daily peak tracker ----------------
+
+def _hour_dist(a: int, b: int) -> int:
+    d = abs(a - b) % 24
+    return min(d, 24 - d)
+
+
+def _fmt_hours(hours: List[int]) -> str:
+    return "/".join(f"{h:02d}:00" for h in hours)
+
+
+class PeakTracker:
+    """
+    Hourly maxima of the current day plus, per weekday (normal days) or holiday
+    phase, a decayed 24-bin histogram of peak hours and the decayed mean/var of
+    the daily peak level. A day is folded into the table when the next one
+    starts, so each run costs O(1) and the rollover O(24).
+    """
+
+    def __init__(self, half_life_days: float = HALF_LIFE_DAYS):
+        self.half_life_days = half_life_days
+        self.day: Optional[int] = None
+        self.key = "0"
+        self.hours: List[Optional[float]] = [None] * 24
+        self.missing_checked = False
+        self.table: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def key_for(ts: int, phase: str) -> str:
+        return str(day_of_week(ts)) if phase == "normal" else phase
+
+    def _row(self, key: str, day: int) -> Optional[Dict[str, Any]]:
+        """Table row decayed to `day` (not written back)."""
+        r = self.table.get(key)
+        if r is None:
+            return None
+        d = 0.5 ** (max(day - r["T"], 0) / self.half_life_days)
+        return {"H": [h * d for h in r["H"]], "W": r["W"] * d, "M": r["M"], "S": r["S"] * d}
+
+    def expected(self, key: str, day: int) -> Optional[Tuple[List[int], float, float]]:
+        """(usual peak hours, mean peak level, std) once the key has enough days."""
+        r = self._row(key, day)
+        if r is None or r["W"] < THRESHOLDS["peak_min_days"]:
+            return None
+        top = max(r["H"])
+        hours = [h for h in range(24) if r["H"][h] >= 0.5 * top]
+        return hours, r["M"], (max(r["S"], 0.0) / r["W"]) ** 0.5
+
+    @staticmethod
+    def peak_hours(hours: List[Optional[float]]) -> Tuple[List[int], float]:
+        """Hours within one point of the day's max (plateaus count as one peak)."""
+        top = max(v for v in hours if v is not None)
+        return [h for h, v in enumerate(hours) if v is not None and v >= top - 1], top
+
+    def _fold(self, day: int):
+        covered = sum(v is not None for v in self.hours)
+        if covered < THRESHOLDS["peak_min_hours"]:
+            return
+        peaks, top = self.peak_hours(self.hours)
+        r = self._row(self.key, day) or {"H": [0.0] * 24, "W": 0.0, "M": 0.0, "S": 0.0}
+        for h in peaks:
+            r["H"][h] += 1.0 / len(peaks)
+        W = r["W"] + 1.0
+        m_new = r["M"] + (top - r["M"]) / W
+        r["S"] += (top - r["M"]) * (top - m_new)
+        r["M"], r["W"], r["T"] = m_new, W, day
+        self.table[self.key] = r
+
+    def step(self, ts: int, busyness: float, phase: str) -> List[Tuple[str, str, float, str]]:
+        """Track one run; returns (type, severity, confidence, explanation) hits."""
+        hits = []
+        day, hour = ts // DAY, hour_of_day(ts)
+        if day != self.day:
+            if self.day is not None:
+                hits.extend(self._check_shift())
+                self._fold(self.day)
+            self.day, self.key = day, self.key_for(ts, phase)
+            self.hours = [None] * 24
+            self.missing_checked = False
+        if self.hours[hour] is None or busyness > self.hours[hour]:
+            self.hours[hour] = busyness
+        if not self.missing_checked:
+            hits.extend(self._check_missing(hour))
+        return hits
+
+    def _check_shift(self):
+        exp = self.expected(self.key, self.day)
+        if exp is None or sum(v is not None for v in self.hours) < THRESHOLDS["peak_min_hours"]:
+            return []
+        usual, _, _ = exp
+        peaks, top = self.peak_hours(self.hours)
+        shift = min(_hour_dist(a, u) for a in peaks for u in usual)
+        if shift < THRESHOLDS["peak_shift_hours"]:
+            return []
+        sev = "medium" if shift >= 2 * THRESHOLDS["peak_shift_hours"] else "low"
+        when = datetime.date.fromordinal(datetime.date(1970, 1, 1).toordinal() + self.day)
+        return [("shifted_peak", sev, anomaly_confidence(0.54, agreements=min(shift // 3, 3)),
+                 f"Peak on {when:%a %d %b} came at {_fmt_hours(peaks[:3])} UTC (busyness {top:.0f}); "
+                 f"usually around {_fmt_hours(usual[:3])}.")]
+
+    def _check_missing(self, hour: int):
+        exp = self.expected(self.key, self.day)
+        if exp is None:
+            return []
+        usual, level, std = exp
+        first = min(usual)
+        if hour < first + THRESHOLDS["peak_grace_hours"]:
+            return []
+        self.missing_checked = True
+        g = THRESHOLDS["peak_grace_hours"]
+        seen = [self.hours[h] for h in range(max(first - g, 0), min(max(usual) + g, 23) + 1)
+                if self.hours[h] is not None]
+        if len(seen) < 2:
+            return []
+        spread = max(std, 3.0)
+        drop = (level - max(seen)) / spread
+        if drop < THRESHOLDS["peak_drop_z"]:
+            return []
+        sev = "high" if drop >= THRESHOLDS["z_high"] else "medium"
+        return [("missing_peak", sev, anomaly_confidence(0.56, agreements=1 if drop >= 3 else 0),
+                 f"Usual {_fmt_hours(usual[:3])} UTC peak (≈{level:.0f}) did not materialise; "
+                 f"max so far {max(seen):.0f}.")]
+
+    def to_dict(self) -> Dict[str, Any]:
+        r = lambda xs: [round(x, 4) for x in xs]
+        return {
+            "half_life_days": self.half_life_days,
+            "day": self.day, "key": self.key, "hours": self.hours, "missing_checked": self.missing_checked,
+            "table": {k: {"H": r(v["H"]), "W": round(v["W"], 4), "M": round(v["M"], 4),
+                          "S": round(v["S"], 4), "T": v["T"]} for k, v in sorted(self.table.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "PeakTracker":
+        p = cls(float(d.get("half_life_days", HALF_LIFE_DAYS)))
+        p.day = d.get("day")
+        p.key = d.get("key", "0")
+        hours = d.get("hours") or []
+        p.hours = list(hours) if len(hours) == 24 else [None] * 24
+        p.missing_checked = bool(d.get("missing_checked"))
+        p.table = {k: dict(v) for k, v in (d.get("table") or {}).items()}
+        return p
+
+
+# ---------------- signal mismatch: online regression ----------------
+
+WET = ("rain", "drizzle", "thunderstorm", "snow")
+MISMATCH_FEATURES = ["bias", "transport", "events", "temperature", "wet"]
+_SIGNAL_OF = {"transport": "transport", "events": "event", "temperature": "weather", "wet": "weather"}
+
+
+def signal_features(sig: Dict[str, Any]) -> List[float]:
+    """Features measured from a neutral reference (no disruption, no events, 12°C, dry)."""
+    temp = sig.get("temperature_C")
+    cond = str(sig.get("weather_condition") or "").lower()
+    return [
+        1.0,
+        float(sig.get("transport_stress") or 0),
+        float(sig.get("events_count") or 0),
+        (float(temp) - 12.0) / 6.0 if isinstance(temp, (int, float)) else 0.0,
+        1.0 if cond in WET else 0.0,
+    ]
+
+
+class MismatchModel:
+    """
+    Recursive least squares (forgetting factor FORGET) of busyness minus the
+    seasonal baseline on signal_features(), plus an exponentially weighted
+    variance of its one-step residuals. Per run: one O(p^2) update, p = 5.
+    """
+
+    FORGET = 0.995
+    RESID_ALPHA = 0.02
+    P_INIT = 100.0
+    P_MAX = 1e4  # stop inflating P in directions the signals never excite
+
+    def __init__(self):
+        p = len(MISMATCH_FEATURES)
+        self.w = [0.0] * p
+        self.P = [[self.P_INIT if i == j else 0.0 for j in range(p)] for i in range(p)]
+        self.var: Optional[float] = None
+        self.n = 0
+        self.last_z: Optional[float] = None  # standardised residual of the latest run (before its update)
+
+    def contributions(self, x: List[float]) -> Dict[str, float]:
+        """Implied busyness effect per signal family (bias excluded)."""
+        out: Dict[str, float] = {}
+        for name, wi, xi in zip(MISMATCH_FEATURES[1:], self.w[1:], x[1:]):
+            sig = _SIGNAL_OF[name]
+            out[sig] = out.get(sig, 0.0) + wi * xi
+        return out
+
+    def predict(self, x: List[float]) -> float:
+        return sum(wi * xi for wi, xi in zip(self.w, x))
+
+    def update(self, x: List[float], y: float) -> float:
+        p = len(x)
+        Px = [sum(self.P[i][j] * x[j] for j in range(p)) for i in range(p)]
+        denom = self.FORGET + sum(x[i] * Px[i] for i in range(p))
+        k = [v / denom for v in Px]
+        e = y - self.predict(x)
+        self.w = [wi + ki * e for wi, ki in zip(self.w, k)]
+        inflate = max(self.P[i][i] for i in range(p)) < self.P_MAX
+        for i in range(p):
+            for j in range(p):
+                v = self.P[i][j] - k[i] * Px[j]
+                self.P[i][j] = v / self.FORGET if inflate else v
+        self.var = e * e if self.var is None else (1 - self.RESID_ALPHA) * self.var + self.RESID_ALPHA * e * e
+        self.n += 1
+        return e
+
+    def step(self, sig: Dict[str, Any], busyness: float, b_avg: float) -> List[Tuple[str, str, float, str]]:
+        x = signal_features(sig)
+        y = busyness - b_avg
+        hits = []
+        self.last_z = None
+        if self.n >= THRESHOLDS["mismatch_min_runs"] and self.var is not None:
+            r = y - self.predict(x)
+            sd = max(self.var ** 0.5, 2.0)
+            z = r / sd
+            self.last_z = z
+            if abs(z) >= THRESHOLDS["mismatch_z"]:
+                for sig_name, c in self.contributions(x).items():
+                    if abs(c) < THRESHOLDS["mismatch_effect"] or (c > 0) == (r > 0):
+                        continue
+                    sev = "medium" if abs(z) >= THRESHOLDS["z_high"] else "low"
+                    hits.append((f"{sig_name}_demand_mismatch", sev,
+                                 anomaly_confidence(0.52, agreements=min(int(abs(c) // 5), 3)),
+                                 f"{sig_name.capitalize()} signals imply {c:+.0f} busyness but demand is "
+                                 f"{abs(r):.0f} {'below' if r < 0 else 'above'} what the signals imply (z≈{z:.1f})."))
+        self.update(x, y)
+        return hits
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "features": MISMATCH_FEATURES,
+            "w": [round(v, 6) for v in self.w],
+            "P": [[round(v, 6) for v in row] for row in self.P],
+            "var": self.var,
+            "n": self.n,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "MismatchModel":
+        m = cls()
+        if d.get("features") == MISMATCH_FEATURES:
+            m.w = list(d["w"])
+            m.P = [list(row) for row in d["P"]]
+            m.var = d.get("var")
+            m.n = int(d.get("n", 0))
+        return m
+
+
+class RollingDetectors:
+    """Timing, mismatch and regime-shift state, advanced once per run (live pipeline and replays)."""
+
+    def __init__(self):
+        self.peaks = PeakTracker()
+        self.mismatch = MismatchModel()
+        self.regimes = RegimeShifts()
+        self.last_ts = 0
+
+    def step(
+        self,
+        *,
+        timestamp: str,
+        ts: int,
+        sig: Dict[str, Any],
+        phase: str,
+        b_avg: float,
+        recent_types: List[str] | RecentTypes,
+        b_std: Optional[float] = None,
+        emit: bool = True,
+    ) -> List[Dict[str, Any]]:
+        busyness = sig.get("busyness")
+        if ts <= self.last_ts or not isinstance(busyness, (int, float)):
+            return []  # already applied (re-runs, replays)
+        self.last_ts = ts
+        hits = self.peaks.step(ts, float(busyness), phase)
+        if not emit:
+            return []
+        hits += self.mismatch.step(sig, float(busyness), b_avg)
+        drivers, _ = drivers_for(sig, phase)
+        out = [make_anomaly(timestamp, ts, typ, sev, conf, expl, drivers, recent_types)
+               for typ, sev, conf, expl in hits]
+
+        spread = max(b_std, 1.0) if b_std is not None else None
+        z = {
+            "busyness": (float(busyness) - b_avg) / spread if spread is not None else None,
+            "residual": self.mismatch.last_z,
+        }
+        scale = {"busyness": spread or 1.0, "residual": max((self.mismatch.var or 0.0) ** 0.5, 2.0)}
+        for typ, sev, conf, expl, extra in self.regimes.step(ts, z, scale):
+            a = make_anomaly(timestamp, ts, typ, sev, clamp(conf, 0.40, 0.95), expl, drivers, recent_types)
+            a.update(extra)
+            out.append(a)
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rules_version": rules_version(),
+            "last_ts": self.last_ts,
+            "peaks": self.peaks.to_dict(),
+            "mismatch": self.mismatch.to_dict(),
+            "regimes": self.regimes.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RollingDetectors":
+        r = cls()
+        r.last_ts = int(d.get("last_ts", 0))
+        r.peaks = PeakTracker.from_dict(d.get("peaks") or {})
+        r.mismatch = MismatchModel.from_dict(d.get("mismatch") or {})
+        r.regimes = RegimeShifts.from_dict(d.get("regimes") or {})
+        return r
+
+    def save(self, path: str = STATE_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_detectors(path: str = STATE_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                   last_ts: Optional[int] = None) -> RollingDetectors:
+    """Load persisted state; if there is none (or the rules changed, or it has not seen `last_ts`,
+    the store's newest row), replay `bootstrap` rows once."""
+    d = codec.read(path)
+    if (isinstance(d, dict) and d.get("rules_version") == rules_version()
+            and int(d.get("last_ts") or 0) >= (last_ts or 0)):
+        return RollingDetectors.from_dict(d)
+    engine = AnomalyEngine()
+    if bootstrap is not None:
+        for _ in engine.run(bootstrap):
+            pass
+    return engine.rolling
+
+
+# ---------------- streaming engine ----------------
+
+def signals_of(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten an observation ({context, signals}) or a history row into one signal dict."""
+    if isinstance(rec.get("signals"), dict):
+        sig = dict(rec["signals"])
+        sig["holiday_phase"] = (rec.get("context") or {}).get("holiday_phase")
+    else:
+        sig = {
+            "busyness": rec.get("busyness"),
+            "transport_stress": rec.get("transport_stress"),
+            "events_count": rec.get("events_count"),
+            "temperature_C": rec.get("temperature"),
+            "weather_condition": rec.get("weather_condition"),
+            "holiday_phase": rec.get("holiday_phase"),
+        }
+    return sig
+
+
+def run_rules(
+    *,
+    timestamp: str,
+    ts: int,
+    sig: Dict[str, Any],
+    phase: str,
+    b_avg: float,
+    b_std: float,
+    level: str,
+    window: List[Tuple[int, float]],
+    rolling: RollingDetectors,
+    recent_types: List[str] | RecentTypes,
+) -> List[Dict[str, Any]]:
+    """
+    One run through every rule: the pipeline (live) and AnomalyEngine (backfill)
+    both call this, so a replay of the same rows gives the same anomalies.
+    While the baseline is still at its "default" level (warm-up) nothing is
+    compared against it; the rolling detectors only track peaks.
+    """
+    if level == "default":
+        rolling.step(timestamp=timestamp, ts=ts, sig=sig, phase=phase, b_avg=b_avg,
+                     recent_types=recent_types, emit=False)
+        return []
+    found = detect(timestamp=timestamp, sig=sig, phase=phase, b_avg=b_avg, b_std=b_std,
+                   window=window, recent_types=recent_types, ts=ts)
+    found += rolling.step(timestamp=timestamp, ts=ts, sig=sig, phase=phase, b_avg=b_avg,
+                          b_std=b_std, recent_types=recent_types)
+    return found
+
+
+class AnomalyEngine:
+    """Rolling state for replaying the rules over a log in one pass."""
+
+    def __init__(self, baseline: Optional[SeasonalBaseline] = None):
+        self.baseline = baseline or SeasonalBaseline()
+        self.rolling = RollingDetectors()
+        self.window: Deque[Tuple[int, float]] = deque(maxlen=WINDOW)
+        self.recent = RecentTypes()
+
+    def step(self, rec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        ts = epoch_of(rec)
+        sig = signals_of(rec)
+        busyness = sig.get("busyness")
+        if ts is None or not isinstance(busyness, (int, float)):
+            return []
+        phase = sig.get("holiday_phase") or "normal"
+        b_avg, b_std, level = self.baseline.robust(ts, phase)
+        self.window.append((ts, busyness))
+        found = run_rules(timestamp=rec.get("timestamp") or iso(ts), ts=ts, sig=sig, phase=phase,
+                          b_avg=b_avg, b_std=b_std, level=level, window=list(self.window),
+                          rolling=self.rolling, recent_types=self.recent)
+        self.baseline.update(ts, float(busyness), phase)
+        return found
+
+    def run(self, rows: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        for rec in rows:
+            yield from self.step(rec)
+
+
+def backfill(rows: Iterable[Dict[str, Any]], out_dir: Optional[str] = None, source: str = "observations") -> Dict[str, Any]:
+    """Replay `rows` through the rules and write a versioned anomaly set."""
+    version = rules_version()
+    out_dir = out_dir or os.path.join(SETS_DIR, version, source)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "anomalies.jsonl")
+
+    engine = AnomalyEngine()
+    n_rows = 0
+    n_anoms = 0
+    by_type: Dict[str, int] = {}
+    first = last = None
+
+    def counted(rows):
+        nonlocal n_rows, first, last
+        for r in rows:
+            n_rows += 1
+            ts = epoch_of(r)
+            if ts is not None:
+                first = ts if first is None else first
+                last = ts
+            yield r
+
+    episodes = EpisodeLog()
+    with open(path + ".tmp", "wb") as f:
+        for a in engine.run(counted(rows)):
+            f.write(codec.dumps(a))
+            f.write(b"\n")
+            n_anoms += 1
+            by_type[a["type"]] = by_type.get(a["type"], 0) + 1
+            episodes.add(a)
+    os.replace(path + ".tmp", path)
+    episodes.save(os.path.join(out_dir, "episodes.json"))
+
+    manifest = {
+        "version": version,
+        "rules_version": RULES_VERSION,
+        "thresholds": THRESHOLDS,
+        "source": source,
+        "generated_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "rows_replayed": n_rows,
+        "range": {"start": iso(first) if first else None, "end": iso(last) if last else None},
+        "anomalies": n_anoms,
+        "episodes": len(episodes),
+        "by_type": dict(sorted(by_type.items(), key=lambda kv: -kv[1])),
+        "file": os.path.basename(path),
+    }
+    codec.write(os.path.join(out_dir, "manifest.json"), manifest)
+    return manifest
@@ -0,0 +1,177 @@
+"""
+Secondary indexes and counters over the anomaly store, maintained on write.
+
+data/store/anomalies/index.json holds
+- cube        rollup over CUBE_DIMS (type x severity x persistence x London local
+              hour x local day of week x holiday phase) with confidence moments per cell; the
+              phase is the one the rules saw (the anomaly's holiday_phase driver),
+              else the Europe/London calendar's (kx.calendar_table)
+- drivers     driver -> n
+- types       type -> last TYPE_TAIL [seq, ts] pairs (seq = position in the log)
+- recent      the last PERSISTENCE_WINDOW types, for persistence lookups
+plus the log's size and time range. Everything is updated in O(1) per anomaly,
+so the pipeline's persistence checks and breakdowns and the insights job are
+lookups / cube projections instead of scans; a missing or outdated index is
+rebuilt from the store in one pass.
+"""
+
+from __future__ import annotations
+import os, sys
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import codec
+from . import calendar_table as cal
+from .anomaly import RecentTypes, anomaly_persistence
+from .paths import STORE_DIR
+from .rollup import Cube
+from .timeutil import epoch_of, iso
+
+INDEX_FILE = os.path.join(STORE_DIR, "anomalies", "index.json")
+VERSION = 5
+CUBE_DIMS = ("type", "severity", "persistence", "hour", "dow", "holiday_phase")
+TYPE_TAIL = 256
+PHASE_DRIVER = "holiday_phase:"
+
+
+def phase_of(a: Dict[str, Any], ts: int) -> str:
+    """Holiday phase the anomaly was detected under (drivers_for() names any non-normal one)."""
+    if a.get("holiday_phase"):
+        return a["holiday_phase"]
+    for d in a.get("drivers") or []:
+        if isinstance(d, str) and d.startswith(PHASE_DRIVER):
+            return d[len(PHASE_DRIVER):]
+    return cal.phase(ts)
+
+
+def run_key(a: Dict[str, Any]) -> str:
+    """What tells two anomalies of one run apart: the type, plus the stream for regime shifts
+    (kx.changepoint emits one per stream, and both can fire on the same run)."""
+    typ = a.get("type")
+    return f"{typ}:{a['stream']}" if a.get("stream") else typ
+
+
+class AnomalyIndex:
+    def __init__(self):
+        self.n = 0
+        self.first_ts: Optional[int] = None
+        self.last_ts: Optional[int] = None
+        self.last_keys: List[str] = []  # run_key()s already indexed at last_ts (re-run guard)
+        self.cube = Cube(CUBE_DIMS)
+        self.drivers: Dict[str, int] = {}
+        self.types: Dict[str, List[List[int]]] = {}
+        self.recent = RecentTypes()
+
+    # ---------------- update ----------------
+
+    def add(self, a: Dict[str, Any]) -> bool:
+        ts = epoch_of(a)
+        typ = a.get("type")
+        if ts is None or not typ:
+            return False
+        rk = run_key(a)
+        if self.last_ts is not None and (ts < self.last_ts or (ts == self.last_ts and rk in self.last_keys)):
+            return False  # already indexed
+        if ts != self.last_ts:
+            self.last_keys = []
+        self.last_keys.append(rk)
+
+        key = (typ, a.get("severity") or "unknown", a.get("persistence") or "unknown",
+               cal.local_hour(ts), cal.local_dow(ts), phase_of(a, ts))
+        self.cube.add(key, a.get("confidence"))
+        for d in a.get("drivers") or []:
+            self.drivers[d] = self.drivers.get(d, 0) + 1
+        tail = self.types.setdefault(typ, [])
+        tail.append([self.n, ts])
+        del tail[:-TYPE_TAIL]
+        self.recent.append(typ)
+
+        self.n += 1
+        self.first_ts = ts if self.first_ts is None else self.first_ts
+        self.last_ts = ts
+        return True
+
+    def add_many(self, anomalies: Iterable[Dict[str, Any]]) -> int:
+        return sum(self.add(a) for a in anomalies)
+
+    # ---------------- lookups ----------------
+
+    def recent_types(self) -> RecentTypes:
+        """A copy of the persistence window, safe for detect() to extend."""
+        return RecentTypes(self.recent)
+
+    def persistence(self, typ: str) -> str:
+        return anomaly_persistence(self.recent, typ)
+
+    def breakdown(self, field: str = "type", top: Optional[int] = None, where: Optional[Dict[str, Any]] = None) -> Dict[Any, int]:
+        """value -> count for "driver" or any cube dimension, most frequent first."""
+        if field == "driver":
+            items = sorted(self.drivers.items(), key=lambda kv: -kv[1])
+        else:
+            items = list(self.cube.counts(field, where).items())
+        return dict(items[:top] if top else items)
+
+    def hour_counts(self, typ: Optional[str] = None) -> List[int]:
+        c = self.cube.counts("hour", {"type": typ} if typ else None)
+        return [c.get(h, 0) for h in range(24)]
+
+    def confidence(self, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.cube.moments(where)
+
+    def last_of_type(self, typ: str, n: int = 1) -> List[int]:
+        """Timestamps of the last n anomalies of a type (n <= TYPE_TAIL)."""
+        return [ts for _, ts in self.types.get(typ, [])[-n:]]
+
+    def date_range(self) -> Dict[str, Optional[str]]:
+        return {
+            "start": iso(self.first_ts) if self.first_ts is not None else None,
+            "end": iso(self.last_ts) if self.last_ts is not None else None,
+        }
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": VERSION,
+            "n": self.n,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "last_keys": self.last_keys,
+            "cube": self.cube.to_dict(),
+            "drivers": self.drivers,
+            "types": self.types,
+            "recent": list(self.recent),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "AnomalyIndex":
+        ix = cls()
+        ix.n = int(d.get("n", 0))
+        ix.first_ts = d.get("first_ts")
+        ix.last_ts = d.get("last_ts")
+        ix.last_keys = list(d.get("last_keys") or [])
+        ix.cube = Cube.from_dict(d.get("cube") or {"dims": CUBE_DIMS})
+        ix.drivers = dict(d.get("drivers") or {})
+        ix.types = {k: [list(p) for p in v] for k, v in (d.get("types") or {}).items()}
+        ix.recent = RecentTypes(d.get("recent") or [])
+        return ix
+
+    def save(self, path: str = INDEX_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_anomaly_index(path: str = INDEX_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                       last_ts: Optional[int] = None) -> AnomalyIndex:
+    """Load the index; if there is none (or it has not seen `last_ts`, the store's newest anomaly),
+    build it from `bootstrap` anomalies (one pass)."""
+    d = codec.read(path)
+    if isinstance(d, dict) and d.get("version") == VERSION and int(d.get("last_ts") or 0) >= (last_ts or 0):
+        return AnomalyIndex.from_dict(d)
+    ix = AnomalyIndex()
+    if bootstrap is not None:
+        rows = 0
+        for a in bootstrap:
+            ix.add(a)
+            rows += epoch_of(a) is not None and bool(a.get("type"))
+        if ix.n != rows:
+            print(f"⚠️ Anomaly index: {ix.n} of {rows} store anomalies indexed (duplicate run keys?)", file=sys.stderr)
+    return ix
@@ -0,0 +1,320 @@
+"""
+Rolling-origin backtest of the busyness forecasters.
+
+Every history run (or every n-th, --every) is a forecast origin. Each model
+is fitted on rows up to and including the origin only, forecasts the next
+`horizon` hours, and is scored against the runs that land within +-30 min of
+each target hour:
+- heuristic       update_pipeline.py: mean / pstdev of the last 600 runs + rush + phase uplift
+                  (the venue lunch signature is not in history, so it is left out)
+- ridge           train_and_forecast.py: ridge on the calendar features, bands from the residual std
+- holt_winters    train_and_forecast.py --model holt_winters: double-seasonal exponential smoothing,
+                  stepped through the runs in order (one O(1) update per run)
+- analog          kx.analogs: k nearest past situations (trailing-day profile + conditions), only
+                  analogs and outcomes before the origin; the standardisation is refitted on the
+                  states before the origin every ANALOG_REFIT_HOURS
+- moving_average  forecast_busyness.py: mean of the last 6 runs (+8 busy events, +5 warm), flat
+- random_forest   scripts/predict/train_model.py: RandomForest on weather / TfL / events (scikit-learn,
+                  refitted daily), flat; P10 / P90 from the spread of the trees
+
+Scores per model, by horizon bucket (kx.intervals.STEP_EDGES) and holiday phase
+of the target: MAE, RMSE and pinball loss averaged over P10 / P50 / P90 (the
+band's low / point / high). Models without their own band get +-1.2816 x the
+recent std, i.e. a Gaussian 80% band.
+
+Origins are split into contiguous folds that run in a process pool; ridge and
+the heuristic refit in O(1) per origin from prefix sums.
+
+    python -m kx backtest --horizon 24 --workers 4
+"""
+
+from __future__ import annotations
+import os, datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import codec
+from . import calendar_table as cal
+from . import forecast as forecast_engine
+from .analogs import AnalogIndex, hourly_grid
+from .columns import columns
+from .holtwinters import HoltWinters
+from .intervals import N_STEPS, QUANTILES, step_bucket, step_label
+from .paths import DATA_DIR
+from .timeutil import HOUR, PHASES, iso
+
+REPORT_FILE = os.path.join(DATA_DIR, "backtest_report.json")
+MODEL_NAMES = ("heuristic", "ridge", "holt_winters", "analog", "moving_average", "random_forest")
+FIELDS = ("busyness", "temperature", "transport_stress", "events_count")
+MIN_TRAIN_HOURS = 48
+MATCH_TOLERANCE = HOUR // 2
+Z90 = 1.2816  # P90 of a standard normal
+
+HEURISTIC_WINDOW = 600  # update_pipeline.HISTORY_LIMIT
+RIDGE_LAMBDA = 0.35
+MA_WINDOW = 6
+RF_TREES = 50
+RF_REFIT_HOURS = 24
+ANALOG_REFIT_HOURS = 24
+
+
+def load_history(source: str = "history", lo: Optional[int] = None, hi: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Runs with a busyness value; missing exogenous inputs fall back to the scripts' defaults."""
+    cols = columns(source, list(FIELDS), lo, hi)
+    ok = ~np.isnan(cols["busyness"])
+    d = {k: v[ok] for k, v in cols.items()}
+    d["temperature"] = np.where(np.isnan(d["temperature"]), 10.0, d["temperature"])
+    d["transport_stress"] = np.nan_to_num(d["transport_stress"])
+    d["events_count"] = np.nan_to_num(d["events_count"])
+    return d
+
+
+# ---------------- models ----------------
+# forecast(i, hours) -> (point, low, high) for ts[i] + 1..hours h, using rows <= i only
+
+def _arrays(fc: Dict[str, Any]):
+    point = np.asarray(fc.get("point", fc["busyness"]), dtype=float)
+    return point, np.asarray(fc["low"], dtype=float), np.asarray(fc["high"], dtype=float)
+
+
+class _Heuristic:
+    def __init__(self, d):
+        self.ts = d["ts"]
+        y = d["busyness"]
+        self.cs = np.concatenate([[0.0], np.cumsum(y)])
+        self.css = np.concatenate([[0.0], np.cumsum(y * y)])
+
+    def forecast(self, i: int, hours: int):
+        lo = max(0, i + 1 - HEURISTIC_WINDOW)
+        n = i + 1 - lo
+        avg = (self.cs[i + 1] - self.cs[lo]) / n
+        std = np.sqrt(max((self.css[i + 1] - self.css[lo]) / n - avg * avg, 0.0)) if n > 1 else 10.0
+        conf = "medium" if n >= 10 else "low"
+        return _arrays(forecast_engine.heuristic_forecast(int(self.ts[i]), avg, std, confidence=conf, hours=hours))
+
+
+class _Ridge:
+    def __init__(self, d):
+        self.d = d
+        X = forecast_engine.feature_matrix(d["ts"], d["temperature"], 10.0, d["transport_stress"], d["events_count"])
+        y = d["busyness"]
+        # prefix sums of X'X, X'y, y'y: fitting on rows <= i is one lookup + a 10x10 solve
+        self.XtX = np.cumsum(X[:, :, None] * X[:, None, :], axis=0)
+        self.Xty = np.cumsum(X * y[:, None], axis=0)
+        self.yty = np.cumsum(y * y)
+        self.m = X.shape[1]
+
+    def forecast(self, i: int, hours: int):
+        d, n = self.d, i + 1
+        if n >= 24:
+            XtX, Xty = self.XtX[i], self.Xty[i]
+            w = np.linalg.solve(XtX + RIDGE_LAMBDA * np.eye(self.m), Xty)
+            ssr = max(self.yty[i] - 2 * w @ Xty + w @ XtX @ w, 0.0)
+            mean = (Xty[0] - w @ XtX[0]) / n
+            resid_std = float(np.clip(np.sqrt(max(ssr / n - mean * mean, 0.0)), 6.0, 18.0))
+        else:
+            w = np.r_[48.0, np.zeros(self.m - 1)]
+            resid_std = 12.0
+        conf = "high" if n >= 7 * 24 else "medium" if n >= 24 else "low"
+        exog = {"temp": d["temperature"][i], "wind": 10.0,
+                "transport": d["transport_stress"][i], "events": d["events_count"][i]}
+        return _arrays(forecast_engine.ridge_forecast(int(d["ts"][i]), w, resid_std, exog, conf, hours=hours))
+
+
+class _HoltWinters:
+    def __init__(self, d):
+        self.d = d
+        self.hw = HoltWinters()
+        self.next = 0  # first row not yet applied
+
+    def forecast(self, i: int, hours: int):
+        d = self.d
+        for j in range(self.next, i + 1):
+            self.hw.update(int(d["ts"][j]), float(d["busyness"][j]))
+        self.next = max(self.next, i + 1)
+        return _arrays(self.hw.forecast(int(d["ts"][i]), hours=hours))
+
+
+class _Analog:
+    def __init__(self, d):
+        self.d = d
+        self.index = AnalogIndex(hourly_grid(d), fit_before=0)
+        self.h0 = int(self.index.grid["ts"][0] // HOUR)
+
+    def forecast(self, i: int, hours: int):
+        ts = int(self.d["ts"][i])
+        t = ts // HOUR - self.h0
+        fitted = self.index.fitted_before
+        if not fitted or not fitted <= t + 1 < fitted + ANALOG_REFIT_HOURS:
+            self.index.fit(t + 1)  # scaling from states up to the origin only (folds may run out of order)
+        fc = self.index.forecast(t, hours, now_ts=ts, before=t + 1)
+        if fc is None:
+            point = np.full(hours, float(self.d["busyness"][i]))
+            return point, point, point
+        return _arrays(fc)
+
+
+class _MovingAverage:
+    def __init__(self, d):
+        self.d = d
+
+    def forecast(self, i: int, hours: int):
+        d = self.d
+        s = slice(max(0, i + 1 - MA_WINDOW), i + 1)
+        spread = float(np.std(d["busyness"][max(0, i + 1 - 24):i + 1]))
+        return _arrays(forecast_engine.moving_average_forecast(
+            int(d["ts"][i]), d["busyness"][s], d["events_count"][s], d["temperature"][s], spread, hours))
+
+
+class _RandomForest:
+    def __init__(self, d):
+        from sklearn.ensemble import RandomForestRegressor  # optional dependency
+        self.make = lambda: RandomForestRegressor(n_estimators=RF_TREES, random_state=42, n_jobs=1)
+        self.d = d
+        # train_model.py columns: temp_C, wind_kmh, tfl_issues, event_count, avg_place_rating
+        n = len(d["ts"])
+        self.X = np.column_stack([d["temperature"], np.zeros(n), d["transport_stress"] / 8.0,
+                                  d["events_count"], np.full(n, 4.0)])
+        self.trees = None  # per-tree predictions for the rows until the next refit
+        self.lo = self.hi = 0
+
+    def forecast(self, i: int, hours: int):
+        d = self.d
+        if self.trees is None or not self.lo <= i < self.hi:
+            ts = int(d["ts"][i])
+            model = self.make().fit(self.X[:i + 1], d["busyness"][:i + 1])
+            self.lo = i
+            self.hi = max(int(np.searchsorted(d["ts"], ts + RF_REFIT_HOURS * HOUR)), i + 1)
+            self.trees = np.stack([t.predict(self.X[self.lo:self.hi]) for t in model.estimators_], axis=1)
+        trees = self.trees[i - self.lo]
+        p10, p90 = np.percentile(trees, [QUANTILES[0] * 100, QUANTILES[2] * 100])
+        return np.full(hours, trees.mean()), np.full(hours, p10), np.full(hours, p90)
+
+
+MODELS = {
+    "heuristic": _Heuristic,
+    "ridge": _Ridge,
+    "holt_winters": _HoltWinters,
+    "analog": _Analog,
+    "moving_average": _MovingAverage,
+    "random_forest": _RandomForest,
+}
+
+
+def available_models(names: Sequence[str] = MODEL_NAMES) -> List[str]:
+    out = []
+    for name in names:
+        if name == "random_forest":
+            try:
+                import sklearn  # noqa: F401
+            except ImportError:
+                print("⚠️ scikit-learn not installed; skipping random_forest")
+                continue
+        out.append(name)
+    return out
+
+
+# ---------------- scoring ----------------
+
+def _pinball(y, f, q):
+    e = y - f
+    return np.maximum(q * e, (q - 1) * e)
+
+
+_STATE: Dict[str, Any] = {}
+
+
+def _init(d: Dict[str, np.ndarray], names: Sequence[str], hours: int):
+    _STATE["d"] = d
+    _STATE["hours"] = hours
+    _STATE["models"] = {name: MODELS[name](d) for name in names}
+
+
+def _run_fold(origins: Sequence[int]) -> Dict[str, np.ndarray]:
+    """Sums [n, |e|, e^2, pinball] per (step, phase) cell for each model over these origins."""
+    d, hours = _STATE["d"], _STATE["hours"]
+    ts, y = d["ts"], d["busyness"]
+    size = hours * len(PHASES)
+    out = {name: np.zeros((4, size)) for name in _STATE["models"]}
+    steps = np.arange(hours)
+    for i in origins:
+        target = int(ts[i]) + HOUR * (steps + 1)
+        j = np.clip(np.searchsorted(ts, target), 1, len(ts) - 1)
+        j = np.where(np.abs(ts[j - 1] - target) <= np.abs(ts[j] - target), j - 1, j)
+        ok = (np.abs(ts[j] - target) <= MATCH_TOLERANCE) & (j > i)
+        if not ok.any():
+            continue
+        actual = y[j[ok]]
+        key = steps[ok] * len(PHASES) + cal.rows(target[ok])["phase"]
+        for name, model in _STATE["models"].items():
+            point, low, high = model.forecast(i, hours)
+            point, low, high = point[ok], low[ok], high[ok]
+            e = actual - point
+            pin = (_pinball(actual, low, QUANTILES[0]) + _pinball(actual, point, QUANTILES[1])
+                   + _pinball(actual, high, QUANTILES[2])) / 3
+            acc = out[name]
+            acc[0] += np.bincount(key, minlength=size)
+            acc[1] += np.bincount(key, weights=np.abs(e), minlength=size)
+            acc[2] += np.bincount(key, weights=e * e, minlength=size)
+            acc[3] += np.bincount(key, weights=pin, minlength=size)
+    return out
+
+
+def _scores(acc: np.ndarray) -> Dict[str, Any]:
+    n = acc[0].sum()
+    if not n:
+        return {"n": 0, "mae": None, "rmse": None, "pinball": None}
+    return {
+        "n": int(n),
+        "mae": round(float(acc[1].sum() / n), 3),
+        "rmse": round(float(np.sqrt(acc[2].sum() / n)), 3),
+        "pinball": round(float(acc[3].sum() / n), 3),
+    }
+
+
+def _summary(acc: np.ndarray, hours: int) -> Dict[str, Any]:
+    cells = acc.reshape(4, hours, len(PHASES))
+    buckets = np.array([step_bucket(s + 1) for s in range(hours)])
+    by_h = [dict(steps=step_label(b), **_scores(cells[:, buckets == b].reshape(4, -1)))
+            for b in range(N_STEPS) if (buckets == b).any()]
+    by_p = {p: _scores(cells[:, :, k]) for k, p in enumerate(PHASES) if cells[0, :, k].sum()}
+    return {"overall": _scores(acc), "by_horizon": [r for r in by_h if r["n"]], "by_phase": by_p}
+
+
+def backtest(d: Dict[str, np.ndarray], names: Sequence[str] = MODEL_NAMES, hours: int = 24, every: int = 1,
+             workers: Optional[int] = None, folds_per_worker: int = 4) -> Dict[str, Any]:
+    ts = d["ts"]
+    origins = [i for i in range(0, len(ts), max(every, 1))
+               if len(ts) and ts[i] - ts[0] >= MIN_TRAIN_HOURS * HOUR]
+    workers = max(1, workers or os.cpu_count() or 1)
+    n_folds = max(1, min(len(origins), workers * folds_per_worker))
+    folds = [f.tolist() for f in np.array_split(np.asarray(origins, dtype=int), n_folds) if len(f)]
+
+    if workers == 1:
+        _init(d, names, hours)
+        parts = [_run_fold(f) for f in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(d, names, hours)) as ex:
+            parts = list(ex.map(_run_fold, folds))
+
+    size = hours * len(PHASES)
+    total = {name: sum((p[name] for p in parts), np.zeros((4, size))) for name in names}
+    models = {name: _summary(total[name], hours) for name in names}
+    ranking = sorted((n for n in names if models[n]["overall"]["n"]), key=lambda n: models[n]["overall"]["mae"])
+    return {
+        "generated_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "horizon": hours,
+        "origins": len(origins),
+        "folds": len(folds),
+        "range": {"start": iso(int(ts[0])) if len(ts) else None, "end": iso(int(ts[-1])) if len(ts) else None},
+        "quantiles": list(QUANTILES),
+        "ranking": ranking,
+        "models": models,
+    }
+
+
+def write_report(report: Dict[str, Any], path: str = REPORT_FILE) -> str:
+    codec.write(path, report)
+    return path
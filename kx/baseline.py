@@ -0,0 +1,206 @@
+"""
+Seasonal baseline engine: hour-of-week x holiday-phase buckets with exponential decay.
+Hours are London local (kx.calendar_table), like the holiday phase and rush hours.
+
+State (data/models/seasonal_baseline.json) is a handful of flat arrays:
+- how_phase   168 x K buckets (K = len(PHASES))
+- hod          24 buckets (hour of day, all phases)
+- glob          1 bucket
+each holding a decayed weight W, mean M and sum of squares S plus the time of
+the last update. Weights halve every HALF_LIFE_DAYS, so old seasons fade
+instead of being cut off at a fixed row count.
+
+Each non-empty bucket also carries a decayed t-digest (kx.sketch) so robust()
+can return median / MAD-based spread and percentile() arbitrary quantiles.
+
+stats() / robust() walk how_phase -> hod -> global and use the first bucket
+with at least MIN_WEIGHT of effective samples. update() touches three buckets
+(plus amortised O(log k) digest merges).
+"""
+
+from __future__ import annotations
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import codec
+from . import calendar_table as cal
+from .paths import MODELS_DIR
+from .sketch import TDigest, MAD_TO_STD
+from .timeutil import DAY, PHASES, holiday_phase, epoch_of
+
+BASELINE_FILE = os.path.join(MODELS_DIR, "seasonal_baseline.json")
+VERSION = 3
+
+HALF_LIFE_DAYS = 28.0
+MIN_WEIGHT = 4.0
+DEFAULT_MEAN = 55.0
+DEFAULT_STD = 10.0
+
+
+def _phase_idx(phase: Optional[str]) -> int:
+    try:
+        return PHASES.index(phase)
+    except ValueError:
+        return 0
+
+
+class _Buckets:
+    def __init__(self, n: int, half_life: float):
+        self.half_life = half_life
+        self.W = [0.0] * n
+        self.M = [0.0] * n
+        self.S = [0.0] * n
+        self.T = [0] * n
+        self.Q: Dict[int, TDigest] = {}  # sparse: only buckets that have seen data
+
+    def digest(self, i: int) -> TDigest:
+        if i not in self.Q:
+            self.Q[i] = TDigest(half_life=self.half_life)
+        return self.Q[i]
+
+    def update(self, i: int, x: float, ts: int, half_life: float):
+        self.digest(i).add(x, ts)
+        if self.W[i] > 0:
+            d = 0.5 ** (max(ts - self.T[i], 0) / half_life)
+        else:
+            d = 0.0
+        W = self.W[i] * d + 1.0
+        m_old = self.M[i]
+        m_new = m_old + (x - m_old) / W
+        self.S[i] = self.S[i] * d + (x - m_old) * (x - m_new)
+        self.M[i] = m_new
+        self.W[i] = W
+        self.T[i] = ts
+
+    def weight(self, i: int, ts: int, half_life: float) -> float:
+        if self.W[i] <= 0:
+            return 0.0
+        return self.W[i] * 0.5 ** (max(ts - self.T[i], 0) / half_life)
+
+    def std(self, i: int) -> float:
+        return (max(self.S[i], 0.0) / self.W[i]) ** 0.5 if self.W[i] > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        r = lambda xs: [round(x, 4) for x in xs]
+        return {
+            "W": r(self.W), "M": r(self.M), "S": r(self.S), "T": self.T,
+            "Q": {str(i): q.to_dict() for i, q in sorted(self.Q.items()) if len(q)},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], n: int, half_life: float) -> "_Buckets":
+        b = cls(n, half_life)
+        if d and len(d.get("W", [])) == n:
+            b.W, b.M, b.S, b.T = list(d["W"]), list(d["M"]), list(d["S"]), list(d["T"])
+            b.Q = {int(i): TDigest.from_dict(q, half_life=half_life) for i, q in (d.get("Q") or {}).items()}
+        return b
+
+
+class SeasonalBaseline:
+    def __init__(self, half_life_days: float = HALF_LIFE_DAYS):
+        self.half_life = half_life_days * DAY
+        self.how_phase = _Buckets(168 * len(PHASES), self.half_life)
+        self.hod = _Buckets(24, self.half_life)
+        self.glob = _Buckets(1, self.half_life)
+        self.last_ts = 0
+
+    # ---------------- update ----------------
+
+    def update(self, ts: int, value: float, phase: Optional[str] = None):
+        if ts <= self.last_ts:
+            return  # already applied (re-runs, replays)
+        if phase is None:
+            phase = holiday_phase(ts)
+        k = cal.local_hour_of_week(ts) * len(PHASES) + _phase_idx(phase)
+        self.how_phase.update(k, value, ts, self.half_life)
+        self.hod.update(cal.local_hour(ts), value, ts, self.half_life)
+        self.glob.update(0, value, ts, self.half_life)
+        self.last_ts = ts
+
+    def update_many(self, rows: Iterable[Dict[str, Any]], key: str = "busyness"):
+        for r in rows:
+            v = r.get(key)
+            ts = epoch_of(r)
+            if ts is None or not isinstance(v, (int, float)):
+                continue
+            self.update(ts, float(v), r.get("holiday_phase"))
+
+    # ---------------- read ----------------
+
+    def _bucket(self, ts: int, phase: Optional[str]):
+        """(level, buckets, index) of the most specific bucket with enough weight."""
+        if phase is None:
+            phase = holiday_phase(ts)
+        levels = (
+            ("hour_of_week", self.how_phase, cal.local_hour_of_week(ts) * len(PHASES) + _phase_idx(phase)),
+            ("hour_of_day", self.hod, cal.local_hour(ts)),
+            ("global", self.glob, 0),
+        )
+        for name, b, i in levels:
+            if b.weight(i, ts, self.half_life) >= MIN_WEIGHT:
+                return name, b, i
+        if self.glob.W[0] > 1:
+            return "global", self.glob, 0
+        return "default", None, None
+
+    def stats(self, ts: int, phase: Optional[str] = None) -> Tuple[float, float, str]:
+        """(mean, std, level) of the decayed moments."""
+        name, b, i = self._bucket(ts, phase)
+        if b is None:
+            return DEFAULT_MEAN, DEFAULT_STD, name
+        return b.M[i], b.std(i), name
+
+    def robust(self, ts: int, phase: Optional[str] = None) -> Tuple[float, float, str]:
+        """(median, 1.4826 * MAD, level) from the bucket's t-digest."""
+        name, b, i = self._bucket(ts, phase)
+        q = b.Q.get(i) if b is not None else None
+        if q is None or not len(q):
+            mean, std, name = self.stats(ts, phase)
+            return mean, std, name
+        return q.median(), MAD_TO_STD * q.mad(), name
+
+    def percentile(self, ts: int, p: float, phase: Optional[str] = None) -> Optional[float]:
+        name, b, i = self._bucket(ts, phase)
+        q = b.Q.get(i) if b is not None else None
+        return q.quantile(p / 100.0) if q is not None else None
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": VERSION,
+            "phases": PHASES,
+            "half_life_days": self.half_life / DAY,
+            "last_ts": self.last_ts,
+            "how_phase": self.how_phase.to_dict(),
+            "hod": self.hod.to_dict(),
+            "global": self.glob.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "SeasonalBaseline":
+        b = cls(float(d.get("half_life_days", HALF_LIFE_DAYS)))
+        if d.get("phases") != PHASES:
+            return b
+        b.last_ts = int(d.get("last_ts", 0))
+        b.how_phase = _Buckets.from_dict(d.get("how_phase"), 168 * len(PHASES), b.half_life)
+        b.hod = _Buckets.from_dict(d.get("hod"), 24, b.half_life)
+        b.glob = _Buckets.from_dict(d.get("global"), 1, b.half_life)
+        return b
+
+    def save(self, path: str = BASELINE_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_baseline(path: str = BASELINE_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                  last_ts: Optional[int] = None) -> SeasonalBaseline:
+    """Load persisted state; if there is none (or it has not seen `last_ts`, the store's newest row),
+    replay `bootstrap` rows (one pass)."""
+    d = codec.read(path)
+    if (isinstance(d, dict) and d.get("phases") == PHASES and d.get("version") == VERSION
+            and int(d.get("last_ts") or 0) >= (last_ts or 0)):
+        return SeasonalBaseline.from_dict(d)
+    b = SeasonalBaseline()
+    if bootstrap is not None:
+        b.update_many(bootstrap)
+    return b
@@ -0,0 +1,269 @@
+"""
+Precomputed per-hour calendar for Kings Cross (Europe/London).
+
+One row per UTC hour from START_YEAR to END_YEAR (inclusive), 8 bytes each:
+
+    local_hour      0-23 in Europe/London (BST-aware)
+    local_dow       Mon = 0, local date
+    dst             1 while British Summer Time is in force
+    bank_holiday    England & Wales bank holidays, incl. substitutes and one-offs
+    school_holiday  London (Camden) state-school holidays, approximated by rule
+    phase           index into PHASES (holiday_phase of the local date)
+    day_of_season   days from 25 Dec of the season (season = year of its December)
+
+The table is written once to data/models/calendar_v<N>.npy (~1 MB, derived and
+not committed) and memory-mapped, so a feature lookup is an index
+(ts - START) // HOUR instead of a timezone conversion and a rule chain.
+Hours outside the table are computed on the fly with the same rules.
+
+    from kx import calendar_table as cal
+    cal.local_hour(ts), cal.local_hour_of_week(ts), cal.rush_hour(ts), cal.phase(ts)
+    cal.rows(ts_array)["school_holiday"]        # vectorised
+"""
+
+from __future__ import annotations
+import os, datetime
+from functools import lru_cache
+from typing import Dict, Optional, Set
+
+import numpy as np
+
+from .paths import MODELS_DIR
+from .timeutil import HOUR, UTC, PHASES, epoch, phase_of
+
+try:
+    from zoneinfo import ZoneInfo
+    LONDON = ZoneInfo("Europe/London")
+except Exception:  # no tz database: fall back to the fixed EU rule below
+    LONDON = None
+
+VERSION = 1
+START_YEAR = 2020
+END_YEAR = 2035
+CALENDAR_FILE = os.path.join(MODELS_DIR, f"calendar_v{VERSION}.npy")
+
+RUSH_HOURS = frozenset((7, 8, 9, 10, 16, 17, 18, 19))  # local time
+
+DTYPE = np.dtype([
+    ("local_hour", "u1"),
+    ("local_dow", "u1"),
+    ("dst", "u1"),
+    ("bank_holiday", "u1"),
+    ("school_holiday", "u1"),
+    ("phase", "u1"),
+    ("day_of_season", "i2"),
+])
+
+START = epoch(datetime.datetime(START_YEAR, 1, 1))
+END = epoch(datetime.datetime(END_YEAR + 1, 1, 1))
+N_HOURS = (END - START) // HOUR
+
+
+# ---------------- rules ----------------
+
+def easter(year: int) -> datetime.date:
+    """Western Easter Sunday (anonymous Gregorian algorithm)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return datetime.date(year, month, day)
+
+
+def _first_monday(year: int, month: int) -> datetime.date:
+    d = datetime.date(year, month, 1)
+    return d + datetime.timedelta(days=(7 - d.weekday()) % 7)
+
+
+def _last_monday(year: int, month: int) -> datetime.date:
+    nxt = datetime.date(year + (month == 12), month % 12 + 1, 1)
+    d = nxt - datetime.timedelta(days=1)
+    return d - datetime.timedelta(days=d.weekday())
+
+
+# one-off moves and extra days announced by proclamation
+_MOVED = {
+    datetime.date(2020, 5, 4): datetime.date(2020, 5, 8),    # VE Day
+    datetime.date(2022, 5, 30): datetime.date(2022, 6, 2),   # Platinum Jubilee
+}
+_EXTRA = {
+    datetime.date(2022, 6, 3),    # Platinum Jubilee
+    datetime.date(2022, 9, 19),   # State funeral
+    datetime.date(2023, 5, 8),    # Coronation
+}
+
+
+@lru_cache(maxsize=64)
+def bank_holidays(year: int) -> Set[datetime.date]:
+    """England & Wales bank holidays, with weekend substitutes."""
+    days = set()
+    nyd = datetime.date(year, 1, 1)
+    days.add(nyd + datetime.timedelta(days={5: 2, 6: 1}.get(nyd.weekday(), 0)))
+    e = easter(year)
+    days.add(e - datetime.timedelta(days=2))
+    days.add(e + datetime.timedelta(days=1))
+    days.add(_first_monday(year, 5))
+    days.add(_last_monday(year, 5))
+    days.add(_last_monday(year, 8))
+    xmas = datetime.date(year, 12, 25)
+    # Christmas / Boxing Day falling on a weekend move to the next free weekdays
+    if xmas.weekday() == 5:      # Sat -> Mon 27, Tue 28
+        days.update({xmas + datetime.timedelta(days=2), xmas + datetime.timedelta(days=3)})
+    elif xmas.weekday() == 6:    # Sun -> Mon 26 (Boxing), Tue 27
+        days.update({xmas + datetime.timedelta(days=1), xmas + datetime.timedelta(days=2)})
+    elif xmas.weekday() == 4:    # Fri, Boxing Day Sat -> Mon 28
+        days.update({xmas, xmas + datetime.timedelta(days=3)})
+    else:
+        days.update({xmas, xmas + datetime.timedelta(days=1)})
+    days = {_MOVED.get(d, d) for d in days}
+    days.update(d for d in _EXTRA if d.year == year)
+    return days
+
+
+def _week_around(monday: datetime.date):
+    # Saturday before .. Sunday after a Mon-Fri half-term week
+    return monday - datetime.timedelta(days=2), monday + datetime.timedelta(days=6)
+
+
+@lru_cache(maxsize=64)
+def school_holidays(year: int):
+    """(start, end) date ranges, inclusive. Rules approximate Camden's published dates."""
+    e = easter(year)
+    feb = datetime.date(year, 2, 12)
+    feb += datetime.timedelta(days=(7 - feb.weekday()) % 7)    # Monday in 12-18 Feb
+    return [
+        (datetime.date(year, 1, 1), datetime.date(year, 1, 3)),
+        _week_around(feb),
+        (e - datetime.timedelta(days=9), e + datetime.timedelta(days=8)),
+        _week_around(_last_monday(year, 5)),
+        (datetime.date(year, 7, 22), datetime.date(year, 8, 31)),
+        _week_around(_last_monday(year, 10)),
+        (datetime.date(year, 12, 20), datetime.date(year, 12, 31)),
+    ]
+
+
+def is_school_holiday_date(d: datetime.date) -> bool:
+    return any(a <= d <= b for a, b in school_holidays(d.year))
+
+
+def _london(ts: int) -> datetime.datetime:
+    if LONDON is not None:
+        return datetime.datetime.fromtimestamp(ts, LONDON)
+    # EU rule: BST from 01:00 UTC on the last Sunday of March to 01:00 UTC on the last Sunday of October
+    u = datetime.datetime.fromtimestamp(ts, UTC)
+    last_sun = lambda m: max(datetime.date(u.year, m, d) for d in range(25, 32)
+                             if datetime.date(u.year, m, d).weekday() == 6)
+    on = epoch(datetime.datetime.combine(last_sun(3), datetime.time(1)))
+    off = epoch(datetime.datetime.combine(last_sun(10), datetime.time(1)))
+    return u + datetime.timedelta(hours=1) if on <= ts < off else u
+
+
+def compute_row(ts: int) -> tuple:
+    loc = _london(ts)
+    d = loc.date()
+    season = d.year if d.month >= 7 else d.year - 1
+    return (
+        loc.hour,
+        d.weekday(),
+        1 if loc.utcoffset() else 0,
+        1 if d in bank_holidays(d.year) else 0,
+        1 if is_school_holiday_date(d) else 0,
+        PHASES.index(phase_of(d.month, d.day)),
+        (d - datetime.date(season, 12, 25)).days,
+    )
+
+
+# ---------------- table ----------------
+
+def build_calendar() -> np.ndarray:
+    return np.array([compute_row(START + i * HOUR) for i in range(N_HOURS)], dtype=DTYPE)
+
+
+_TABLE: Optional[np.ndarray] = None
+
+
+def table(path: str = CALENDAR_FILE) -> np.ndarray:
+    """The memory-mapped table, built and saved on first use."""
+    global _TABLE
+    if _TABLE is None:
+        t = None
+        if os.path.exists(path):
+            try:
+                t = np.load(path, mmap_mode="r")
+            except (OSError, ValueError):
+                t = None
+        if t is None or t.dtype != DTYPE or len(t) != N_HOURS:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.save(path, build_calendar())
+            t = np.load(path, mmap_mode="r")
+        _TABLE = t
+    return _TABLE
+
+
+def row(ts: int):
+    i = (int(ts) - START) // HOUR
+    if 0 <= i < N_HOURS:
+        return table()[i]
+    return np.array(compute_row(int(ts)), dtype=DTYPE)[()]
+
+
+def rows(ts: np.ndarray) -> np.ndarray:
+    """Vectorised lookup; hours outside the table are computed individually."""
+    ts = np.asarray(ts, dtype=np.int64)
+    i = (ts - START) // HOUR
+    inside = (i >= 0) & (i < N_HOURS)
+    out = np.empty(len(ts), dtype=DTYPE)
+    out[inside] = table()[i[inside]]
+    for k in np.where(~inside)[0]:
+        out[k] = compute_row(int(ts[k]))
+    return out
+
+
+def local_hour(ts: int) -> int:
+    return int(row(ts)["local_hour"])
+
+
+def local_dow(ts: int) -> int:
+    return int(row(ts)["local_dow"])
+
+
+def local_hour_of_week(ts: int) -> int:
+    """Mon 00:00 London = 0 .. Sun 23:00 = 167 (the local counterpart of timeutil.hour_of_week)."""
+    r = row(ts)
+    return int(r["local_dow"]) * 24 + int(r["local_hour"])
+
+
+def is_dst(ts: int) -> bool:
+    return bool(row(ts)["dst"])
+
+
+def is_bank_holiday(ts: int) -> bool:
+    return bool(row(ts)["bank_holiday"])
+
+
+def is_school_holiday(ts: int) -> bool:
+    return bool(row(ts)["school_holiday"])
+
+
+def phase(ts: int) -> str:
+    return PHASES[int(row(ts)["phase"])]
+
+
+def day_of_season(ts: int) -> int:
+    return int(row(ts)["day_of_season"])
+
+
+def rush_hour(ts: int) -> bool:
+    """Morning 7-10 / evening 16-19, London local time."""
+    return int(row(ts)["local_hour"]) in RUSH_HOURS
+
+
+def features(ts: int) -> Dict[str, int]:
+    r = row(ts)
+    return {name: int(r[name]) for name in DTYPE.names}
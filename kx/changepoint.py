@@ -0,0 +1,228 @@
+"""
+Streaming change-point detection for regime shifts (start of Christmas trading,
+the post-NYE collapse, a long line closure).
+
+Each stream is a standardised series, one value per run:
+- "busyness": (busyness - seasonal baseline median) / baseline robust std
+- "residual": the signal-mismatch regression's one-step residual / its std
+(the second one shifts when demand stops following the transport / weather /
+event signals the way it used to). Neither is unit-variance in practice
+(busyness saturates at 100, the MAD of a quiet bucket is tiny), so each stream
+is rescaled by its own decayed mean absolute value and clipped at +-CLIP_Z
+before it reaches the detectors.
+
+Two detectors run side by side on every stream:
+- Cusum: two-sided Page CUSUM, S+ = max(0, S+ + z - k), S- likewise. An
+  alarm at S > h dates the change to the run after the statistic last left 0.
+- Bocpd: Bayesian online change-point detection (Adams & MacKay) with a
+  Gaussian mean of known unit variance per segment and a constant hazard.
+  The run-length distribution is truncated at MAX_RUN (mass of longer runs is
+  folded into the last bin), so the state is a few fixed-size vectors. A change
+  is declared when the most likely run length drops from >= MIN_RUN to a
+  handful of runs and the segment mean moved by MIN_SHIFT or more; the start
+  is the run that many steps back.
+
+RegimeShifts keeps one of each per stream, a cooldown per stream, and returns
+(type, severity, confidence, explanation, extra) hits for kx.anomaly.
+State is bounded (~2 * MAX_RUN floats per stream) and lives in anomaly_state.json.
+"""
+
+from __future__ import annotations
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .timeutil import HOUR, iso
+
+CUSUM_K = 1.0          # allowance, in std's (detects shifts of ~2k)
+CUSUM_H = 20.0         # alarm level; runs are hourly and autocorrelated, so well above the textbook 4-5
+HAZARD = 1.0 / 3000    # prior probability of a change at any run
+PRIOR_VAR = 1.0        # prior variance of a segment's mean (std units)
+MAX_RUN = 120          # run-length truncation (runs)
+MIN_RUN = 24           # a regime must have lasted this long before a change is declared
+NEW_RUN = 6            # ... and the most likely run length must now be below this
+MIN_SHIFT = 1.5        # ... and the segment mean must have moved this much (std's)
+SCALE_HALF_LIFE = 24 * 14  # runs
+WARMUP = 24            # runs used only to learn a stream's scale
+COOLDOWN = 24 * HOUR   # one regime_shift per stream per day at most
+CLIP_Z = 4.0
+
+STREAMS = ("busyness", "residual")
+
+
+class Cusum:
+    def __init__(self, k: float = CUSUM_K, h: float = CUSUM_H):
+        self.k, self.h = k, h
+        self.pos = self.neg = 0.0
+        self.n_pos = self.n_neg = 0          # runs since each side last left zero
+        self.start_pos = self.start_neg = 0  # ts of the first of those runs
+
+    def step(self, ts: int, z: float) -> Optional[Tuple[int, float]]:
+        """(start ts, mean shift in std's) on an alarm, else None; the alarmed side restarts."""
+        if self.pos == 0.0:
+            self.start_pos, self.n_pos = ts, 0
+        if self.neg == 0.0:
+            self.start_neg, self.n_neg = ts, 0
+        self.pos = max(0.0, self.pos + z - self.k)
+        self.neg = max(0.0, self.neg - z - self.k)
+        self.n_pos = self.n_pos + 1 if self.pos > 0 else 0
+        self.n_neg = self.n_neg + 1 if self.neg > 0 else 0
+        if self.pos > self.h:
+            hit = (self.start_pos, self.k + self.pos / self.n_pos)
+            self.pos, self.n_pos = 0.0, 0
+            return hit
+        if self.neg > self.h:
+            hit = (self.start_neg, -(self.k + self.neg / self.n_neg))
+            self.neg, self.n_neg = 0.0, 0
+            return hit
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"pos": round(self.pos, 4), "neg": round(self.neg, 4), "n_pos": self.n_pos, "n_neg": self.n_neg,
+                "start_pos": self.start_pos, "start_neg": self.start_neg}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Cusum":
+        c = cls()
+        c.pos, c.neg = float(d.get("pos", 0.0)), float(d.get("neg", 0.0))
+        c.n_pos, c.n_neg = int(d.get("n_pos", 0)), int(d.get("n_neg", 0))
+        c.start_pos, c.start_neg = int(d.get("start_pos", 0)), int(d.get("start_neg", 0))
+        return c
+
+
+class Bocpd:
+    """Run-length posterior p(r), with the posterior mean / variance of the segment mean per run length."""
+
+    def __init__(self, max_run: int = MAX_RUN):
+        self.max_run = max_run
+        self.p = np.array([1.0])
+        self.mean = np.array([0.0])
+        self.var = np.array([PRIOR_VAR])
+        self.ts: List[int] = []   # timestamps of the last max_run runs (run length -> start)
+        self.map_run = 0
+        self.map_mean = 0.0
+
+    def step(self, ts: int, z: float) -> Optional[Tuple[int, float, float]]:
+        """(start ts, change of the mean in std's, P(change within NEW_RUN runs)) when a change is declared."""
+        pred_var = self.var + 1.0
+        like = np.exp(-0.5 * (z - self.mean) ** 2 / pred_var) / np.sqrt(2 * np.pi * pred_var)
+        growth = self.p * like * (1 - HAZARD)
+        cp = float((self.p * like).sum() * HAZARD)
+
+        post_var = 1.0 / (1.0 / self.var + 1.0)
+        post_mean = post_var * (self.mean / self.var + z)
+        p = np.concatenate([[cp], growth])
+        mean = np.concatenate([[0.0], post_mean])
+        var = np.concatenate([[PRIOR_VAR], post_var])
+        if len(p) > self.max_run:
+            # fold the longest runs into the last bin (keep the stats of the heavier one)
+            keep = -1 if p[-1] >= p[-2] else -2
+            mean[-2], var[-2] = mean[keep], var[keep]
+            p[-2] += p[-1]
+            p, mean, var = p[:-1], mean[:-1], var[:-1]
+        total = p.sum()
+        self.p = p / total if total > 0 else np.eye(len(p))[0]
+        self.mean, self.var = mean, var
+
+        self.ts.append(ts)
+        del self.ts[:-self.max_run]
+        prev, prev_mean = self.map_run, self.map_mean
+        self.map_run = r = int(np.argmax(self.p))
+        self.map_mean = float(self.mean[r])
+        if prev >= MIN_RUN and r < NEW_RUN and abs(self.map_mean - prev_mean) >= MIN_SHIFT:
+            start = self.ts[-(r + 1)] if r + 1 <= len(self.ts) else self.ts[0]
+            return start, self.map_mean - prev_mean, float(self.p[:NEW_RUN].sum())
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        r = lambda xs: [round(float(x), 6) for x in xs]
+        return {"p": r(self.p), "mean": r(self.mean), "var": r(self.var), "ts": self.ts,
+                "map_run": self.map_run, "map_mean": round(self.map_mean, 4)}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Bocpd":
+        b = cls()
+        p, mean, var = d.get("p") or [], d.get("mean") or [], d.get("var") or []
+        if p and len(p) == len(mean) == len(var) <= b.max_run:
+            b.p, b.mean, b.var = np.asarray(p, dtype=float), np.asarray(mean, dtype=float), np.asarray(var, dtype=float)
+        b.ts = [int(t) for t in (d.get("ts") or [])][-b.max_run:]
+        b.map_run = int(d.get("map_run", 0))
+        b.map_mean = float(d.get("map_mean", 0.0))
+        return b
+
+
+class RegimeShifts:
+    """Cusum + Bocpd per stream; step() returns regime_shift hits for kx.anomaly."""
+
+    def __init__(self):
+        self.cusum = {s: Cusum() for s in STREAMS}
+        self.bocpd = {s: Bocpd() for s in STREAMS}
+        self.scale = {s: 1.0 for s in STREAMS}  # decayed mean |z|
+        self.n = {s: 0 for s in STREAMS}
+        self.last_emit = {s: 0 for s in STREAMS}
+
+    def _standardise(self, s: str, v: float) -> Optional[float]:
+        sd = max(1.25 * self.scale[s], 0.1)  # mean |x| -> std for a normal
+        self.n[s] += 1
+        if self.n[s] == 1:
+            self.scale[s] = abs(v)
+        else:
+            d = 0.5 ** (1 / SCALE_HALF_LIFE)
+            self.scale[s] = d * self.scale[s] + (1 - d) * min(abs(v), 5 * sd)
+        if self.n[s] <= WARMUP:
+            return None
+        return max(-CLIP_Z, min(CLIP_Z, v / sd))
+
+    def step(self, ts: int, z: Dict[str, Optional[float]], scale: Dict[str, float]) -> List[Tuple[str, str, float, str, Dict[str, Any]]]:
+        """z: standardised value per stream (None = no data this run); scale: busyness points per std."""
+        hits = []
+        for s in STREAMS:
+            v = z.get(s)
+            if v is None or not math.isfinite(v):
+                continue
+            sd = max(1.25 * self.scale[s], 0.1)
+            v = self._standardise(s, v)
+            if v is None:
+                continue
+            c = self.cusum[s].step(ts, v)
+            b = self.bocpd[s].step(ts, v)
+            if (c is None and b is None) or ts - self.last_emit[s] < COOLDOWN:
+                continue
+            self.last_emit[s] = ts
+            detectors = [name for name, hit in (("cusum", c), ("bocpd", b)) if hit is not None]
+            start = min(h[0] for h in (c, b) if h is not None)
+            shift = (c[1] if c is not None else b[1]) * sd * scale.get(s, 1.0)
+            hits.append((s, start, shift, detectors, b[2] if b is not None else None))
+        return [self._hit(ts, *h) for h in hits]
+
+    @staticmethod
+    def _hit(ts, stream, start, shift, detectors, prob):
+        agree = len(detectors) == 2
+        direction = "up" if shift > 0 else "down"
+        what = "Demand level" if stream == "busyness" else "Demand vs. signals"
+        since = max((ts - start) / HOUR, 0)
+        expl = (f"{what} shifted {direction} by ~{abs(shift):.0f} points since {iso(start)} "
+                f"(~{since:.0f}h ago; {' + '.join(d.upper() for d in detectors)}).")
+        extra = {"stream": stream, "regime_start": iso(start), "regime_start_ts": int(start),
+                 "shift": round(float(shift), 1), "detectors": detectors}
+        if prob is not None:
+            extra["change_prob"] = round(prob, 2)
+        sev = "medium" if agree or abs(shift) >= 15 else "low"
+        return "regime_shift", sev, 0.5 + 0.1 * agree + 0.05 * min(abs(shift) // 10, 3), expl, extra
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {s: {"cusum": self.cusum[s].to_dict(), "bocpd": self.bocpd[s].to_dict(), "scale": round(self.scale[s], 4),
+                    "n": self.n[s], "last_emit": self.last_emit[s]} for s in STREAMS}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RegimeShifts":
+        r = cls()
+        for s in STREAMS:
+            st = d.get(s) or {}
+            r.cusum[s] = Cusum.from_dict(st.get("cusum") or {})
+            r.bocpd[s] = Bocpd.from_dict(st.get("bocpd") or {})
+            r.scale[s] = float(st.get("scale", 1.0))
+            r.n[s] = int(st.get("n", 0))
+            r.last_emit[s] = int(st.get("last_emit", 0))
+        return r
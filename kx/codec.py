@@ -0,0 +1,158 @@
+"""
+JSON codec used by every read/write helper in the pipeline.
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+Set KX_JSON_BACKEND=json to force the stdlib (e.g. when debugging or benchmarking).
+
+Output policy per artifact: large machine-read logs are written compact,
+small human-inspected files (dashboard, forecast, insights, models) stay
+indented with 2 spaces. Both backends write UTF-8 without ASCII escaping and
+write NaN / +-inf as null (the stdlib would emit bare NaN / Infinity, which is
+not JSON and breaks the page's JSON.parse), so they produce the same *values*
+for the same object. The bytes can still differ in float formatting (orjson
+writes 1e20 where the stdlib writes 1e+20), so do not compare files bytewise.
+"""
+
+from __future__ import annotations
+import os, sys, json, math, time, statistics
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None and os.getenv("KX_JSON_BACKEND", "") != "json" else "json"
+
+# Basenames of artifacts that are written compact. Everything under data/store/ is compact too.
+COMPACT_ARTIFACTS = {
+    "kingscross_history.json",
+    "signals_history.json",
+    "observations.json",
+    "anomalies.json",
+    "anomaly_episodes.json",
+    "forecast_168h.json",
+    "forecast_residuals.json",
+    "decomposition.json",
+    "seasonal_baseline.json",
+}
+
+
+def _default(o: Any):
+    # numpy / pandas scalars and arrays
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _finite(o: Any) -> Any:
+    """Copy of o with non-finite floats as None (what orjson writes for them)."""
+    if isinstance(o, float):
+        return o if math.isfinite(o) else None
+    if isinstance(o, dict):
+        return {k: _finite(v) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [_finite(v) for v in o]
+    if hasattr(o, "tolist") and not isinstance(o, (int, str)):
+        return _finite(o.tolist())
+    return o
+
+
+def _json_dumps(obj: Any, **kw) -> str:
+    try:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, default=_default, **kw)
+    except ValueError:  # NaN / inf somewhere: normalise (rare, so the common path stays one pass)
+        return json.dumps(_finite(obj), ensure_ascii=False, allow_nan=False, default=_default, **kw)
+
+
+def loads(data: Any) -> Any:
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    if BACKEND == "orjson":
+        opts = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            opts |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default, option=opts)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits – let the stdlib handle it
+    if pretty:
+        txt = _json_dumps(obj, indent=2)
+    else:
+        txt = _json_dumps(obj, separators=(",", ":"))
+    return txt.encode("utf-8")
+
+
+def is_pretty(path: str) -> bool:
+    p = str(path).replace(os.sep, "/")
+    if "/store/" in p or p.startswith("store/"):
+        return False
+    return os.path.basename(p) not in COMPACT_ARTIFACTS
+
+
+def read(path: str, default: Any = None) -> Any:
+    """Parse a JSON file; a missing or empty file gives `default`. A file that does not
+    decode also gives `default` but is reported on stderr, so a corrupt state file is not
+    mistaken for a missing one; other I/O errors (permissions, a directory) raise."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return default
+    if not data.strip():
+        return default
+    try:
+        return loads(data)
+    except ValueError as e:  # JSON / UTF-8 decode errors (both backends)
+        print(f"⚠️ {path}: not valid JSON ({e}); treating it as missing", file=sys.stderr)
+        return default
+
+
+def write(path: str, obj: Any, pretty: Optional[bool] = None):
+    if pretty is None:
+        pretty = is_pretty(path)
+    d = os.path.dirname(str(path))
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(dumps(obj, pretty=pretty))
+
+
+# ======================================================
+# BENCHMARK  (python -m kx bench-codec)
+# ======================================================
+
+def _time(fn, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return statistics.median(runs) * 1000.0
+
+
+def benchmark(paths: List[str], repeat: int = 5) -> List[Dict[str, Any]]:
+    """Median load/dump times (ms) per file for the stdlib and, if installed, orjson."""
+    rows = []
+    for p in paths:
+        with open(p, "rb") as f:
+            raw = f.read()
+        obj = json.loads(raw)
+        row: Dict[str, Any] = {"file": p, "kb": round(len(raw) / 1024, 1)}
+        row["json_load"] = _time(lambda: json.loads(raw), repeat)
+        row["json_dump_pretty"] = _time(lambda: json.dumps(obj, indent=2, ensure_ascii=False), repeat)
+        row["json_dump_compact"] = _time(lambda: json.dumps(obj, ensure_ascii=False, separators=(",", ":")), repeat)
+        if orjson is not None:
+            row["orjson_load"] = _time(lambda: orjson.loads(raw), repeat)
+            row["orjson_dump_pretty"] = _time(lambda: orjson.dumps(obj, option=orjson.OPT_INDENT_2), repeat)
+            row["orjson_dump_compact"] = _time(lambda: orjson.dumps(obj), repeat)
+        rows.append(row)
+    return rows
@@ -0,0 +1,81 @@
+"""
+Columnar view of the segment stores for vectorised analysis (NumPy).
+
+columns(name, fields) returns {"ts": int64[n], field: float64[n], ...} over the
+whole store (or the months overlapping [lo, hi)). Dotted fields reach into
+nested records ("signals.busyness"); missing or non-numeric values are NaN.
+
+Closed months (archived, no open segments) never change, so their columns are
+cached as data/store/<name>/columns/YYYY-MM.npz and later scans only parse the
+current month's JSON. The cache is derived data and is not committed.
+"""
+
+from __future__ import annotations
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .store import SegmentStore, open_store
+from .timeutil import epoch_of, iso
+
+
+def _get(rec, path: List[str]) -> float:
+    cur = rec
+    for k in path:
+        cur = cur.get(k) if isinstance(cur, dict) else None
+    return float(cur) if isinstance(cur, (int, float)) and not isinstance(cur, bool) else np.nan
+
+
+def _parse_month(store: SegmentStore, month: str, fields: Sequence[str]) -> Dict[str, np.ndarray]:
+    paths = [f.split(".") for f in fields]
+    ts: List[int] = []
+    cols: List[List[float]] = [[] for _ in fields]
+    for rec in store.iter_month(month):
+        t = epoch_of(rec)
+        if t is None:
+            continue
+        ts.append(t)
+        for c, p in zip(cols, paths):
+            c.append(_get(rec, p))
+    out = {"ts": np.asarray(ts, dtype=np.int64)}
+    for f, c in zip(fields, cols):
+        out[f] = np.asarray(c, dtype=np.float64)
+    order = np.argsort(out["ts"], kind="stable")
+    return {k: v[order] for k, v in out.items()}
+
+
+def month_columns(store: SegmentStore, month: str, fields: Sequence[str]) -> Dict[str, np.ndarray]:
+    arc = os.path.join(store.arc_dir, f"{month}.jsonl")
+    closed = os.path.exists(arc) and not store._segment_files(month)
+    cache = os.path.join(store.root, "columns", f"{month}.npz")
+    if closed and os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(arc):
+        with np.load(cache) as z:
+            if all(f in z.files for f in fields):
+                return {k: z[k] for k in ["ts", *fields]}
+    cols = _parse_month(store, month, fields)
+    if closed:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        np.savez(cache, **cols)
+    return cols
+
+
+def columns(name: str, fields: Sequence[str] = (), lo: Optional[int] = None, hi: Optional[int] = None) -> Dict[str, np.ndarray]:
+    store = open_store(name)
+    lo_m = iso(lo)[:7] if lo is not None else None
+    hi_m = iso(hi)[:7] if hi is not None else None
+    parts = [month_columns(store, m, fields) for m in store.months()
+             if (lo_m is None or m >= lo_m) and (hi_m is None or m <= hi_m)]
+    if not parts:
+        out = {"ts": np.zeros(0, dtype=np.int64)}
+        out.update({f: np.zeros(0) for f in fields})
+        return out
+    out = {k: np.concatenate([p[k] for p in parts]) for k in ["ts", *fields]}
+    if lo is not None or hi is not None:
+        m = np.ones(len(out["ts"]), dtype=bool)
+        if lo is not None:
+            m &= out["ts"] >= lo
+        if hi is not None:
+            m &= out["ts"] < hi
+        out = {k: v[m] for k, v in out.items()}
+    return out
@@ -0,0 +1,207 @@
+"""
+Batch seasonal decomposition of the busyness series (STL-style, additive):
+
+    busyness = trend + daily + weekly + residual
+
+on an hourly UTC grid (kx.resample; runs averaged per hour, hours without a run are gaps).
+All passes are whole-array NumPy:
+1. trend     centred 2x168 moving average (168 points plus half-weighted
+             ends, via cumulative sums; it cancels both the daily and the
+             weekly cycle), shrinking to a symmetric odd window at the edges
+2. seasonal  the detrended series is laid out as weeks x 168 hours and every
+             hour-of-week column (one value per week) is smoothed across
+             neighbouring weeks with a tricube kernel (loess-style cycle
+             subseries), so the weekly shape can drift through the year
+3. daily     each week's 168-hour profile averaged by hour of day; weekly is
+             the rest of the seasonal profile
+4. gaps are refilled with trend + seasonal and steps 1-3 repeat (ITERATIONS)
+The FFT of the gap-filled, detrended series gives the dominant periods.
+
+A year of hourly data takes a few milliseconds. The artifact
+(data/decomposition.json, compact) holds the components as hourly arrays from
+start_ts (NaN -> null in the residual), the latest daily / weekly profiles,
+component strengths and the spectrum peaks. The workflow refreshes it once a
+day; the pipeline publishes expected() for the current hour (trend + seasonal,
+and the run's deviation from it) as the dashboard's "seasonal" block:
+
+    python -m kx decompose
+    python -m kx decompose --source observations --from 2026-01-01
+"""
+
+from __future__ import annotations
+import os, datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from . import codec
+from .columns import columns
+from .paths import DATA_DIR
+from .resample import to_grid
+from .seasons import SOURCE_FIELDS
+from .timeutil import HOUR, hour_of_week, iso
+
+DECOMPOSITION_FILE = os.path.join(DATA_DIR, "decomposition.json")
+VERSION = 1
+
+TREND_HOURS = 168
+SEASON_WEEKS = 4     # kernel half-width across weeks for the seasonal subseries
+ITERATIONS = 2
+TOP_PERIODS = 5
+
+
+# ---------------- smoothers ----------------
+
+def _moving_average(x: np.ndarray, width: int) -> np.ndarray:
+    """Centred moving average; an even width is the 2 x width MA (width - 1 points
+    plus half weights on the two ends). Where the full window does not fit it
+    shrinks to a symmetric odd window."""
+    n = len(x)
+    cs = np.concatenate([[0.0], np.cumsum(x)])
+    i = np.arange(n)
+    h = width // 2
+    half = np.minimum(np.minimum(h, i), n - 1 - i)
+    out = (cs[i + half + 1] - cs[i - half]) / (2 * half + 1)
+    if width % 2 == 0 and n > width:
+        j = np.arange(h, n - h)
+        inner = cs[j + h] - cs[j - h + 1]
+        out[j] = (inner + 0.5 * (x[j - h] + x[j + h])) / width
+    return out
+
+
+def _subseries(m: np.ndarray, w: np.ndarray, half: int) -> np.ndarray:
+    """Tricube-weighted smoothing down axis 0 (weeks) of a weeks x slots matrix; w = observation weights."""
+    num = np.zeros_like(m)
+    den = np.zeros_like(m)
+    mv = np.where(w > 0, m, 0.0)
+    for k in range(-half, half + 1):
+        kw = (1 - (abs(k) / (half + 1)) ** 3) ** 3
+        lo, hi = max(k, 0), len(m) + min(k, 0)
+        num[lo - k:hi - k] += kw * (mv * w)[lo:hi]
+        den[lo - k:hi - k] += kw * w[lo:hi]
+    col = (mv * w).sum(axis=0) / np.maximum(w.sum(axis=0), 1e-12)  # slots never seen in the window
+    return np.where(den > 0, num / np.maximum(den, 1e-12), col)
+
+
+def _strength(component: np.ndarray, resid: np.ndarray) -> float:
+    """1 - var(R) / var(C + R), clipped to [0, 1] (Wang, Smith & Hyndman)."""
+    ok = ~np.isnan(resid)
+    if ok.sum() < 2:
+        return 0.0
+    v = np.var(component[ok] + resid[ok])
+    return float(np.clip(1 - np.var(resid[ok]) / v, 0, 1)) if v > 0 else 0.0
+
+
+# ---------------- decomposition ----------------
+
+def decompose(ts: np.ndarray, y: np.ndarray) -> Dict[str, np.ndarray]:
+    """Components of an hourly grid (ts, y with NaN gaps)."""
+    n = len(y)
+    obs = ~np.isnan(y)
+    idx = np.arange(n)
+    yf = np.interp(idx, idx[obs], y[obs])  # first pass: straight lines across gaps
+    off = hour_of_week(int(ts[0]))
+    weeks = -(-(off + n) // 168)
+    w = np.zeros(weeks * 168)
+    w[off:off + n] = obs
+
+    seasonal = np.zeros(n)
+    for _ in range(ITERATIONS):
+        trend = _moving_average(yf - seasonal, TREND_HOURS)
+        detr = np.zeros(weeks * 168)
+        detr[off:off + n] = yf - trend
+        prof = _subseries(detr.reshape(weeks, 168), w.reshape(weeks, 168), SEASON_WEEKS)
+        prof -= prof.mean(axis=1, keepdims=True)
+        day = prof.reshape(weeks, 7, 24).mean(axis=1)
+        daily = np.tile(day, (1, 7)).ravel()[off:off + n]
+        seasonal = prof.ravel()[off:off + n]
+        yf = np.where(obs, y, trend + seasonal)
+    trend = _moving_average(yf - seasonal, TREND_HOURS)
+    return {
+        "ts": ts,
+        "observed": obs,
+        "trend": trend,
+        "daily": daily,
+        "weekly": seasonal - daily,
+        "residual": np.where(obs, y - trend - seasonal, np.nan),
+        "filled": yf,
+    }
+
+
+def spectrum(c: Dict[str, np.ndarray], top: int = TOP_PERIODS):
+    """Dominant periods (hours) of the gap-filled, detrended series by FFT amplitude."""
+    x = c["filled"] - c["trend"]
+    amp = np.abs(np.fft.rfft(x - x.mean())) * 2 / len(x)
+    freq = np.fft.rfftfreq(len(x), d=1.0)
+    keep = freq >= 1.0 / (len(x) / 2)  # at least two cycles in the data
+    amp, freq = amp[keep], freq[keep]
+    order = np.argsort(amp)[::-1][:top]
+    return [{"period_hours": round(float(1 / freq[i]), 2), "amplitude": round(float(amp[i]), 2)} for i in order]
+
+
+def report(c: Dict[str, np.ndarray], source: str) -> Dict[str, Any]:
+    r1 = lambda xs: [None if v != v else v for v in np.round(xs, 1).tolist()]  # NaN -> null
+    ts = c["ts"]
+    n = len(ts)
+    last = n - 1
+    latest_week = np.arange(max(n - 168, 0), n)
+    weekly = np.zeros(168)
+    weekly[(latest_week + hour_of_week(int(ts[0]))) % 168] = c["daily"][latest_week] + c["weekly"][latest_week]
+    daily = np.zeros(24)
+    daily[(ts[latest_week[-24:]] // HOUR) % 24] = c["daily"][latest_week[-24:]]
+    resid = c["residual"]
+    return {
+        "version": VERSION,
+        "generated_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "source": source,
+        "start": iso(int(ts[0])),
+        "start_ts": int(ts[0]),
+        "step": HOUR,
+        "n": n,
+        "coverage": round(float(c["observed"].mean()), 3),
+        "strength": {
+            "trend": _strength(c["trend"], resid),
+            "daily": _strength(c["daily"], resid),
+            "weekly": _strength(c["weekly"], resid),
+        },
+        "residual_std": round(float(np.nanstd(resid)), 2),
+        "periods": spectrum(c),
+        "latest": {
+            "trend": round(float(c["trend"][last]), 1),
+            "daily": r1(daily),     # by UTC hour of day
+            "seasonal": r1(weekly),  # daily + weekly by UTC hour of week
+        },
+        "trend": r1(c["trend"]),
+        "daily": r1(c["daily"]),
+        "weekly": r1(c["weekly"]),
+        "residual": r1(resid),
+    }
+
+
+def run(source: str = "history", lo: Optional[int] = None, hi: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    field = SOURCE_FIELDS[source]
+    cols = columns(source, [field], lo, hi)
+    if not np.isfinite(cols[field]).any():
+        return None
+    ok = ~np.isnan(cols[field])
+    g = to_grid(cols["ts"][ok], {"busyness": cols[field][ok]})
+    return report(decompose(g["ts"], g["busyness"]), source)
+
+
+def write(rep: Dict[str, Any], path: str = DECOMPOSITION_FILE) -> str:
+    codec.write(path, rep)
+    return path
+
+
+# ---------------- consumers ----------------
+
+def load_decomposition(path: str = DECOMPOSITION_FILE) -> Optional[Dict[str, Any]]:
+    d = codec.read(path)
+    return d if isinstance(d, dict) and d.get("version") == VERSION else None
+
+
+def expected(dec: Dict[str, Any], ts: np.ndarray) -> np.ndarray:
+    """Latest trend + seasonal profile at epochs ts (for forecasters / anomaly baselines)."""
+    how = np.array([hour_of_week(int(t)) for t in np.atleast_1d(ts)], dtype=int)
+    prof = np.array([v if v is not None else 0.0 for v in dec["latest"]["seasonal"]])
+    return dec["latest"]["trend"] + prof[how]
@@ -0,0 +1,169 @@
+"""
+Online ensemble of the forecasters with Hedge (multiplicative-weights) updates.
+
+Each run the pipeline hands over every member forecast it could build
+(kx.forecast array form: heuristic, ridge, holt_winters, moving_average,
+random_forest). The combiner
+1. scores the members' previous forecasts against this run's actual:
+   loss = min(|actual - forecast| / LOSS_SCALE, 1) for the step within +-30 min,
+2. updates w_m <- w_m * exp(-ETA * loss_m), then mixes in FIXED_SHARE of the
+   uniform weights so a member that was bad for a while can come back,
+3. publishes the weighted average of the members' point / low / high (only the
+   members present this run, renormalised) with each member's weight and its
+   contribution w_m * forecast_m per step.
+
+No model is refitted here; an update is a few dict operations.
+State: data/models/ensemble_state.json, a local cache rebuilt from the
+"forecasts" store (each run's actual and its members' pending steps).
+"""
+
+from __future__ import annotations
+import math, os
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from . import codec
+from .paths import MODELS_DIR
+from .timeutil import HOUR, epoch_of
+
+ENSEMBLE_FILE = os.path.join(MODELS_DIR, "ensemble_state.json")
+VERSION = 1
+
+ETA = 2.0
+FIXED_SHARE = 0.02
+LOSS_SCALE = 25.0
+PENDING_STEPS = 24  # steps of each member's last forecast kept for scoring
+MATCH_TOLERANCE = HOUR // 2
+
+
+class Hedge:
+    def __init__(self):
+        self.weights: Dict[str, float] = {}
+        self.cum_loss: Dict[str, float] = {}
+        self.n_scored: Dict[str, int] = {}
+        self.pending: Dict[str, Dict[str, Any]] = {}  # member -> {"start_ts", "step", "busyness"}
+        self.last_ts = 0
+
+    def _join(self, name: str):
+        if name not in self.weights:
+            # newcomers start at the current average weight
+            self.weights[name] = sum(self.weights.values()) / len(self.weights) if self.weights else 1.0
+            self.cum_loss[name] = 0.0
+            self.n_scored[name] = 0
+
+    # ---------------- update ----------------
+
+    def observe(self, ts: int, actual: float) -> Dict[str, float]:
+        """Hedge step from the members' previous forecasts; returns their losses."""
+        if ts <= self.last_ts:
+            return {}
+        self.last_ts = ts
+        losses = {}
+        for name, p in self.pending.items():
+            k = int(round((ts - p["start_ts"]) / p["step"]))
+            if 0 <= k < len(p["busyness"]) and abs(ts - (p["start_ts"] + k * p["step"])) <= MATCH_TOLERANCE:
+                losses[name] = min(abs(actual - p["busyness"][k]) / LOSS_SCALE, 1.0)
+        if not losses:
+            return losses
+        for name, loss in losses.items():
+            self._join(name)
+            self.weights[name] *= math.exp(-ETA * loss)
+            self.cum_loss[name] += loss
+            self.n_scored[name] += 1
+        total = sum(self.weights.values())
+        n = len(self.weights)
+        self.weights = {k: (1 - FIXED_SHARE) * w / total + FIXED_SHARE / n for k, w in self.weights.items()}
+        return losses
+
+    def remember(self, members: Dict[str, Dict[str, Any]]):
+        """Keep the start of each member's raw forecast for the next observe()."""
+        for name, fc in members.items():
+            self.pending[name] = {
+                "start_ts": fc["start_ts"],
+                "step": fc["step"],
+                "busyness": list(fc.get("point", fc["busyness"])[:PENDING_STEPS]),
+            }
+
+    def update_many(self, rows: Iterable[Dict[str, Any]]):
+        """Replay forecasts-store rows newer than the state: observe "actual", then remember "members"."""
+        for r in rows:
+            ts = epoch_of(r)
+            if ts is None or ts <= self.last_ts or not isinstance(r.get("actual"), (int, float)):
+                continue
+            self.observe(ts, float(r["actual"]))
+            members = r.get("members") or {}
+            for name in members:
+                self._join(name)  # as combine() does before the live remember()
+            self.remember(members)
+
+    # ---------------- combine ----------------
+
+    def combine(self, members: Dict[str, Dict[str, Any]], base: Optional[str] = None) -> Dict[str, Any]:
+        """Weighted forecast over the members present; timing / rush flags come from `base` (or the first)."""
+        for name in members:
+            self._join(name)
+        names = sorted(members)
+        w = np.array([self.weights[n] for n in names])
+        w = w / w.sum()
+        ref = members[base] if base in members else members[names[0]]
+        horizon = min(len(members[n]["busyness"]) for n in names)
+
+        def stack(field):
+            return np.array([np.asarray(members[n][field][:horizon], dtype=float) for n in names])
+
+        point, low, high = stack("busyness"), stack("low"), stack("high")
+        contrib = w[:, None] * point
+        bus = contrib.sum(axis=0)
+        out = dict(ref)
+        out.pop("point", None)
+        out.pop("interval", None)
+        out.update({
+            "model": "ensemble",
+            "horizon": horizon,
+            "busyness": np.rint(bus).astype(int).tolist(),
+            "low": np.floor((w[:, None] * low).sum(axis=0)).astype(int).tolist(),
+            "high": np.floor((w[:, None] * high).sum(axis=0)).astype(int).tolist(),
+            "rush_hour": ref["rush_hour"][:horizon],
+            "members": {n: {"weight": round(float(w[i]), 4),
+                            "contribution": np.round(contrib[i], 1).tolist()} for i, n in enumerate(names)},
+        })
+        return out
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": VERSION,
+            "last_ts": self.last_ts,
+            "weights": {k: round(v, 6) for k, v in sorted(self.weights.items())},
+            "cum_loss": {k: round(v, 4) for k, v in sorted(self.cum_loss.items())},
+            "n_scored": dict(sorted(self.n_scored.items())),
+            "pending": self.pending,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Hedge":
+        h = cls()
+        h.last_ts = int(d.get("last_ts", 0))
+        h.weights = {k: float(v) for k, v in (d.get("weights") or {}).items()}
+        h.cum_loss = {k: float(v) for k, v in (d.get("cum_loss") or {}).items()}
+        h.n_scored = {k: int(v) for k, v in (d.get("n_scored") or {}).items()}
+        h.pending = dict(d.get("pending") or {})
+        return h
+
+    def save(self, path: str = ENSEMBLE_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_ensemble(path: str = ENSEMBLE_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                  last_ts: Optional[int] = None) -> Hedge:
+    """Load persisted state; if there is none (or it has not seen `last_ts`, the forecasts store's
+    newest run), replay `bootstrap` rows once."""
+    d = codec.read(path)
+    if isinstance(d, dict) and d.get("version") == VERSION and int(d.get("last_ts") or 0) >= (last_ts or 0):
+        return Hedge.from_dict(d)
+    h = Hedge()
+    if bootstrap is not None:
+        h.update_many(bootstrap)
+    return h
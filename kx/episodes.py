@@ -0,0 +1,191 @@
+"""
+Anomaly episodes: consecutive anomalies of one type merged into a single record.
+
+An "established" volatile_demand is re-emitted every run while it lasts; as
+an episode it is one row with start / end, peak severity, run count, the union
+of drivers and per-severity counts:
+
+    {"type": "volatile_demand", "start": "...", "end": "...", "start_ts": ..., "end_ts": ...,
+     "severity": "medium", "severities": {"low": 11, "medium": 1}, "runs": 12,
+     "confidence": 0.63, "persistence": "established", "drivers": [...], "explanation": "..."}
+
+An anomaly extends the open episode of its type when it follows the previous
+hit by at most EPISODE_GAP, otherwise it opens a new one. EpisodeLog keeps the
+episodes sorted by start plus a running max of end, so overlap queries are a
+bisect and a short scan.
+
+The log is derived from the anomaly store: data/models/episode_state.json is a
+local cache of it (not committed, rebuilt when it has not seen the store's
+newest anomaly), and closed episodes that ended more than EPISODE_RETENTION ago
+are pruned from it. The page only downloads data/anomaly_episodes.json, the
+latest EPISODE_VIEW_LIMIT episodes. Older ranges are merged from the store on
+demand:
+
+    python -m kx episodes --from 2025-12-20 --to 2026-01-07
+    python -m kx episodes --rebuild        # recompute the log and the published view from the store
+"""
+
+from __future__ import annotations
+import os
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import codec
+from .paths import DATA_DIR
+from .timeutil import HOUR, epoch_of, iso
+
+EPISODES_FILE = os.path.join(DATA_DIR, "anomaly_episodes.json")          # UI view
+STATE_FILE = os.path.join(DATA_DIR, "models", "episode_state.json")         # full (retained) log
+EPISODE_GAP = 6 * HOUR  # same span as the 6-run persistence window; cron runs are irregular
+EPISODE_RETENTION = 90 * 24 * HOUR
+EPISODE_VIEW_LIMIT = 20
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
+
+
+def new_episode(a: Dict[str, Any], ts: int) -> Dict[str, Any]:
+    sev = a.get("severity") or "low"
+    return {
+        "type": a.get("type"),
+        "start": iso(ts),
+        "end": iso(ts),
+        "start_ts": ts,
+        "end_ts": ts,
+        "severity": sev,
+        "severities": {sev: 1},
+        "runs": 1,
+        "confidence": a.get("confidence"),
+        "persistence": a.get("persistence"),
+        "drivers": sorted(set(a.get("drivers") or [])),
+        "explanation": a.get("explanation"),
+    }
+
+
+def extend_episode(ep: Dict[str, Any], a: Dict[str, Any], ts: int):
+    sev = a.get("severity") or "low"
+    ep["end"], ep["end_ts"] = iso(ts), ts
+    ep["runs"] += 1
+    ep["severities"][sev] = ep["severities"].get(sev, 0) + 1
+    if SEVERITY_RANK.get(sev, 0) >= SEVERITY_RANK.get(ep["severity"], 0):
+        # explanation follows the (latest) peak-severity run
+        ep["severity"] = sev
+        ep["explanation"] = a.get("explanation")
+    conf = a.get("confidence")
+    if isinstance(conf, (int, float)):
+        ep["confidence"] = max(ep["confidence"] or 0.0, conf)
+    ep["persistence"] = a.get("persistence") or ep["persistence"]
+    if a.get("drivers"):
+        ep["drivers"] = sorted(set(ep["drivers"]) | set(a["drivers"]))
+
+
+class EpisodeLog:
+    def __init__(self, episodes: Optional[List[Dict[str, Any]]] = None, last_ts: int = 0, horizon: int = 0):
+        self.last_ts = last_ts  # newest anomaly merged
+        self.horizon = horizon  # episodes ending before this were pruned
+        self._rebuild(episodes or [])
+
+    def _rebuild(self, episodes: List[Dict[str, Any]]):
+        self.episodes: List[Dict[str, Any]] = sorted(episodes, key=lambda e: e["start_ts"])
+        self.open: Dict[str, int] = {}  # type -> index of its latest episode
+        for i, e in enumerate(self.episodes):
+            self.open[e["type"]] = i
+        self.starts = [e["start_ts"] for e in self.episodes]
+        self.max_end: List[int] = []
+        self._reindex(0)
+
+    def _reindex(self, i: int):
+        """Recompute the running max of end_ts from position i on."""
+        del self.max_end[i:]
+        m = self.max_end[-1] if self.max_end else -1
+        for e in self.episodes[i:]:
+            m = max(m, e["end_ts"])
+            self.max_end.append(m)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    # ---------------- update ----------------
+
+    def add(self, a: Dict[str, Any]) -> bool:
+        """Merge one anomaly; returns False when it was already applied (re-runs)."""
+        ts = epoch_of(a)
+        typ = a.get("type")
+        if ts is None or not typ or ts < self.horizon:
+            return False
+        self.last_ts = max(self.last_ts, ts)
+        i = self.open.get(typ)
+        if i is not None:
+            ep = self.episodes[i]
+            if ts <= ep["end_ts"]:
+                return False
+            if ts - ep["end_ts"] <= EPISODE_GAP:
+                extend_episode(ep, a, ts)
+                self._reindex(i)
+                return True
+        ep = new_episode(a, ts)
+        if self.starts and ts < self.starts[-1]:
+            # out-of-order input: rebuild positions (rare, only on odd replays)
+            self._rebuild(self.episodes + [ep])
+            return True
+        self.episodes.append(ep)
+        self.starts.append(ts)
+        self.open[typ] = len(self.episodes) - 1
+        self._reindex(len(self.episodes) - 1)
+        return True
+
+    def add_many(self, anomalies: Iterable[Dict[str, Any]]) -> int:
+        return sum(self.add(a) for a in anomalies)
+
+    def prune(self, before: int) -> int:
+        """Drop closed episodes that ended before `before` (at least EPISODE_GAP ago); returns how many."""
+        cutoff = min(before, self.last_ts - EPISODE_GAP)
+        if not self.episodes or cutoff <= self.horizon:
+            return 0
+        keep = [e for e in self.episodes if e["end_ts"] >= cutoff]
+        dropped = len(self.episodes) - len(keep)
+        self.horizon = cutoff
+        if dropped:
+            self._rebuild(keep)
+        return dropped
+
+    # ---------------- read ----------------
+
+    def overlapping(self, lo: Optional[int] = None, hi: Optional[int] = None, typ: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Episodes with end_ts >= lo and start_ts < hi."""
+        i = 0 if lo is None else bisect_left(self.max_end, lo)
+        j = len(self.episodes) if hi is None else bisect_left(self.starts, hi)
+        return [e for e in self.episodes[i:j]
+                if (lo is None or e["end_ts"] >= lo) and (typ is None or e["type"] == typ)]
+
+    def active_at(self, t: int) -> List[Dict[str, Any]]:
+        return self.overlapping(t, t + 1)
+
+    def latest(self, n: int) -> List[Dict[str, Any]]:
+        """n most recently active episodes, oldest first."""
+        return sorted(self.episodes, key=lambda e: e["end_ts"])[-n:] if n else []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"last_ts": self.last_ts, "horizon": self.horizon, "episodes": self.episodes}
+
+    def save(self, path: str = STATE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        codec.write(path, self.to_dict())
+
+    def publish(self, path: str = EPISODES_FILE, n: int = EPISODE_VIEW_LIMIT):
+        """Write the latest n episodes for the page (a few KB, whatever the log's size)."""
+        codec.write(path, self.latest(n))
+
+
+def load_episodes(path: str = STATE_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                  last_ts: Optional[int] = None, retention: Optional[int] = EPISODE_RETENTION) -> EpisodeLog:
+    """Load the episode log; if there is none (or it has not seen `last_ts`, the store's newest
+    anomaly), merge `bootstrap` anomalies (one pass) and prune to `retention`."""
+    d = codec.read(path)
+    if isinstance(d, dict) and isinstance(d.get("episodes"), list) and int(d.get("last_ts") or 0) >= (last_ts or 0):
+        return EpisodeLog([e for e in d["episodes"] if isinstance(e, dict) and "start_ts" in e],
+                          int(d.get("last_ts") or 0), int(d.get("horizon") or 0))
+    log = EpisodeLog()
+    if bootstrap is not None:
+        log.add_many(bootstrap)
+    if retention is not None:
+        log.prune(log.last_ts - retention)
+    return log
@@ -0,0 +1,232 @@
+"""
+Multi-step forecast engine: the whole horizon in one feature matrix.
+
+Both forecasters (the pipeline's level + rush heuristic and the ridge model
+in scripts/ml/train_and_forecast.py) build an (H x F) matrix for the next
+HORIZON hours from the calendar table (London local hour / weekday / rush
+hour, holiday phase) and the exogenous inputs, then predict every step at
+once. Exogenous inputs are persisted from "now": temperature and wind stay
+flat, the current transport disruption and events fade with EXOG_HALF_LIFE.
+Intervals widen with the step (interval_scale). A tuned ridge model
+(python -m kx tune-ridge) can add FEATURE_GROUPS columns: calendar terms,
+interactions and the busyness one week earlier (design_matrix).
+
+Outputs:
+- data/forecast_168h.json   compact, array form:
+      {"start": iso, "start_ts": .., "step": 3600, "model": .., "confidence": ..,
+       "busyness": [...], "low": [...], "high": [...], "rush_hour": [0/1 ...]}
+- data/forecast.json        the first VIEW_HOURS steps as the usual list of dicts (UI)
+"""
+
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import codec
+from . import calendar_table as cal
+from .paths import DATA_DIR
+from .resample import to_grid
+from .timeutil import HOUR, PHASES, iso
+
+HORIZON = 168
+VIEW_HOURS = 12
+FORECAST_ARRAY_FILE = os.path.join(DATA_DIR, "forecast_168h.json")
+
+FEATURE_ORDER = [
+    "bias","hour_sin","hour_cos","dow_sin","dow_cos","rush",
+    "temp_scaled","wind_scaled","transport_scaled","events_scaled"
+]
+
+# Optional ridge feature groups (kx.tune searches their subsets); columns go after FEATURE_ORDER in this order
+FEATURE_GROUPS = {
+    "calendar": ["hour2_sin", "hour2_cos", "weekend", "bank_holiday", "school_holiday"] + [f"phase_{p}" for p in PHASES[1:]],
+    "interactions": ["rush_x_transport", "rush_x_events", "weekend_x_hour_sin", "weekend_x_hour_cos"],
+    "lags": ["lag_week", "lag_week_missing"],
+}
+LAG_HOURS = 168
+
+RUSH_UPLIFT = 12.0
+PHASE_UPLIFT = np.array([{"christmas_period": 4, "pre_nye": 6, "nye": 10, "new_year_day": 3}.get(p, 0)
+                         for p in PHASES], dtype=float)
+EXOG_HALF_LIFE = {"transport": 6.0, "events": 12.0}  # hours
+Z90 = 1.2816  # P90 of a standard normal: +-Z90 std is an 80% band
+WIDEN_HOURS = 48.0  # band grows by sqrt(1 + step / WIDEN_HOURS)
+
+
+def horizon_ts(now_ts: int, hours: int = HORIZON) -> np.ndarray:
+    return int(now_ts) + HOUR * np.arange(1, hours + 1, dtype=np.int64)
+
+
+def exog_paths(hours: int, temp: float, wind: float, transport: float, events: float) -> Dict[str, np.ndarray]:
+    step = np.arange(1, hours + 1, dtype=float)
+    return {
+        "temp": np.full(hours, float(temp)),
+        "wind": np.full(hours, float(wind)),
+        "transport": float(transport) * 0.5 ** (step / EXOG_HALF_LIFE["transport"]),
+        "events": float(events) * 0.5 ** (step / EXOG_HALF_LIFE["events"]),
+    }
+
+
+def feature_matrix(ts: np.ndarray, temp, wind, transport, events) -> np.ndarray:
+    """Rows in FEATURE_ORDER; exogenous args are scalars or arrays matching ts."""
+    ts = np.asarray(ts, dtype=np.int64)
+    c = cal.rows(ts)
+    hour = c["local_hour"] + (ts % HOUR) / 3600.0
+    dow = c["local_dow"].astype(float)
+    n = len(ts)
+    X = np.empty((n, len(FEATURE_ORDER)))
+    X[:, 0] = 1.0
+    X[:, 1] = np.sin(2 * np.pi * hour / 24.0)
+    X[:, 2] = np.cos(2 * np.pi * hour / 24.0)
+    X[:, 3] = np.sin(2 * np.pi * dow / 7.0)
+    X[:, 4] = np.cos(2 * np.pi * dow / 7.0)
+    X[:, 5] = np.isin(c["local_hour"], list(cal.RUSH_HOURS))
+    X[:, 6] = (np.asarray(temp, dtype=float) - 10.0) / 10.0
+    X[:, 7] = (np.asarray(wind, dtype=float) - 10.0) / 10.0
+    X[:, 8] = np.asarray(transport, dtype=float) / 40.0
+    X[:, 9] = np.asarray(events, dtype=float) / 10.0
+    return X
+
+
+def feature_names(groups: Sequence[str] = ()) -> List[str]:
+    unknown = set(groups) - set(FEATURE_GROUPS)
+    if unknown:
+        raise ValueError(f"unknown feature groups: {sorted(unknown)}")
+    return FEATURE_ORDER + [n for g, names in FEATURE_GROUPS.items() if g in groups for n in names]
+
+
+def lagged(ts: np.ndarray, y: np.ndarray, at: np.ndarray, hours: int = LAG_HOURS) -> np.ndarray:
+    """Hourly mean of y in the clock hour `hours` before each of `at`; NaN where no run landed."""
+    ts, at = np.asarray(ts, dtype=np.int64), np.asarray(at, dtype=np.int64)
+    if not len(ts):
+        return np.full(len(at), np.nan)
+    g = to_grid(ts, {"y": y})
+    idx = (at - hours * HOUR) // HOUR - g["ts"][0] // HOUR
+    ok = (idx >= 0) & (idx < len(g["ts"]))
+    out = np.full(len(at), np.nan)
+    out[ok] = g["y"][idx[ok]]
+    return out
+
+
+def design_matrix(ts: np.ndarray, temp, wind, transport, events, groups: Sequence[str] = (),
+                  lag: Optional[np.ndarray] = None) -> np.ndarray:
+    """feature_matrix plus the columns of `groups` (feature_names order); lag = lagged() busyness at ts."""
+    ts = np.asarray(ts, dtype=np.int64)
+    X = feature_matrix(ts, temp, wind, transport, events)
+    names = feature_names(groups)
+    if len(names) == X.shape[1]:
+        return X
+    c = cal.rows(ts)
+    hour = c["local_hour"] + (ts % HOUR) / 3600.0
+    weekend = (c["local_dow"] >= 5).astype(float)
+    cols = []
+    if "calendar" in groups:
+        cols += [np.sin(4 * np.pi * hour / 24.0), np.cos(4 * np.pi * hour / 24.0), weekend,
+                 c["bank_holiday"].astype(float), c["school_holiday"].astype(float)]
+        cols += [(c["phase"] == k).astype(float) for k in range(1, len(PHASES))]
+    if "interactions" in groups:
+        cols += [X[:, 5] * X[:, 8], X[:, 5] * X[:, 9], weekend * X[:, 1], weekend * X[:, 2]]
+    if "lags" in groups:
+        lag = np.full(len(ts), np.nan) if lag is None else np.asarray(lag, dtype=float)
+        missing = np.isnan(lag)
+        cols += [np.where(missing, 0.0, (lag - 55.0) / 20.0), missing.astype(float)]
+    return np.column_stack([X] + cols)
+
+
+def interval_scale(hours: int) -> np.ndarray:
+    return np.sqrt(1.0 + np.arange(1, hours + 1) / WIDEN_HOURS)
+
+
+def pack(ts: np.ndarray, bus: np.ndarray, band: np.ndarray, rush: np.ndarray, model: str, confidence: str) -> Dict[str, Any]:
+    bus = np.clip(bus, 0, 100)
+    return {
+        "start": iso(int(ts[0])),
+        "start_ts": int(ts[0]),
+        "step": HOUR,
+        "horizon": len(ts),
+        "model": model,
+        "confidence": confidence,
+        "busyness": np.rint(bus).astype(int).tolist(),
+        "low": np.clip(bus - band, 0, 100).astype(int).tolist(),
+        "high": np.clip(bus + band, 0, 100).astype(int).tolist(),
+        "rush_hour": rush.astype(int).tolist(),
+    }
+
+
+def ridge_forecast(now_ts: int, w: Sequence[float], resid_std: float, exog: Dict[str, float],
+                   confidence: str, hours: int = HORIZON, groups: Sequence[str] = (),
+                   lag: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """X @ w for every step, plus the rush-hour uplift; band = resid_std (+6 low confidence, +4 rush) x step scale.
+    groups / lag: the model's extra feature groups (kx.tune) and lagged() busyness at the horizon steps."""
+    ts = horizon_ts(now_ts, hours)
+    e = exog_paths(hours, **exog)
+    X = design_matrix(ts, e["temp"], e["wind"], e["transport"], e["events"], groups, lag)
+    rush = X[:, 5] > 0
+    bus = X @ np.asarray(w, dtype=float) + RUSH_UPLIFT * rush
+    band = (resid_std + (6.0 if confidence == "low" else 0.0) + 4.0 * rush) * interval_scale(hours)
+    return pack(ts, bus, band, rush, "ridge", confidence)
+
+
+def heuristic_forecast(now_ts: int, level: float, spread: float, hour_boost: Optional[Sequence[float]] = None,
+                       confidence: str = "medium", hours: int = HORIZON,
+                       rush_hours: Sequence[int] = (7, 8, 9, 16, 17, 18)) -> Dict[str, Any]:
+    """level + rush uplift + holiday-phase uplift + per-local-hour boost (e.g. the lunch signature)."""
+    ts = horizon_ts(now_ts, hours)
+    c = cal.rows(ts)
+    rush = np.isin(c["local_hour"], list(rush_hours))
+    bus = level + RUSH_UPLIFT * rush + PHASE_UPLIFT[c["phase"]]
+    if hour_boost is not None:
+        bus = bus + np.asarray(hour_boost, dtype=float)[c["local_hour"]]
+    band = spread * interval_scale(hours)
+    return pack(ts, bus, band, rush, "heuristic", confidence)
+
+
+def moving_average_forecast(now_ts: int, busyness: Sequence[float], events: Sequence[float], temperature: Sequence[float],
+                            spread: float, hours: int = HORIZON) -> Dict[str, Any]:
+    """forecast_busyness.py: mean of the recent runs (+8 with busy events, +5 when warm), flat; +-Z90 x spread."""
+    pred = float(np.mean(busyness))
+    if np.mean(events) > 2:
+        pred += 8
+    if np.mean(temperature) > 18:
+        pred += 5
+    ts = horizon_ts(now_ts, hours)
+    rush = np.isin(cal.rows(ts)["local_hour"], list(cal.RUSH_HOURS))
+    return pack(ts, np.full(hours, float(min(int(pred), 100))), np.full(hours, Z90 * spread), rush,
+                "moving_average", "low")
+
+
+def random_forest_forecast(model, x: Sequence[float], now_ts: int, hours: int = HORIZON) -> Dict[str, Any]:
+    """scripts/predict/train_model.py's forest on this run's inputs
+    [temp_C, wind_kmh, tfl_issues, event_count, avg_place_rating], flat; P10 / P90 from the trees."""
+    x = np.asarray([x], dtype=float)
+    trees = np.array([t.predict(x)[0] for t in model.estimators_])
+    ts = horizon_ts(now_ts, hours)
+    rush = np.isin(cal.rows(ts)["local_hour"], list(cal.RUSH_HOURS))
+    p10, p90 = np.percentile(trees, [10, 90])
+    bus = np.full(hours, trees.mean())
+    fc = pack(ts, bus, np.zeros(hours), rush, "random_forest", "medium")
+    fc["low"] = [int(min(max(p10, 0), 100))] * hours
+    fc["high"] = [int(min(max(p90, 0), 100))] * hours
+    return fc
+
+
+def to_view(fc: Dict[str, Any], n: int = VIEW_HOURS) -> List[Dict[str, Any]]:
+    """First n steps as the list-of-dicts forecast.json the UI reads."""
+    return [
+        {
+            "time": iso(fc["start_ts"] + i * fc["step"]),
+            "busyness": fc["busyness"][i],
+            "low": fc["low"][i],
+            "high": fc["high"][i],
+            "rush_hour": bool(fc["rush_hour"][i]),
+            "confidence": fc["confidence"],
+        }
+        for i in range(min(n, fc["horizon"]))
+    ]
+
+
+def write_forecast(fc: Dict[str, Any], view_path: str, array_path: str = FORECAST_ARRAY_FILE):
+    codec.write(array_path, fc)
+    codec.write(view_path, to_view(fc))
@@ -0,0 +1,166 @@
+"""
+Double-seasonal Holt-Winters (additive, damped trend) for busyness.
+
+    forecast(t + h) = level + trend * (phi + ... + phi^h) + daily[hour] + weekly[hour of week]
+
+with London local hour / hour of week from the calendar table. update() is
+the error-correction form, O(1) per observation:
+    e       = y - forecast
+    level  += alpha * e
+    trend  += alpha * beta * e
+    daily[hour]   += gamma * (1 - alpha) * e
+    weekly[how]   += omega * (1 - alpha) * e
+Runs arrive at irregular times, so the level / trend are first advanced by the
+whole hours since the previous observation.
+
+State (data/models/holt_winters.json): level, trend, the 24 + 168 seasonal
+arrays and a decayed one-step residual variance for the bands. forecast()
+produces the whole horizon in one vectorised pass (kx.forecast array form).
+"""
+
+from __future__ import annotations
+import datetime, math, os
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from . import codec
+from . import calendar_table as cal
+from . import forecast as forecast_engine
+from .paths import MODELS_DIR
+from .timeutil import HOUR, epoch_of
+
+HW_FILE = os.path.join(MODELS_DIR, "holt_winters.json")
+VERSION = 1
+
+ALPHA, BETA, PHI = 0.1, 0.01, 0.98
+GAMMA, OMEGA = 0.15, 0.05
+RESID_HALF_LIFE = 24 * 14  # observations
+MAX_GAP_HOURS = 24 * 14
+
+
+def _damped(k):
+    """phi + phi^2 + ... + phi^k (k may be an array)."""
+    return PHI * (1 - PHI ** k) / (1 - PHI)
+
+
+def _slots(ts: np.ndarray):
+    c = cal.rows(ts)
+    hour = c["local_hour"].astype(int)
+    return hour, c["local_dow"].astype(int) * 24 + hour
+
+
+class HoltWinters:
+    def __init__(self):
+        self.level: Optional[float] = None
+        self.trend = 0.0
+        self.daily = np.zeros(24)
+        self.weekly = np.zeros(168)
+        self.resid_var = 12.0 ** 2
+        self.n = 0
+        self.last_ts = 0
+
+    # ---------------- update ----------------
+
+    def update(self, ts: int, y: float) -> Optional[float]:
+        """One observation; returns its one-step-ahead error (None for the first one and replays)."""
+        if ts <= self.last_ts:
+            return None
+        r = cal.row(ts)
+        hour = int(r["local_hour"])
+        how = int(r["local_dow"]) * 24 + hour
+        k = min((ts - self.last_ts) // HOUR, MAX_GAP_HOURS)
+        self.last_ts = ts
+        self.n += 1
+        if self.level is None:
+            self.level = float(y)
+            return None
+        level = self.level + self.trend * _damped(k)
+        trend = self.trend * PHI ** k
+        e = float(y) - (level + self.daily[hour] + self.weekly[how])
+        self.level = level + ALPHA * e
+        self.trend = trend + ALPHA * BETA * e
+        self.daily[hour] += GAMMA * (1 - ALPHA) * e
+        self.weekly[how] += OMEGA * (1 - ALPHA) * e
+        d = 0.5 ** (1 / RESID_HALF_LIFE)
+        self.resid_var = d * self.resid_var + (1 - d) * e * e
+        return e
+
+    def update_many(self, rows: Iterable[Dict[str, Any]], key: str = "busyness") -> int:
+        """Feed rows newer than the state; returns how many were applied."""
+        n = self.n
+        for r in rows:
+            v = r.get(key)
+            ts = epoch_of(r)
+            if ts is None or not isinstance(v, (int, float)):
+                continue
+            self.update(ts, float(v))
+        return self.n - n
+
+    # ---------------- forecast ----------------
+
+    @property
+    def resid_std(self) -> float:
+        return math.sqrt(self.resid_var)
+
+    def predict(self, ts: np.ndarray) -> np.ndarray:
+        """Point forecasts for future epochs (whole hours after the last observation)."""
+        ts = np.asarray(ts, dtype=np.int64)
+        hour, how = _slots(ts)
+        k = np.clip((ts - self.last_ts) // HOUR, 0, None)
+        level = self.level if self.level is not None else 55.0
+        return level + self.trend * _damped(k) + self.daily[hour] + self.weekly[how]
+
+    def forecast(self, now_ts: int, confidence: str = "medium", hours: int = forecast_engine.HORIZON) -> Dict[str, Any]:
+        ts = forecast_engine.horizon_ts(now_ts, hours)
+        bus = self.predict(ts)
+        band = forecast_engine.Z90 * self.resid_std * forecast_engine.interval_scale(hours)
+        rush = np.isin(cal.rows(ts)["local_hour"], list(cal.RUSH_HOURS))
+        return forecast_engine.pack(ts, bus, band, rush, "holt_winters", confidence)
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        r = lambda xs: [round(float(x), 4) for x in xs]
+        return {
+            "version": VERSION,
+            "trained_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            "params": {"alpha": ALPHA, "beta": BETA, "phi": PHI, "gamma": GAMMA, "omega": OMEGA},
+            "n_samples": self.n,
+            "last_ts": self.last_ts,
+            "level": self.level,
+            "trend": self.trend,
+            "daily": r(self.daily),
+            "weekly": r(self.weekly),
+            "resid_var": self.resid_var,
+            "resid_std": round(self.resid_std, 3),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "HoltWinters":
+        hw = cls()
+        hw.level = d.get("level")
+        hw.trend = float(d.get("trend", 0.0))
+        if len(d.get("daily") or []) == 24 and len(d.get("weekly") or []) == 168:
+            hw.daily = np.asarray(d["daily"], dtype=float)
+            hw.weekly = np.asarray(d["weekly"], dtype=float)
+        hw.resid_var = float(d.get("resid_var", hw.resid_var))
+        hw.n = int(d.get("n_samples", 0))
+        hw.last_ts = int(d.get("last_ts", 0))
+        return hw
+
+    def save(self, path: str = HW_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_holt_winters(path: str = HW_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                      last_ts: Optional[int] = None) -> HoltWinters:
+    """Load persisted state; if there is none (or it has not seen `last_ts`, the store's newest row),
+    fit by replaying `bootstrap` rows once."""
+    d = codec.read(path)
+    if isinstance(d, dict) and d.get("version") == VERSION and int(d.get("last_ts") or 0) >= (last_ts or 0):
+        return HoltWinters.from_dict(d)
+    hw = HoltWinters()
+    if bootstrap is not None:
+        hw.update_many(bootstrap)
+    return hw
@@ -0,0 +1,300 @@
+"""
+Empirical prediction intervals from forecast residuals.
+
+Every forecast the scripts publish (kx.forecast, array form) is kept in a
+ledger for its whole horizon. When an actual arrives, each open forecast that
+covers that hour adds residual = actual - forecast to its model's
+- how_step   168 UTC hour-of-week x N_STEPS horizon-step buckets
+- hod_step    24 hour-of-day x N_STEPS buckets
+- step       horizon-step buckets only
+- global
+each a decayed t-digest (kx.sketch), and scores the band it was issued with
+(below / inside / above) for the coverage report.
+
+apply() replaces a fresh forecast's point and parametric band with
+P50 / P10 / P90 = forecast + residual quantiles of the most specific bucket
+with at least MIN_SAMPLES distinct actuals (overlapping forecasts share their
+actuals, so residual counts would overstate the evidence); steps with no
+residual history keep the parametric band.
+
+State: data/models/forecast_residuals.json, a local cache: every run logs the
+actual and its ledger entry to the "forecasts" store, and load_intervals()
+replays that store when the state is missing or behind it.
+Coverage:  python -m kx coverage
+"""
+
+from __future__ import annotations
+import os
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import codec
+from .paths import MODELS_DIR
+from .sketch import TDigest
+from .timeutil import DAY, HOUR, epoch_of, hour_of_week
+
+INTERVALS_FILE = os.path.join(MODELS_DIR, "forecast_residuals.json")
+VERSION = 1
+
+QUANTILES = (0.1, 0.5, 0.9)
+NOMINAL_COVERAGE = QUANTILES[2] - QUANTILES[0]
+STEP_EDGES = (1, 2, 4, 7, 13, 25, 49, 97)  # horizon buckets: 1, 2-3, 4-6, 7-12, 13-24, 25-48, 49-96, 97+
+N_STEPS = len(STEP_EDGES)
+MIN_SAMPLES = 12
+HALF_LIFE_DAYS = 28.0
+LEDGER_HOURS = 168
+COMPRESSION = 10.0  # residual digests are many and small
+# Ledger size: every forecast is scored over its first FULL_STEPS steps, only every
+# LONG_ORIGIN_EVERY-th hour's forecast over the whole horizon.
+FULL_STEPS = 24
+LONG_ORIGIN_EVERY = 6
+MATCH_TOLERANCE = HOUR // 2  # an actual counts for a step within +-30 min of its target time
+
+
+def step_bucket(step: int) -> int:
+    """Horizon bucket of a 1-based step."""
+    return max(bisect_right(STEP_EDGES, step) - 1, 0)
+
+
+def step_label(b: int) -> str:
+    lo = STEP_EDGES[b]
+    hi = STEP_EDGES[b + 1] - 1 if b + 1 < N_STEPS else None
+    if hi is None:
+        return f"{lo}+"
+    return str(lo) if hi == lo else f"{lo}-{hi}"
+
+
+def ledger_entry(fc: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a published forecast the ledger keeps (also what the forecasts store logs)."""
+    n = len(fc["busyness"])
+    if (fc["start_ts"] // HOUR) % LONG_ORIGIN_EVERY:
+        n = min(n, FULL_STEPS)
+    point = fc.get("point", fc["busyness"])
+    return {
+        "model": fc["model"],
+        "start_ts": fc["start_ts"],
+        "step": fc["step"],
+        "busyness": list(point[:n]),  # residuals are taken against the raw model output
+        "low": list(fc["low"][:n]),
+        "high": list(fc["high"][:n]),
+    }
+
+
+def _levels(n: int):
+    """Quantile levels for a bucket of n residuals: the outer ones are pushed out by
+    (n + 1) / n (split-conformal correction) so small buckets still cover ~80%."""
+    lo, mid, hi = QUANTILES
+    f = (n + 1) / n
+    return max(0.5 - (0.5 - lo) * f, 0.0), mid, min(0.5 + (hi - 0.5) * f, 1.0)
+
+
+class _ModelResiduals:
+    def __init__(self, half_life: float):
+        self.half_life = half_life
+        self.how_step: Dict[int, TDigest] = {}
+        self.hod_step: Dict[int, TDigest] = {}
+        self.step: Dict[int, TDigest] = {}
+        self.glob = TDigest(COMPRESSION, half_life=half_life)
+        self.n: Dict[str, int] = {}  # bucket key -> distinct actuals (for MIN_SAMPLES)
+        self.last: Dict[str, int] = {}  # bucket key -> latest target time counted
+        self.coverage = [[0, 0, 0, 0] for _ in range(N_STEPS)]  # n, below, inside, above
+
+    def _digest(self, table: Dict[int, TDigest], i: int) -> TDigest:
+        if i not in table:
+            table[i] = TDigest(COMPRESSION, half_life=self.half_life)
+        return table[i]
+
+    def _keys(self, target_ts: int, step: int):
+        b = step_bucket(step)
+        how = hour_of_week(target_ts)
+        return (
+            (f"h{how * N_STEPS + b}", self.how_step, how * N_STEPS + b),
+            (f"d{how % 24 * N_STEPS + b}", self.hod_step, how % 24 * N_STEPS + b),
+            (f"s{b}", self.step, b),
+        )
+
+    def add(self, target_ts: int, step: int, resid: float, actual: float, low: float, high: float):
+        for key, table, i in self._keys(target_ts, step):
+            self._digest(table, i).add(resid, target_ts)
+            self._count(key, target_ts)
+        self.glob.add(resid, target_ts)
+        self._count("g", target_ts)
+        c = self.coverage[step_bucket(step)]
+        c[0] += 1
+        c[1 if actual < low else 3 if actual > high else 2] += 1
+
+    def _count(self, key: str, target_ts: int):
+        if self.last.get(key) != target_ts:
+            self.n[key] = self.n.get(key, 0) + 1
+            self.last[key] = target_ts
+
+    def digest_for(self, target_ts: int, step: int):
+        """(digest, n) of the most specific bucket with MIN_SAMPLES actuals, or (None, 0)."""
+        for key, table, i in self._keys(target_ts, step):
+            if self.n.get(key, 0) >= MIN_SAMPLES:
+                return table[i], self.n[key]
+        if self.n.get("g", 0) >= MIN_SAMPLES:
+            return self.glob, self.n["g"]
+        return None, 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "how_step": {str(i): q.to_dict() for i, q in sorted(self.how_step.items()) if len(q)},
+            "hod_step": {str(i): q.to_dict() for i, q in sorted(self.hod_step.items()) if len(q)},
+            "step": {str(i): q.to_dict() for i, q in sorted(self.step.items()) if len(q)},
+            "global": self.glob.to_dict(),
+            "n": self.n,
+            "last": self.last,
+            "coverage": self.coverage,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], half_life: float) -> "_ModelResiduals":
+        m = cls(half_life)
+        m.how_step = {int(i): TDigest.from_dict(q, COMPRESSION, half_life) for i, q in (d.get("how_step") or {}).items()}
+        m.hod_step = {int(i): TDigest.from_dict(q, COMPRESSION, half_life) for i, q in (d.get("hod_step") or {}).items()}
+        m.step = {int(i): TDigest.from_dict(q, COMPRESSION, half_life) for i, q in (d.get("step") or {}).items()}
+        m.glob = TDigest.from_dict(d.get("global") or {}, COMPRESSION, half_life)
+        m.n = dict(d.get("n") or {})
+        m.last = dict(d.get("last") or {})
+        cov = d.get("coverage") or []
+        if len(cov) == N_STEPS:
+            m.coverage = [list(c) for c in cov]
+        return m
+
+
+class ForecastIntervals:
+    def __init__(self, half_life_days: float = HALF_LIFE_DAYS):
+        self.half_life = half_life_days * DAY
+        self.models: Dict[str, _ModelResiduals] = {}
+        self.ledger: List[Dict[str, Any]] = []  # issued forecasts still inside their horizon
+        self.last_ts = 0  # latest run observed or recorded
+
+    def model(self, name: str) -> _ModelResiduals:
+        if name not in self.models:
+            self.models[name] = _ModelResiduals(self.half_life)
+        return self.models[name]
+
+    # ---------------- update ----------------
+
+    def record(self, fc: Dict[str, Any]):
+        """Remember a published forecast (or its ledger_entry) until its (possibly shortened) horizon has passed."""
+        e = ledger_entry(fc)
+        e["seen"] = -1  # last step index already scored
+        self.ledger = [x for x in self.ledger if not (x["model"] == e["model"] and x["start_ts"] == e["start_ts"])]
+        self.ledger.append(e)
+        self.last_ts = max(self.last_ts, e["start_ts"] - e["step"])
+
+    def observe(self, ts: int, actual: float) -> int:
+        """Score every open forecast that covers ts; returns the number of residuals added."""
+        self.last_ts = max(self.last_ts, ts)
+        added = 0
+        for e in self.ledger:
+            k = int(round((ts - e["start_ts"]) / e["step"]))
+            if k <= e["seen"] or not 0 <= k < len(e["busyness"]):
+                continue
+            target = e["start_ts"] + k * e["step"]
+            if abs(ts - target) > MATCH_TOLERANCE:
+                continue
+            self.model(e["model"]).add(target, k + 1, actual - e["busyness"][k], actual, e["low"][k], e["high"][k])
+            e["seen"] = k
+            added += 1
+        self.ledger = [e for e in self.ledger
+                       if e["start_ts"] + (len(e["busyness"]) - 1) * e["step"] + MATCH_TOLERANCE >= ts
+                       and ts - e["start_ts"] < LEDGER_HOURS * HOUR + MATCH_TOLERANCE]
+        return added
+
+    def update_many(self, rows: Iterable[Dict[str, Any]]):
+        """Replay forecasts-store rows newer than the state: observe "actual", then record "published"."""
+        for r in rows:
+            ts = epoch_of(r)
+            if ts is None or ts <= self.last_ts:
+                continue
+            if isinstance(r.get("actual"), (int, float)):
+                self.observe(ts, float(r["actual"]))
+            if isinstance(r.get("published"), dict):
+                self.record(r["published"])
+            self.last_ts = max(self.last_ts, ts)
+
+    # ---------------- read ----------------
+
+    def apply(self, fc: Dict[str, Any]) -> Dict[str, Any]:
+        """busyness -> P50 and low / high -> P10 / P90 wherever the model has residual history.
+
+        The raw model output is kept as "point"; the ledger scores residuals against it.
+        """
+        m = self.models.get(fc["model"])
+        if m is None:
+            fc["interval"] = "parametric"
+            return fc
+        point = fc.get("point", fc["busyness"])
+        bus, low, high = list(point), list(fc["low"]), list(fc["high"])
+        empirical = 0
+        for k in range(len(bus)):
+            q, n = m.digest_for(fc["start_ts"] + k * fc["step"], k + 1)
+            if q is None:
+                continue
+            p10, p50, p90 = (point[k] + q.quantile(p) for p in _levels(n))
+            bus[k] = int(round(min(max(p50, 0), 100)))
+            low[k] = int(min(max(p10, 0), 100))
+            high[k] = int(min(max(p90, 0), 100))
+            empirical += 1
+        fc["point"], fc["busyness"], fc["low"], fc["high"] = point, bus, low, high
+        fc["interval"] = "empirical" if empirical == len(bus) else "mixed" if empirical else "parametric"
+        return fc
+
+    def coverage_report(self) -> Dict[str, Any]:
+        """Per model and horizon bucket: share of actuals below / inside / above the published band."""
+        out = {}
+        for name, m in sorted(self.models.items()):
+            rows = []
+            tot = [0, 0, 0, 0]
+            for b, c in enumerate(m.coverage):
+                tot = [a + x for a, x in zip(tot, c)]
+                if c[0]:
+                    rows.append({"steps": step_label(b), "n": c[0], "below": round(c[1] / c[0], 3),
+                                 "inside": round(c[2] / c[0], 3), "above": round(c[3] / c[0], 3)})
+            out[name] = {
+                "n": tot[0],
+                "inside": round(tot[2] / tot[0], 3) if tot[0] else None,
+                "nominal": round(NOMINAL_COVERAGE, 2),
+                "by_step": rows,
+            }
+        return out
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": VERSION,
+            "step_edges": list(STEP_EDGES),
+            "half_life_days": self.half_life / DAY,
+            "last_ts": self.last_ts,
+            "models": {k: m.to_dict() for k, m in sorted(self.models.items())},
+            "ledger": self.ledger,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ForecastIntervals":
+        fi = cls(float(d.get("half_life_days", HALF_LIFE_DAYS)))
+        fi.models = {k: _ModelResiduals.from_dict(v, fi.half_life) for k, v in (d.get("models") or {}).items()}
+        fi.ledger = list(d.get("ledger") or [])
+        fi.last_ts = int(d.get("last_ts", 0))
+        return fi
+
+    def save(self, path: str = INTERVALS_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_intervals(path: str = INTERVALS_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                   last_ts: Optional[int] = None) -> ForecastIntervals:
+    """Load persisted state; if there is none (or it has not seen `last_ts`, the forecasts store's
+    newest row), replay `bootstrap` rows once."""
+    d = codec.read(path)
+    if (isinstance(d, dict) and d.get("version") == VERSION and d.get("step_edges") == list(STEP_EDGES)
+            and int(d.get("last_ts") or 0) >= (last_ts or 0)):
+        return ForecastIntervals.from_dict(d)
+    fi = ForecastIntervals()
+    if bootstrap is not None:
+        fi.update_many(bootstrap)
+    return fi
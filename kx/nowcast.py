@@ -0,0 +1,155 @@
+"""
+Kalman-filter nowcaster: local level + hour-of-week seasonal, persisted between runs.
+
+State x = [L, s_0 .. s_167]: a random-walk level and one random-walk seasonal
+effect per London local hour of week (kx.calendar_table). A run at hour-of-week h observes
+    y = L + s_h + noise(R)
+where y is the pipeline's heuristic busyness. The filter fuses y with the
+prior and publishes L + s_h with its standard deviation.
+
+Covariance is kept as var(L), var(s_j) and cov(L, s_j); the seasonal slots
+are treated as uncorrelated with each other (they only ever meet through L),
+so an update is O(168) work and the state is ~4 KB whatever the history length:
+data/models/nowcast_state.json.
+
+Outlying runs (|innovation| > GATE innovation std's) get their noise inflated
+Huber-style, so one 100-busyness run moves the nowcast only a little.
+"""
+
+from __future__ import annotations
+import math, os
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from . import codec
+from . import calendar_table as cal
+from .paths import MODELS_DIR
+from .timeutil import HOUR, epoch_of
+
+NOWCAST_FILE = os.path.join(MODELS_DIR, "nowcast_state.json")
+VERSION = 2
+SLOTS = 168
+
+LEVEL_INIT, LEVEL_VAR_INIT = 55.0, 20.0 ** 2
+SEASON_VAR_INIT = 10.0 ** 2
+Q_LEVEL = 2.0 ** 2          # level drift variance per hour
+Q_SEASON = 1.0 ** 2         # seasonal drift variance per week (spread over the hours)
+R_OBS = 12.0 ** 2           # noise of the heuristic busyness
+GATE = 2.5
+MAX_GAP_HOURS = 24 * 14     # cap the predict step after long outages
+Z90 = 1.2816
+
+
+class Nowcaster:
+    def __init__(self):
+        self.level = LEVEL_INIT
+        self.p_level = LEVEL_VAR_INIT
+        self.season = np.zeros(SLOTS)
+        self.p_season = np.full(SLOTS, SEASON_VAR_INIT)
+        self.cov = np.zeros(SLOTS)  # cov(L, s_j)
+        self.last_ts = 0
+
+    # ---------------- filter ----------------
+
+    def _predict(self, ts: int):
+        if not self.last_ts:
+            return
+        dt = min(max(ts - self.last_ts, 0) / HOUR, MAX_GAP_HOURS)
+        self.p_level += Q_LEVEL * dt
+        self.p_season += Q_SEASON * dt / SLOTS
+
+    def estimate(self, ts: int) -> Dict[str, float]:
+        """Prior mean and variance of L + s_h at ts (no update)."""
+        h = cal.local_hour_of_week(ts)
+        dt = min(max(ts - self.last_ts, 0) / HOUR, MAX_GAP_HOURS) if self.last_ts else 0.0
+        var = (self.p_level + Q_LEVEL * dt) + (self.p_season[h] + Q_SEASON * dt / SLOTS) + 2 * self.cov[h]
+        return {"mean": self.level + self.season[h], "var": max(var, 0.0)}
+
+    def update(self, ts: int, y: float) -> Optional[Dict[str, Any]]:
+        """One predict + correct step; returns the published nowcast (None for replays)."""
+        if ts <= self.last_ts:
+            return None  # already applied (re-runs, replays)
+        self._predict(ts)
+        h = cal.local_hour_of_week(ts)
+        v = float(y - (self.level + self.season[h]))
+
+        # cov(state, L + s_h): level, then every slot (s_h also has its own variance)
+        g_level = self.p_level + self.cov[h]
+        g_season = self.cov.copy()
+        g_season[h] += self.p_season[h]
+        var_pred = g_level + g_season[h]
+
+        r = R_OBS
+        s = var_pred + r
+        if abs(v) > GATE * math.sqrt(s):
+            r *= (abs(v) / (GATE * math.sqrt(s))) ** 2
+            s = var_pred + r
+
+        self.level += g_level / s * v
+        self.season += g_season / s * v
+        self.p_level -= g_level * g_level / s
+        self.p_season -= g_season * g_season / s
+        self.cov -= g_level * g_season / s
+        self.last_ts = ts
+
+        mean = float(self.level + self.season[h])
+        std = math.sqrt(max(float(self.p_level + self.p_season[h] + 2 * self.cov[h]), 0.0))
+        return {
+            "busyness": int(round(min(max(mean, 0), 100))),
+            "std": round(std, 2),
+            "low": int(min(max(mean - Z90 * std, 0), 100)),
+            "high": int(min(max(mean + Z90 * std, 0), 100)),
+            "raw": y,
+            "innovation": round(v, 2),
+            "gated": r > R_OBS,
+        }
+
+    def update_many(self, rows: Iterable[Dict[str, Any]], key: str = "busyness"):
+        for r in rows:
+            v = r.get(key)
+            ts = epoch_of(r)
+            if ts is None or not isinstance(v, (int, float)):
+                continue
+            self.update(ts, float(v))
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        r = lambda xs: [round(float(x), 4) for x in xs]
+        return {
+            "version": VERSION,
+            "last_ts": self.last_ts,
+            "level": round(self.level, 4),
+            "p_level": round(self.p_level, 4),
+            "season": r(self.season),
+            "p_season": r(self.p_season),
+            "cov": r(self.cov),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Nowcaster":
+        n = cls()
+        n.last_ts = int(d.get("last_ts", 0))
+        n.level = float(d.get("level", LEVEL_INIT))
+        n.p_level = float(d.get("p_level", LEVEL_VAR_INIT))
+        for k in ("season", "p_season", "cov"):
+            if len(d.get(k) or []) == SLOTS:
+                setattr(n, k, np.asarray(d[k], dtype=float))
+        return n
+
+    def save(self, path: str = NOWCAST_FILE):
+        codec.write(path, self.to_dict())
+
+
+def load_nowcaster(path: str = NOWCAST_FILE, bootstrap: Optional[Iterable[Dict[str, Any]]] = None,
+                   last_ts: Optional[int] = None) -> Nowcaster:
+    """Load persisted state; if there is none (or it has not seen `last_ts`, the store's newest row),
+    filter `bootstrap` rows once."""
+    d = codec.read(path)
+    if isinstance(d, dict) and d.get("version") == VERSION and int(d.get("last_ts") or 0) >= (last_ts or 0):
+        return Nowcaster.from_dict(d)
+    n = Nowcaster()
+    if bootstrap is not None:
+        n.update_many(bootstrap)
+    return n
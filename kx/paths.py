@@ -0,0 +1,20 @@
+import os
+
+# All paths are relative to the repo root, same as the scripts.
+DATA_DIR = "data"
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+MODELS_DIR = os.path.join(DATA_DIR, "models")
+STORE_DIR = os.path.join(DATA_DIR, "store")
+
+DASH_FILE = os.path.join(DATA_DIR, "kingscross_dashboard.json")
+HISTORY_FILE = os.path.join(HISTORY_DIR, "kingscross_history.json")
+FORECAST_FILE = os.path.join(DATA_DIR, "forecast.json")
+OBS_FILE = os.path.join(DATA_DIR, "observations.json")
+ANOM_FILE = os.path.join(DATA_DIR, "anomalies.json")
+
+# Legacy rolled files the segment stores are seeded from on first use.
+LEGACY_FILES = {
+    "history": HISTORY_FILE,
+    "observations": OBS_FILE,
+    "anomalies": ANOM_FILE,
+}
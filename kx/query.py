@@ -0,0 +1,104 @@
+"""
+Time-range queries over the epoch-sorted stores.
+
+Stores are written in time order and every compaction re-sorts by "ts", so a
+month's rows are already sorted; month files are pruned by name, the start
+inside an archived month is located by bisecting byte offsets and only the
+rows in range are read and decoded (SegmentStore.iter_range).
+
+    python -m kx query history --from 2025-12-20 --to 2026-01-02 --fields timestamp,busyness
+    python -m kx query anomalies --last 6 --where type=volatile_demand
+    python -m kx query history --as-of 2025-12-25T12:00
+"""
+
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, List, Optional
+
+from .store import SegmentStore, open_store
+from .timeutil import epoch_of, iso
+
+Where = Optional[Callable[[Dict[str, Any]], bool]]
+
+
+class TimeSeries:
+    """Rows sorted by epoch with a parallel key list for bisect."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        rows = [r for r in rows if isinstance(r, dict) and epoch_of(r) is not None]
+        keys = [epoch_of(r) for r in rows]
+        if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)):
+            order = sorted(range(len(rows)), key=keys.__getitem__)
+            rows = [rows[i] for i in order]
+            keys = [keys[i] for i in order]
+        self.rows = rows
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.rows)
+
+    def range(self, lo: Optional[int] = None, hi: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows with lo <= ts < hi."""
+        i = 0 if lo is None else bisect_left(self.keys, lo)
+        j = len(self.keys) if hi is None else bisect_left(self.keys, hi)
+        return self.rows[i:j]
+
+    def as_of(self, t: int) -> Optional[Dict[str, Any]]:
+        """Latest row at or before t."""
+        i = bisect_right(self.keys, t)
+        return self.rows[i - 1] if i else None
+
+    def last_n(self, n: int, where: Where = None) -> List[Dict[str, Any]]:
+        if where is None:
+            return self.rows[-n:] if n else []
+        out = []
+        for r in reversed(self.rows):
+            if where(r):
+                out.append(r)
+                if len(out) >= n:
+                    break
+        return out[::-1]
+
+
+def _months_between(store: SegmentStore, lo: Optional[int], hi: Optional[int]) -> List[str]:
+    lo_m = iso(lo)[:7] if lo is not None else None
+    hi_m = iso(hi)[:7] if hi is not None else None
+    return [m for m in store.months() if (lo_m is None or m >= lo_m) and (hi_m is None or m <= hi_m)]
+
+
+def load_series(name: str, lo: Optional[int] = None, hi: Optional[int] = None) -> TimeSeries:
+    """Rows with lo <= ts < hi; only the month files overlapping the range are read."""
+    store = open_store(name)
+    rows: List[Dict[str, Any]] = []
+    for m in _months_between(store, lo, hi):
+        rows.extend(store.iter_range(m, lo, hi))
+    return TimeSeries(rows)
+
+
+def query_range(name: str, lo: Optional[int], hi: Optional[int], where: Where = None) -> List[Dict[str, Any]]:
+    rows = load_series(name, lo, hi).range(lo, hi)
+    return [r for r in rows if where(r)] if where else rows
+
+
+def query_last(name: str, n: int, where: Where = None) -> List[Dict[str, Any]]:
+    """Last n (matching) rows, walking months backwards until enough are found."""
+    store = open_store(name)
+    found: List[Dict[str, Any]] = []
+    for m in reversed(store.months()):
+        ts = TimeSeries(list(store.iter_month(m)))
+        found = ts.last_n(n - len(found), where) + found
+        if len(found) >= n:
+            break
+    return found
+
+
+def query_as_of(name: str, t: int, where: Where = None) -> Optional[Dict[str, Any]]:
+    store = open_store(name)
+    for m in reversed(_months_between(store, None, t)):
+        ts = TimeSeries(list(store.iter_range(m, None, t + 1)))
+        rows = ts.rows
+        if where:
+            rows = [r for r in rows if where(r)]
+        if rows:
+            return rows[-1]
+    return None
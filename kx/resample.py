@@ -0,0 +1,107 @@
+"""
+Regular-grid resampling of the irregular runs.
+
+Runs land at irregular times (04:05, 05:45, 06:40 ...) and cron skips hours,
+so "the last N rows" is not "the last N hours". to_grid() maps columns of runs
+(kx.columns form) onto a regular grid of STEPS (15 min or hourly slots):
+- per slot: run count, observed mask and the mean (or min / max / last) of
+  each field, NaN where the slot has no finite value
+- fill(): linear interpolation or forward fill across gaps of at most `limit`
+  slots, whole-array NumPy; longer gaps stay NaN
+- gaps(): (first slot, length) of every run of missing slots
+- recent(): the grid over the last N slots ending at a given time, for
+  detectors that need true time windows
+
+    g = to_grid(d["ts"], {"busyness": d["busyness"]}, step=STEPS["15min"])
+    bus = fill(g["busyness"], limit=4)            # bridge gaps up to an hour
+"""
+
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .timeutil import HOUR
+
+STEPS = {"15min": 15 * 60, "hour": HOUR}
+AGGREGATES = ("mean", "min", "max", "last")
+
+
+def to_grid(ts: np.ndarray, cols: Dict[str, np.ndarray], step: int = HOUR,
+            lo: Optional[int] = None, hi: Optional[int] = None, agg: str = "mean") -> Dict[str, np.ndarray]:
+    """Slots [lo, hi) floored to `step` (default: first .. last run); runs outside are dropped."""
+    ts = np.asarray(ts, dtype=np.int64)
+    s0 = (int(ts.min()) if lo is None else int(lo)) // step
+    s1 = (int(ts.max()) // step + 1) if hi is None else -(-int(hi) // step)
+    n = max(s1 - s0, 0)
+    idx = ts // step - s0
+    inside = (idx >= 0) & (idx < n)
+    idx = idx[inside].astype(int)
+    out = {"ts": (s0 + np.arange(n, dtype=np.int64)) * step}
+    count = np.bincount(idx, minlength=n)
+    out["count"] = count
+    out["observed"] = count > 0
+    for name, x in cols.items():
+        x = np.asarray(x, dtype=float)[inside]
+        ok = ~np.isnan(x)
+        out[name] = _aggregate(idx[ok], x[ok], n, agg)
+    return out
+
+
+def _aggregate(idx: np.ndarray, x: np.ndarray, n: int, agg: str) -> np.ndarray:
+    if agg == "mean":
+        s = np.bincount(idx, weights=x, minlength=n)
+        c = np.bincount(idx, minlength=n)
+        with np.errstate(invalid="ignore"):
+            return np.where(c > 0, s / np.maximum(c, 1), np.nan)
+    out = np.full(n, np.nan)
+    if agg == "last":
+        out[idx] = x  # later runs overwrite earlier ones (runs are time-ordered)
+    elif agg == "max":
+        np.fmax.at(out, idx, x)
+    elif agg == "min":
+        np.fmin.at(out, idx, x)
+    else:
+        raise ValueError(f"agg must be one of {AGGREGATES}")
+    return out
+
+
+def fill(x: np.ndarray, limit: int, method: str = "linear") -> np.ndarray:
+    """Fill NaN gaps of at most `limit` slots; linear needs values on both sides, ffill only before."""
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    ok = ~np.isnan(x)
+    if not ok.any() or limit <= 0:
+        return x.copy()
+    i = np.arange(n)
+    prev = np.where(ok, i, -1)
+    np.maximum.accumulate(prev, out=prev)
+    if method == "ffill":
+        use = ~ok & (prev >= 0) & (i - prev <= limit)
+        out = x.copy()
+        out[use] = x[prev[use]]
+        return out
+    if method != "linear":
+        raise ValueError("method must be 'linear' or 'ffill'")
+    nxt = np.where(ok, i, n)
+    nxt = np.minimum.accumulate(nxt[::-1])[::-1]
+    use = ~ok & (prev >= 0) & (nxt < n) & (nxt - prev - 1 <= limit)
+    out = x.copy()
+    out[use] = np.interp(i[use], i[ok], x[ok])
+    return out
+
+
+def gaps(observed: np.ndarray) -> List[Tuple[int, int]]:
+    """(first slot, length) of each run of unobserved slots."""
+    miss = np.concatenate([[False], ~np.asarray(observed, dtype=bool), [False]])
+    d = np.diff(miss.astype(np.int8))
+    starts, ends = np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+    return [(int(a), int(b - a)) for a, b in zip(starts, ends)]
+
+
+def recent(ts: Sequence[int], values: Sequence[float], end: int, slots: int, step: int = HOUR,
+           agg: str = "mean") -> Dict[str, np.ndarray]:
+    """The `slots` grid slots up to and including the one containing `end`, under "value"."""
+    s_end = (int(end) // step + 1) * step
+    return to_grid(np.asarray(ts, dtype=np.int64), {"value": np.asarray(values, dtype=float)},
+                   step, lo=s_end - slots * step, hi=s_end, agg=agg)
@@ -0,0 +1,110 @@
+"""
+Sparse rollup cube: counts and moments per combination of dimension values.
+
+Each cell is [n, sum, sum of squares, min, max] of one measure (anomaly
+confidence), so any projection gives counts, mean, std and range without
+touching raw rows:
+
+    cube = Cube(("type", "severity", "hour"))
+    cube.add(("volatile_demand", "low", 14), 0.55)
+    cube.counts("type")                       # {"volatile_demand": 1}
+    cube.moments(where={"severity": "low"})   # {"n": 1, "avg": 0.55, ...}
+"""
+
+from __future__ import annotations
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Cell = List[float]
+
+
+def _empty() -> Cell:
+    return [0, 0.0, 0.0, math.inf, -math.inf]
+
+
+def _merge(into: Cell, c: Cell):
+    into[0] += c[0]
+    into[1] += c[1]
+    into[2] += c[2]
+    into[3] = min(into[3], c[3])
+    into[4] = max(into[4], c[4])
+
+
+class Cube:
+    def __init__(self, dims: Sequence[str]):
+        self.dims = tuple(dims)
+        self.cells: Dict[Tuple, Cell] = {}
+
+    def add(self, key: Tuple, x: Optional[float] = None):
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = _empty()
+        cell[0] += 1
+        if isinstance(x, (int, float)):
+            cell[1] += x
+            cell[2] += x * x
+            cell[3] = min(cell[3], x)
+            cell[4] = max(cell[4], x)
+
+    @property
+    def n(self) -> int:
+        return int(sum(c[0] for c in self.cells.values()))
+
+    # ---------------- projections ----------------
+
+    def _match(self, where: Optional[Dict[str, Any]]):
+        if not where:
+            return lambda key: True
+        idx = [(self.dims.index(d), v) for d, v in where.items()]
+        return lambda key: all(key[i] == v for i, v in idx)
+
+    def project(self, dims: Iterable[str], where: Optional[Dict[str, Any]] = None) -> Dict[Tuple, Cell]:
+        """Cells summed over every dimension not in `dims`."""
+        pos = [self.dims.index(d) for d in dims]
+        match = self._match(where)
+        out: Dict[Tuple, Cell] = {}
+        for key, cell in self.cells.items():
+            if not match(key):
+                continue
+            k = tuple(key[i] for i in pos)
+            if k not in out:
+                out[k] = _empty()
+            _merge(out[k], cell)
+        return out
+
+    def counts(self, dim: str, where: Optional[Dict[str, Any]] = None) -> Dict[Any, int]:
+        """value -> count along one dimension, most frequent first."""
+        p = self.project([dim], where)
+        return {k[0]: int(c[0]) for k, c in sorted(p.items(), key=lambda kv: -kv[1][0])}
+
+    def moments(self, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        c = self.project([], where).get((), _empty())
+        n = c[0]
+        if not n:
+            return {"n": 0, "avg": None, "std": None, "min": None, "max": None}
+        mean = c[1] / n
+        return {
+            "n": int(n),
+            "avg": mean,
+            "std": max(c[2] / n - mean * mean, 0.0) ** 0.5,
+            "min": c[3] if c[3] != math.inf else None,
+            "max": c[4] if c[4] != -math.inf else None,
+        }
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        rows = []
+        for key, (n, s, ss, lo, hi) in sorted(self.cells.items(), key=lambda kv: [str(k) for k in kv[0]]):
+            rows.append(list(key) + [int(n), round(s, 6), round(ss, 6),
+                                     None if lo == math.inf else lo, None if hi == -math.inf else hi])
+        return {"dims": list(self.dims), "cells": rows}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Cube":
+        cube = cls(d.get("dims") or [])
+        k = len(cube.dims)
+        for row in d.get("cells") or []:
+            n, s, ss, lo, hi = row[k:]
+            cube.cells[tuple(row[:k])] = [n, s, ss, math.inf if lo is None else lo, -math.inf if hi is None else hi]
+        return cube
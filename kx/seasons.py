@@ -0,0 +1,224 @@
+"""
+Year-over-year comparison of the Christmas / New Year season.
+
+Runs are aligned by day of season (days relative to 25 December of the
+season's year, so 31 Dec is always day +6 whatever the weekday) and hour. A
+season is named after its December: season 2025 = Jul 2025 - Jun 2026, and
+only days DAY_FROM..DAY_TO (20 Nov - 15 Jan) are compared.
+
+Everything is NumPy group-bys (np.bincount) over the columnar view of the
+stores (kx.columns), so several years compare in well under a second:
+
+    python -m kx yoy                          # latest season vs every earlier one
+    python -m kx yoy --season 2026 --vs 2025
+
+The report is stored under "year_over_year" in data/seasonal_insights_<season>.json:
+- seasons      runs, mean, std and anomaly rate (anomalies per run) per season
+- comparisons  per reference season: overall / per phase / per day deltas,
+               volatility ratios (within-day std, target / reference),
+               anomaly-rate differences and the largest per-slot (day, hour) deltas
+"""
+
+from __future__ import annotations
+import os, datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from . import codec
+from .columns import columns
+from .paths import DATA_DIR
+from .timeutil import DAY, HOUR, epoch, holiday_phase
+
+DAY_FROM, DAY_TO = -35, 21
+N_DAYS = DAY_TO - DAY_FROM + 1
+N_SLOTS = N_DAYS * 24
+TOP_SLOTS = 10
+
+SOURCE_FIELDS = {"history": "busyness", "observations": "signals.busyness"}
+
+
+def insights_file(season: int) -> str:
+    return os.path.join(DATA_DIR, f"seasonal_insights_{season}.json")
+
+
+# ---------------- alignment ----------------
+
+def _phase_table() -> List[str]:
+    # phases are fixed calendar days, so they map 1:1 onto days of season
+    xmas = datetime.datetime(2001, 12, 25)
+    return [holiday_phase(epoch(xmas + datetime.timedelta(days=d))) for d in range(DAY_FROM, DAY_TO + 1)]
+
+
+PHASE_OF_DAY = _phase_table()
+PHASE_NAMES = sorted(set(PHASE_OF_DAY), key=PHASE_OF_DAY.index)
+_PHASE_IDX = np.array([PHASE_NAMES.index(p) for p in PHASE_OF_DAY])
+
+
+def align(ts: np.ndarray) -> Dict[str, np.ndarray]:
+    """season, day of season and hour for each epoch (UTC)."""
+    days = ts // DAY
+    d = days.astype("datetime64[D]")
+    year = d.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = d.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    season = np.where(month >= 7, year, year - 1)
+    dec = (season - 1970).astype("datetime64[Y]").astype("datetime64[M]") + 11
+    xmas = dec.astype("datetime64[D]").astype(np.int64) + 24
+    return {"season": season, "day": days - xmas, "hour": (ts // HOUR) % 24}
+
+
+def _in_window(a: Dict[str, np.ndarray]) -> np.ndarray:
+    return (a["day"] >= DAY_FROM) & (a["day"] <= DAY_TO)
+
+
+# ---------------- group-bys ----------------
+
+def _moments(key: np.ndarray, x: np.ndarray, size: int):
+    n = np.bincount(key, minlength=size).astype(float)
+    s = np.bincount(key, weights=x, minlength=size)
+    ss = np.bincount(key, weights=x * x, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s / n
+        var = np.where(n > 1, (ss - n * mean * mean) / np.maximum(n - 1, 1), np.nan)
+    return n, mean, np.sqrt(np.maximum(var, 0.0))
+
+
+def season_tables(source: str = "history") -> Dict[str, Any]:
+    """Per season: slot (day x hour), day and phase moments plus anomaly counts."""
+    field = SOURCE_FIELDS[source]
+    cols = columns(source, [field])
+    ok = ~np.isnan(cols[field])
+    ts, x = cols["ts"][ok], cols[field][ok]
+    a = align(ts)
+    w = _in_window(a)
+    ts, x = ts[w], x[w]
+    a = {k: v[w] for k, v in a.items()}
+
+    seasons = sorted(int(s) for s in np.unique(a["season"]))
+    s_idx = np.searchsorted(seasons, a["season"])
+    day = a["day"] - DAY_FROM
+    k = len(seasons)
+
+    slot = s_idx * N_SLOTS + day * 24 + a["hour"]
+    dkey = s_idx * N_DAYS + day
+    pkey = s_idx * len(PHASE_NAMES) + _PHASE_IDX[day]
+
+    an = align(columns("anomalies")["ts"])
+    aw = _in_window(an) & np.isin(an["season"], seasons)
+    a_s = np.searchsorted(seasons, an["season"][aw])
+    a_day = an["day"][aw] - DAY_FROM
+
+    out = {"seasons": seasons}
+    out["slot"] = _moments(slot, x, k * N_SLOTS)
+    out["day"] = _moments(dkey, x, k * N_DAYS)
+    out["phase"] = _moments(pkey, x, k * len(PHASE_NAMES))
+    out["season"] = _moments(s_idx, x, k)
+    out["anoms_day"] = np.bincount(a_s * N_DAYS + a_day, minlength=k * N_DAYS).astype(float)
+    out["anoms_phase"] = np.bincount(a_s * len(PHASE_NAMES) + _PHASE_IDX[a_day], minlength=k * len(PHASE_NAMES)).astype(float)
+    out["anoms_season"] = np.bincount(a_s, minlength=k).astype(float)
+    return out
+
+
+# ---------------- comparison ----------------
+
+def _r(v, nd=2):
+    return None if v is None or not np.isfinite(v) else round(float(v), nd)
+
+
+def _rate(anoms, runs):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(runs > 0, anoms / runs, np.nan)
+
+
+def _block(t, kind, i, j, size):
+    """Comparison rows for one grouping; i / j are season indices (target / reference)."""
+    n, mean, std = t[kind]
+    an = t["anoms_" + kind]
+    a, b = slice(i * size, (i + 1) * size), slice(j * size, (j + 1) * size)
+    both = (n[a] > 0) & (n[b] > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vol = std[a] / std[b]
+    return {
+        "both": both,
+        "delta": mean[a] - mean[b],
+        "vol_ratio": vol,
+        "rate_delta": _rate(an[a], n[a]) - _rate(an[b], n[b]),
+        "runs": (n[a], n[b]),
+    }
+
+
+def compare(t: Dict[str, Any], season: int, ref: int) -> Dict[str, Any]:
+    i, j = t["seasons"].index(season), t["seasons"].index(ref)
+
+    n, mean, std = t["season"]
+    rate = _rate(t["anoms_season"], n)
+
+    # per slot (day x hour): mean deltas where both seasons have runs
+    sn, smean, _ = t["slot"]
+    a, b = slice(i * N_SLOTS, (i + 1) * N_SLOTS), slice(j * N_SLOTS, (j + 1) * N_SLOTS)
+    both = (sn[a] > 0) & (sn[b] > 0)
+    delta = np.where(both, smean[a] - smean[b], np.nan)
+    idx = np.where(both)[0]
+    top = idx[np.argsort(-np.abs(delta[idx]))[:TOP_SLOTS]]
+
+    d = _block(t, "day", i, j, N_DAYS)
+    by_day = [
+        {"day": int(k + DAY_FROM), "phase": PHASE_OF_DAY[k], "delta": _r(d["delta"][k]),
+         "volatility_ratio": _r(d["vol_ratio"][k]), "anomaly_rate_delta": _r(d["rate_delta"][k], 3)}
+        for k in np.where(d["both"])[0]
+    ]
+    p = _block(t, "phase", i, j, len(PHASE_NAMES))
+    by_phase = {
+        PHASE_NAMES[k]: {"delta": _r(p["delta"][k]), "volatility_ratio": _r(p["vol_ratio"][k]),
+                         "anomaly_rate_delta": _r(p["rate_delta"][k], 3),
+                         "runs": [int(p["runs"][0][k]), int(p["runs"][1][k])]}
+        for k in np.where(p["both"])[0]
+    }
+    return {
+        "season": season,
+        "vs": ref,
+        "slots_compared": int(both.sum()),
+        "days_compared": len(by_day),
+        "mean_delta": _r(mean[i] - mean[j]),
+        "mean_slot_delta": _r(np.nanmean(delta)) if both.any() else None,
+        "volatility_ratio": _r(std[i] / std[j]) if std[j] else None,
+        "median_day_volatility_ratio": _r(np.nanmedian(d["vol_ratio"][d["both"]])) if d["both"].any() else None,
+        "anomaly_rate_delta": _r(rate[i] - rate[j], 3),
+        "by_phase": by_phase,
+        "by_day": by_day,
+        "largest_slot_deltas": [
+            {"day": int(s // 24 + DAY_FROM), "hour": int(s % 24), "delta": _r(delta[s])} for s in top
+        ],
+    }
+
+
+def yoy_report(season: Optional[int] = None, refs: Optional[List[int]] = None, source: str = "history") -> Dict[str, Any]:
+    t = season_tables(source)
+    seasons = t["seasons"]
+    if not seasons:
+        return {"source": source, "seasons": {}, "comparisons": []}
+    season = season if season is not None else seasons[-1]
+    if refs is None:
+        refs = [s for s in seasons if s < season]
+    n, mean, std = t["season"]
+    rate = _rate(t["anoms_season"], n)
+    return {
+        "source": source,
+        "window": {"from_day": DAY_FROM, "to_day": DAY_TO, "anchor": "12-25"},
+        "seasons": {
+            str(s): {"runs": int(n[k]), "mean": _r(mean[k]), "std": _r(std[k]), "anomaly_rate": _r(rate[k], 3)}
+            for k, s in enumerate(seasons)
+        },
+        "comparisons": [compare(t, season, r) for r in refs if r in seasons and r != season and season in seasons],
+    }
+
+
+def write_report(report: Dict[str, Any], season: int, path: Optional[str] = None) -> str:
+    """Store the report under "year_over_year", keeping the rest of the insights file."""
+    path = path or insights_file(season)
+    doc = codec.read(path, {})
+    if not isinstance(doc, dict):
+        doc = {}
+    doc["year_over_year"] = report
+    codec.write(path, doc)
+    return path
@@ -0,0 +1,193 @@
+"""
+Bounded-memory quantile sketch (merging t-digest) with exponential time decay.
+
+- add() appends to a small buffer; a full buffer is sorted and merged into the
+  centroid list, so updates cost amortised O(log k) for k centroids.
+- quantile(), cdf(), median() and mad() read the centroids directly.
+- Decay: a sample at time ts weighs 2 ** ((ts - t0) / half_life), i.e. newer
+  samples weigh more; weights are renormalised when the exponent grows large.
+
+Used per seasonal-baseline bucket (kx.baseline) so one 100-busyness outlier
+run shifts the median/MAD far less than it shifts a mean/std.
+"""
+
+from __future__ import annotations
+import math
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional
+
+COMPRESSION = 20.0
+MAD_TO_STD = 1.4826
+_RESCALE_AT = 40.0  # renormalise once weights span 2**40
+
+
+class TDigest:
+    def __init__(self, compression: float = COMPRESSION, half_life: Optional[float] = None):
+        self.compression = compression
+        self.half_life = half_life
+        self.t0 = None
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.total = 0.0
+        self.lo = math.inf
+        self.hi = -math.inf
+        self._buf: List[tuple] = []
+        self._knots = None  # (xs, cum) cache for cdf, rebuilt after a merge
+
+    # ---------------- update ----------------
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def add(self, x: float, ts: Optional[int] = None, w: float = 1.0):
+        if self.half_life and ts is not None:
+            if self.t0 is None:
+                self.t0 = ts
+            e = (ts - self.t0) / self.half_life
+            if e > _RESCALE_AT:
+                self._rescale(2.0 ** -e)
+                self.t0 = ts
+                e = 0.0
+            w *= 2.0 ** e
+        self._buf.append((x, w))
+        self._knots = None
+        self.total += w
+        self.lo = min(self.lo, x)
+        self.hi = max(self.hi, x)
+        if len(self._buf) >= self.compression:
+            self._flush()
+
+    def _rescale(self, f: float):
+        self._knots = None
+        self.weights = [w * f for w in self.weights]
+        self._buf = [(x, w * f) for x, w in self._buf]
+        self.total *= f
+
+    def _flush(self):
+        if not self._buf:
+            return
+        pts = sorted(list(zip(self.means, self.weights)) + self._buf)
+        self._buf = []
+        total = sum(w for _, w in pts)
+        means, weights = [], []
+        cur_m, cur_w = pts[0]
+        done = 0.0
+        k_lo = self._k(0.0)
+        for m, w in pts[1:]:
+            if self._k((done + cur_w + w) / total) - k_lo <= 1.0:
+                cur_w += w
+                cur_m += (m - cur_m) * w / cur_w
+            else:
+                means.append(cur_m)
+                weights.append(cur_w)
+                done += cur_w
+                k_lo = self._k(done / total)
+                cur_m, cur_w = m, w
+        means.append(cur_m)
+        weights.append(cur_w)
+        self.means, self.weights, self.total = means, weights, total
+        self._knots = None
+
+    # ---------------- read ----------------
+
+    def __len__(self):
+        return len(self.means) + len(self._buf)
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._flush()
+        n = len(self.means)
+        if n == 0:
+            return None
+        if n == 1:
+            return self.means[0]
+        target = q * self.total
+        # centroid i is centred at cumulative weight c_i = sum(w[:i]) + w[i]/2
+        cum = 0.0
+        prev_c, prev_m = 0.0, self.lo
+        for m, w in zip(self.means, self.weights):
+            c = cum + w / 2
+            if target <= c:
+                if c == prev_c:
+                    return m
+                return prev_m + (m - prev_m) * (target - prev_c) / (c - prev_c)
+            prev_c, prev_m = c, m
+            cum += w
+        if self.total == prev_c:
+            return self.hi
+        return prev_m + (self.hi - prev_m) * (target - prev_c) / (self.total - prev_c)
+
+    def _knot_table(self):
+        # cdf is piecewise linear through (lo, 0), (mean_i, centre_i), (hi, total)
+        self._flush()
+        if self._knots is None:
+            xs, cs = [self.lo], [0.0]
+            cum = 0.0
+            for m, w in zip(self.means, self.weights):
+                xs.append(m)
+                cs.append(cum + w / 2)
+                cum += w
+            xs.append(self.hi)
+            cs.append(self.total)
+            self._knots = (xs, cs)
+        return self._knots
+
+    def cdf(self, x: float) -> float:
+        if not self.means and not self._buf:
+            return 0.0
+        xs, cs = self._knot_table()
+        if x < xs[0]:
+            return 0.0
+        if x >= xs[-1]:
+            return 1.0
+        i = bisect_right(xs, x)
+        x0, x1, c0, c1 = xs[i - 1], xs[i], cs[i - 1], cs[i]
+        c = c1 if x1 == x0 else c0 + (c1 - c0) * (x - x0) / (x1 - x0)
+        return c / self.total
+
+    def median(self) -> Optional[float]:
+        return self.quantile(0.5)
+
+    def mad(self) -> Optional[float]:
+        """Median absolute deviation: smallest t with P(|X - median| <= t) >= 1/2."""
+        med = self.median()
+        if med is None:
+            return None
+        xs, _ = self._knot_table()
+        g = lambda t: self.cdf(med + t) - self.cdf(med - t)
+        # g is piecewise linear between the knot distances |x_i - median|
+        prev_t, prev_g = 0.0, g(0.0)
+        if prev_g >= 0.5:
+            return 0.0
+        for t in sorted(set(abs(x - med) for x in xs)):
+            if t <= prev_t:
+                continue
+            gt = g(t)
+            if gt >= 0.5:
+                if gt == prev_g:
+                    return t
+                return prev_t + (t - prev_t) * (0.5 - prev_g) / (gt - prev_g)
+            prev_t, prev_g = t, gt
+        return prev_t
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._flush()
+        return {
+            "c": [[round(m, 3), round(w, 6)] for m, w in zip(self.means, self.weights)],
+            "lo": self.lo,
+            "hi": self.hi,
+            "t0": self.t0,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], compression: float = COMPRESSION, half_life: Optional[float] = None) -> "TDigest":
+        t = cls(compression, half_life)
+        for m, w in d.get("c", []):
+            t.means.append(float(m))
+            t.weights.append(float(w))
+        t.total = sum(t.weights)
+        t.lo = float(d.get("lo", min(t.means, default=math.inf)))
+        t.hi = float(d.get("hi", max(t.means, default=-math.inf)))
+        t.t0 = d.get("t0")
+        return t
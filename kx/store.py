@@ -0,0 +1,257 @@
+"""
+Append-only segment store for the hourly time series (history, observations, anomalies).
+
+Layout, per store (e.g. data/store/history/):
+- segments/YYYY-MM/YYYYMMDDTHHMMSSZ.json   one small immutable file per run
+- archive/YYYY-MM.jsonl                     a compacted month, one record per line
+
+Every record carries an integer "ts" (epoch seconds) next to its ISO "timestamp".
+
+Hourly runs only ever add a new segment file, so a commit carries a few hundred
+bytes instead of a rewrite of the whole history. `python -m kx compact` folds
+closed months into their archive file (run from the workflow; a no-op most hours).
+"""
+
+from __future__ import annotations
+import os, sys, datetime
+from typing import List, Dict, Any, Iterator, Optional
+
+from . import codec
+from .timeutil import epoch_of, with_epoch
+from .paths import STORE_DIR, LEGACY_FILES
+
+STORES = ("history", "observations", "anomalies", "forecasts")
+
+
+def _month_of(rec: Dict[str, Any]) -> Optional[str]:
+    ts = rec.get("timestamp")
+    if isinstance(ts, str) and len(ts) >= 7 and ts[4] == "-":
+        return ts[:7]
+    return None
+
+
+def _stamp(ts: str) -> str:
+    # "2026-08-22T23:10:35Z" -> "20260822T231035Z"
+    return ts[:19].replace("-", "").replace(":", "") + "Z"
+
+
+class SegmentStore:
+    def __init__(self, name: str, root: str = STORE_DIR):
+        self.name = name
+        self.root = os.path.join(root, name)
+        self.seg_dir = os.path.join(self.root, "segments")
+        self.arc_dir = os.path.join(self.root, "archive")
+
+    # ---------------- layout ----------------
+
+    def _archive_path(self, month: str) -> str:
+        return os.path.join(self.arc_dir, f"{month}.jsonl")
+
+    def _segment_files(self, month: str) -> List[str]:
+        d = os.path.join(self.seg_dir, month)
+        if not os.path.isdir(d):
+            return []
+        return [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith(".json")]
+
+    def months(self) -> List[str]:
+        months = set()
+        if os.path.isdir(self.arc_dir):
+            months.update(f[:-6] for f in os.listdir(self.arc_dir) if f.endswith(".jsonl"))
+        if os.path.isdir(self.seg_dir):
+            months.update(d for d in os.listdir(self.seg_dir) if os.path.isdir(os.path.join(self.seg_dir, d)))
+        return sorted(months)
+
+    def is_empty(self) -> bool:
+        return not self.months()
+
+    # ---------------- write ----------------
+
+    def append(self, records: List[Dict[str, Any]], ts: str) -> Optional[str]:
+        """Write one immutable segment for this run. Returns its path."""
+        if not records:
+            return None
+        month = ts[:7]
+        d = os.path.join(self.seg_dir, month)
+        os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, f"{_stamp(ts)}.json")
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(d, f"{_stamp(ts)}-{n}.json")
+            n += 1
+        with open(path, "wb") as f:
+            f.write(codec.dumps([with_epoch(r) for r in records]))
+        return path
+
+    def _write_archive(self, month: str, records: List[Dict[str, Any]]):
+        os.makedirs(self.arc_dir, exist_ok=True)
+        path = self._archive_path(month)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for rec in records:
+                f.write(codec.dumps(rec))
+                f.write(b"\n")
+        os.replace(tmp, path)
+
+    def seed(self, records: List[Dict[str, Any]]) -> int:
+        """Bulk-load legacy rows straight into monthly archives."""
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for rec in records:
+            if not isinstance(rec, dict):
+                continue
+            m = _month_of(rec)
+            if m is None:
+                continue
+            by_month.setdefault(m, []).append(with_epoch(rec))
+        for month, rows in by_month.items():
+            rows.sort(key=lambda r: r.get("ts", 0))
+            self._write_archive(month, rows)
+        return sum(len(r) for r in by_month.values())
+
+    def compact(self, now: Optional[datetime.datetime] = None) -> Dict[str, int]:
+        """Fold segments of every closed month into archive/YYYY-MM.jsonl."""
+        now = now or datetime.datetime.utcnow()
+        current = now.strftime("%Y-%m")
+        done: Dict[str, int] = {}
+        for month in self.months():
+            if month >= current:
+                continue
+            files = self._segment_files(month)
+            if not files:
+                continue
+            rows = list(self.iter_month(month))
+            rows.sort(key=lambda r: r.get("ts", 0))
+            self._write_archive(month, rows)
+            for p in files:
+                os.remove(p)
+            try:
+                os.rmdir(os.path.join(self.seg_dir, month))
+            except OSError:
+                pass
+            done[month] = len(files)
+        return done
+
+    # ---------------- read ----------------
+
+    def iter_month(self, month: str) -> Iterator[Dict[str, Any]]:
+        arc = self._archive_path(month)
+        if os.path.exists(arc):
+            with open(arc, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield with_epoch(codec.loads(line))
+        for p in self._segment_files(month):
+            rows = codec.read(p)
+            if rows is None:
+                continue
+            for rec in rows if isinstance(rows, list) else [rows]:
+                if isinstance(rec, dict):
+                    yield with_epoch(rec)
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        for month in self.months():
+            yield from self.iter_month(month)
+
+    def last_ts(self) -> Optional[int]:
+        """ts of the newest record: one segment file (or the newest archive's last line) is read."""
+        for month in reversed(self.months()):
+            files = self._segment_files(month)
+            for p in reversed(files):
+                rows = codec.read(p)
+                rows = [r for r in (rows if isinstance(rows, list) else [rows]) if isinstance(r, dict)]
+                if rows:
+                    return max((epoch_of(r) or 0) for r in rows) or None
+            arc = self._archive_path(month)
+            if os.path.exists(arc):
+                with open(arc, "rb") as f:
+                    lines = [ln for ln in f.read().splitlines() if ln.strip()]
+                if lines:
+                    return epoch_of(codec.loads(lines[-1]))
+        return None
+
+    def iter_range(self, month: str, lo: Optional[int] = None, hi: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Records of one month with lo <= ts < hi. The archive is sorted by ts, so the
+        start is found by bisecting byte offsets (seek + readline, ~log n lines read and
+        decoded) and lines are read from there until one reaches hi; the rest of the
+        file is never read. The open month's segments are small and are filtered."""
+        arc = self._archive_path(month)
+        if os.path.exists(arc):
+            with open(arc, "rb") as f:
+                f.seek(0 if lo is None else _seek_ts(f, os.path.getsize(arc), lo))
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    rec = codec.loads(line)
+                    if hi is not None and (rec.get("ts") or 0) >= hi:
+                        break
+                    yield with_epoch(rec)
+        for p in self._segment_files(month):
+            rows = codec.read(p)
+            if rows is None:
+                continue
+            for rec in rows if isinstance(rows, list) else [rows]:
+                if isinstance(rec, dict):
+                    rec = with_epoch(rec)
+                    t = epoch_of(rec)
+                    if t is not None and (lo is None or t >= lo) and (hi is None or t < hi):
+                        yield rec
+
+    def read_all(self) -> List[Dict[str, Any]]:
+        return list(self.iter_records())
+
+    def tail(self, n: int) -> List[Dict[str, Any]]:
+        """Last n records, reading only as many months as needed."""
+        chunks: List[List[Dict[str, Any]]] = []
+        have = 0
+        for month in reversed(self.months()):
+            rows = list(self.iter_month(month))
+            chunks.append(rows)
+            have += len(rows)
+            if have >= n:
+                break
+        out = [r for rows in reversed(chunks) for r in rows]
+        return out[-n:] if n else []
+
+
+def _line_at(f, off: int):
+    """(start, ts) of the first non-blank line starting at or after byte `off`; (size, None) past the end."""
+    f.seek(max(off - 1, 0))
+    if off:
+        f.readline()  # finish the line before `off` (only the newline when `off` starts a line)
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line:
+            return start, None
+        if line.strip():
+            return start, codec.loads(line).get("ts") or 0  # the compaction sort key
+
+
+def _seek_ts(f, size: int, x: int) -> int:
+    """Byte offset of the first line with ts >= x in a ts-sorted JSONL file (bisect over offsets)."""
+    lo, hi = 0, size  # invariant: every line starting before lo has ts < x; the answer starts <= hi
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, ts = _line_at(f, mid)
+        if ts is None or ts >= x:
+            hi = mid
+        else:
+            lo = start + 1
+    return _line_at(f, lo)[0]
+
+
+def open_store(name: str, root: str = STORE_DIR) -> SegmentStore:
+    """Open a store, seeding it from the legacy rolled JSON file the first time."""
+    store = SegmentStore(name, root)
+    legacy = LEGACY_FILES.get(name)
+    if store.is_empty() and legacy and os.path.exists(legacy):
+        rows = codec.read(legacy, [])
+        if isinstance(rows, list) and rows:
+            n = store.seed(rows)
+            print(f"📦 Seeded store '{name}' from {legacy} ({n} rows)", file=sys.stderr)
+    return store
+
+
+def compact_all(now: Optional[datetime.datetime] = None, root: str = STORE_DIR) -> Dict[str, Dict[str, int]]:
+    return {name: SegmentStore(name, root).compact(now) for name in STORES}
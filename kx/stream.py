@@ -0,0 +1,148 @@
+"""
+Streaming readers with bounded memory.
+
+- iter_json_array(path)  incremental parse of a top-level JSON array, one item at a time
+- iter_jsonl(path)       one record per line
+- iter_records(source, start=, end=, where=)
+      source is a store name ("history", "observations", "anomalies") or a file path.
+      The time window is pushed down to the store layout (months outside it are
+      never opened); `where` is applied per record before anything is yielded.
+"""
+
+from __future__ import annotations
+import os, json, datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+from . import codec
+from .store import STORES, open_store
+from .timeutil import epoch, epoch_of, iso, parse_ts
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WS = " \t\r\n"
+
+
+def iter_json_array(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield items of a top-level JSON array without loading the whole file.
+    ValueError if it is not an array or ends before its closing ']' (an empty file yields nothing)."""
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # make sure there is something to look at
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    if started:  # a half-written file must not read as a shorter, valid one
+                        raise ValueError(f"{path}: truncated JSON array (no closing ']')")
+                    return
+                buf = f.read(chunk_size)
+                pos = 0
+                eof = not buf
+                continue
+
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"{path}: not a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            ch = buf[pos]
+            if ch == "]":
+                return
+            if ch == ",":
+                pos += 1
+                continue
+
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            # a bare number/literal at the buffer edge may be truncated ("12" of "12.5")
+            if not eof and not isinstance(item, (dict, list, str)) and (end == len(buf) or buf[end] not in _WS + ",]"):
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield item
+            pos = end
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+
+def iter_jsonl(path: str) -> Iterator[Any]:
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield codec.loads(line)
+
+
+def iter_file(path: str) -> Iterator[Any]:
+    if not os.path.exists(path):
+        return iter(())
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def _to_epoch(v: Union[str, int, datetime.datetime, None]) -> Optional[int]:
+    if v is None:
+        return None
+    if isinstance(v, int):
+        return v
+    if isinstance(v, datetime.datetime):
+        return epoch(v)
+    return parse_ts(str(v))
+
+
+def iter_records(
+    source: str,
+    start: Union[str, int, datetime.datetime, None] = None,
+    end: Union[str, int, datetime.datetime, None] = None,
+    where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Stream records in [start, end) that satisfy `where`."""
+    lo = _to_epoch(start)
+    hi = _to_epoch(end)
+
+    if source in STORES:
+        store = open_store(source)
+        lo_m = iso(lo)[:7] if lo is not None else None
+        hi_m = iso(hi)[:7] if hi is not None else None
+        rows = (
+            rec
+            for month in store.months()
+            if (lo_m is None or month >= lo_m) and (hi_m is None or month <= hi_m)
+            for rec in store.iter_month(month)
+        )
+    else:
+        rows = iter_file(source)
+
+    for rec in rows:
+        if not isinstance(rec, dict):
+            continue
+        if lo is not None or hi is not None:
+            ts = epoch_of(rec)
+            if ts is None:
+                continue
+            if lo is not None and ts < lo:
+                continue
+            if hi is not None and ts >= hi:
+                continue
+        if where is not None and not where(rec):
+            continue
+        yield rec
@@ -0,0 +1,105 @@
+"""
+Canonical timestamps: integer UTC epoch seconds.
+
+The data files carry ISO strings in several dialects ("...Z", "+00:00", naive,
+with or without microseconds). parse_ts() maps any of them to an int once and
+memoises the result; records in the stores carry it as a "ts" column next to
+"timestamp". Hour, day-of-week and holiday phase are then integer arithmetic.
+"""
+
+from __future__ import annotations
+import datetime
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+UTC = datetime.timezone.utc
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * DAY
+
+
+@lru_cache(maxsize=65536)
+def parse_ts(s: str) -> Optional[int]:
+    """ISO-8601 string -> epoch seconds (UTC). Naive strings are taken as UTC."""
+    if not isinstance(s, str) or not s:
+        return None
+    try:
+        dt = datetime.datetime.fromisoformat(s.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return int(dt.timestamp())
+
+
+def epoch(dt: datetime.datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return int(dt.timestamp())
+
+
+def to_datetime(ts: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(ts, UTC)
+
+
+def iso(ts: int) -> str:
+    return to_datetime(ts).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def epoch_of(rec: Dict[str, Any]) -> Optional[int]:
+    """The record's "ts" column, falling back to parsing "timestamp"."""
+    ts = rec.get("ts")
+    if isinstance(ts, int):
+        return ts
+    s = rec.get("timestamp")
+    return parse_ts(s) if isinstance(s, str) else None
+
+
+def with_epoch(rec: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(rec.get("ts"), int):
+        ts = epoch_of(rec)
+        if ts is not None:
+            rec["ts"] = ts
+    return rec
+
+
+# ---------------- integer calendar fields (UTC) ----------------
+
+def hour_of_day(ts: int) -> int:
+    return (ts // HOUR) % 24
+
+
+def day_of_week(ts: int) -> int:
+    # 1970-01-01 was a Thursday; Monday = 0 like datetime.weekday()
+    return (ts // DAY + 3) % 7
+
+
+def hour_of_week(ts: int) -> int:
+    return day_of_week(ts) * 24 + hour_of_day(ts)
+
+
+@lru_cache(maxsize=4096)
+def _month_day(day: int):
+    d = datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+    return d.month, d.day
+
+
+PHASES = ["normal", "christmas_period", "pre_nye", "nye", "new_year_day"]
+
+
+def phase_of(month: int, day: int) -> str:
+    """Holiday phase of a calendar date."""
+    if month == 12 and day == 31:
+        return "nye"
+    if month == 12 and 27 <= day <= 30:
+        return "pre_nye"
+    if month == 12 and 20 <= day <= 26:
+        return "christmas_period"
+    if month == 1 and day == 1:
+        return "new_year_day"
+    return "normal"
+
+
+def holiday_phase(ts: int) -> str:
+    """Phase of the UTC date; kx.calendar_table.phase() uses the London date."""
+    return phase_of(*_month_day(ts // DAY))
@@ -0,0 +1,167 @@
+"""
+Hyperparameter search for the ridge busyness model: regularisation strength x
+feature groups (kx.forecast.FEATURE_GROUPS: calendar terms, interactions, the
+busyness one week earlier), scored by expanding-window time-series CV.
+
+The runs are cut into FOLDS + 1 contiguous blocks; fold k trains on blocks
+0..k-1 and predicts block k. The full design (every group) is built once and
+each block's X'X / X'y is summed once, so a fold's Gram matrix for any feature
+subset is a prefix sum + an index. Per (subset, fold) it is eigendecomposed
+once, G = V diag(e) V', after which the whole lambda grid is one product:
+
+    W = V diag(1 / (e + lambda)) V' X'y      (features x lambdas)
+
+Scoring is a few ms per subset at the store's size, far less than starting a
+process pool, so subsets run serially unless rows x subsets reaches
+POOL_MIN_WORK (or --workers asks for a pool). The best
+(subset, lambda) by CV MAE is refitted on all runs and written to
+data/models/busyness_model.json with its groups, lambda and the CV scores;
+update_pipeline.py and train_and_forecast.py pick both up from there.
+
+    python -m kx tune-ridge
+    python -m kx tune-ridge --folds 5 --workers 4 --dry-run
+"""
+
+from __future__ import annotations
+import os, datetime, itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import codec
+from . import forecast as forecast_engine
+from .paths import DATA_DIR
+
+MODEL_FILE = os.path.join(DATA_DIR, "models", "busyness_model.json")
+LAMBDAS = np.logspace(-3, 3, 25)
+DEFAULT_LAMBDA = 0.35   # train_and_forecast.py before tuning
+FOLDS = 5
+MIN_ROWS = 24 * 7
+POOL_MIN_WORK = 400_000   # rows x subsets below which a process pool costs more than it saves
+
+
+def subsets(groups: Sequence[str] = tuple(forecast_engine.FEATURE_GROUPS)) -> List[Tuple[str, ...]]:
+    return [c for r in range(len(groups) + 1) for c in itertools.combinations(groups, r)]
+
+
+def design(d: Dict[str, np.ndarray], groups: Sequence[str]) -> np.ndarray:
+    """Rows of kx.backtest.load_history() in feature_names(groups) order (wind is not logged: 10 km/h)."""
+    lag = forecast_engine.lagged(d["ts"], d["busyness"], d["ts"]) if "lags" in groups else None
+    return forecast_engine.design_matrix(d["ts"], d["temperature"], 10.0, d["transport_stress"],
+                                         d["events_count"], groups, lag)
+
+
+# ---------------- cross-validation ----------------
+
+_STATE: Dict[str, Any] = {}
+
+
+def _init(X: np.ndarray, y: np.ndarray, bounds: Sequence[int], lambdas: np.ndarray):
+    """Per-block X'X / X'y of the full design, cumulated: training on blocks < k is entry k."""
+    G = np.stack([X[a:b].T @ X[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+    g = np.stack([X[a:b].T @ y[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+    _STATE.update(X=X, y=y, bounds=list(bounds), lambdas=np.asarray(lambdas, dtype=float),
+                  G=np.cumsum(G, axis=0), g=np.cumsum(g, axis=0))
+
+
+def _score(groups: Tuple[str, ...]) -> Dict[str, Any]:
+    """CV MAE / RMSE of one feature subset at every lambda."""
+    X, y, bounds, lams = _STATE["X"], _STATE["y"], _STATE["bounds"], _STATE["lambdas"]
+    full = forecast_engine.feature_names(tuple(forecast_engine.FEATURE_GROUPS))
+    cols = [full.index(n) for n in forecast_engine.feature_names(groups)]
+    abs_err = np.zeros(len(lams))
+    sq_err = np.zeros(len(lams))
+    n = 0
+    for k in range(1, len(bounds) - 1):
+        G = _STATE["G"][k - 1][np.ix_(cols, cols)]
+        e, V = np.linalg.eigh(G)
+        b = V.T @ _STATE["g"][k - 1][cols]
+        W = V @ (b[:, None] / (np.maximum(e, 0.0)[:, None] + lams[None, :]))
+        a, z = bounds[k], bounds[k + 1]
+        err = y[a:z, None] - X[a:z][:, cols] @ W
+        abs_err += np.abs(err).sum(axis=0)
+        sq_err += (err * err).sum(axis=0)
+        n += z - a
+    return {"groups": list(groups), "mae": abs_err / max(n, 1), "rmse": np.sqrt(sq_err / max(n, 1)), "n": n}
+
+
+def grid(lambdas: Sequence[float] = LAMBDAS) -> np.ndarray:
+    """The lambda grid actually searched: sorted, unique, DEFAULT_LAMBDA included (the untuned baseline)."""
+    return np.union1d(np.asarray(lambdas, dtype=float), [DEFAULT_LAMBDA])
+
+
+def search(d: Dict[str, np.ndarray], lambdas: Sequence[float] = LAMBDAS, folds: int = FOLDS,
+           workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Best lambda per feature subset, best first. workers=None: serial below POOL_MIN_WORK, else all cores."""
+    lambdas = grid(lambdas)
+    X = design(d, tuple(forecast_engine.FEATURE_GROUPS))
+    y = np.asarray(d["busyness"], dtype=float)
+    bounds = np.linspace(0, len(y), folds + 2).astype(int).tolist()
+    cand = subsets()
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(y) * len(cand) >= POOL_MIN_WORK else 1
+    workers = max(1, min(workers, len(cand)))
+    if workers == 1:
+        _init(X, y, bounds, lambdas)
+        parts = [_score(c) for c in cand]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(X, y, bounds, lambdas)) as ex:
+            parts = list(ex.map(_score, cand))
+
+    j = int(np.searchsorted(lambdas, DEFAULT_LAMBDA))
+    out = []
+    for p in parts:
+        i = int(np.argmin(p["mae"]))
+        out.append({"groups": p["groups"], "lam": float(lambdas[i]), "n": p["n"],
+                    "cv_mae": round(float(p["mae"][i]), 3), "cv_rmse": round(float(p["rmse"][i]), 3),
+                    "cv_mae_default_lam": round(float(p["mae"][j]), 3)})
+    return sorted(out, key=lambda r: r["cv_mae"])
+
+
+# ---------------- model ----------------
+
+def fit(d: Dict[str, np.ndarray], groups: Sequence[str] = (), lam: float = DEFAULT_LAMBDA) -> Dict[str, Any]:
+    """Ridge on all runs; same busyness_model.json layout as train_and_forecast.py plus groups / lam."""
+    groups = [g for g in forecast_engine.FEATURE_GROUPS if g in groups]
+    X = design(d, groups)
+    y = np.asarray(d["busyness"], dtype=float)
+    w = np.linalg.solve(X.T @ X + lam * np.eye(X.shape[1]), X.T @ y)
+    resid_std = float(np.clip(np.std(y - X @ w), 6.0, 18.0)) if len(y) > 1 else 10.0
+    return {
+        "trained_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "n_samples": int(len(y)),
+        "weights": w.tolist(),
+        "resid_std": resid_std,
+        "feature_order": forecast_engine.feature_names(groups),
+        "groups": groups,
+        "lam": float(lam),
+    }
+
+
+def tune(d: Dict[str, np.ndarray], lambdas: Sequence[float] = LAMBDAS, folds: int = FOLDS,
+         workers: Optional[int] = None, source: str = "history") -> Optional[Dict[str, Any]]:
+    if len(d["ts"]) < max(MIN_ROWS, folds + 2):
+        return None
+    searched = grid(lambdas)
+    results = search(d, lambdas, folds, workers)
+    best = results[0]
+    model = fit(d, best["groups"], best["lam"])
+    base = next(r for r in results if not r["groups"])
+    model["tuning"] = {
+        "tuned_at": model["trained_at"],
+        "source": source,
+        "folds": folds,
+        "lambdas": [float(searched[0]), float(searched[-1]), len(searched)],
+        "cv_mae": best["cv_mae"],
+        "cv_rmse": best["cv_rmse"],
+        "cv_mae_untuned": base["cv_mae_default_lam"],  # base features at lam=0.35
+        "results": results,
+    }
+    return model
+
+
+def write_model(model: Dict[str, Any], path: str = MODEL_FILE) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    codec.write(path, model)
+    return path
@@ -1,18 +1,16 @@
-import json
+import os
+import sys
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kx import codec
+
 DATA_DIR = Path("data")
 DASHBOARD_FILE = DATA_DIR / "kingscross_dashboard.json"
 
 # Load all sources safely
 def load_json(filename):
-    try:
-        with open(DATA_DIR / filename) as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        return {}
+    return codec.read(DATA_DIR / filename, {})
 
 dashboard = {
     "tfl": load_json("kingscross_tfl.json"),
@@ -23,8 +21,6 @@ dashboard = {
 }
 
 # Save combined dashboard
-DASHBOARD_FILE.parent.mkdir(parents=True, exist_ok=True)
-with open(DASHBOARD_FILE, "w") as f:
-    json.dump(dashboard, f, indent=2)
+codec.write(DASHBOARD_FILE, dashboard)
 
 print(f"Dashboard saved to {DASHBOARD_FILE}")
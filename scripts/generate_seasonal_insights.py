@@ -1,107 +1,75 @@
-import json
 import os
-from collections import Counter, defaultdict
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kx import codec
+from kx.store import open_store
+from kx.anomaly_index import load_anomaly_index
 
 DATA_DIR = "data"
 
-ANOM_FILE = os.path.join(DATA_DIR, "anomalies.json")
-HISTORY_FILE = os.path.join(DATA_DIR, "history/kingscross_history.json")
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 OUT_FILE = os.path.join(DATA_DIR, "seasonal_insights_2025.json")
 
 # ------------------------
 # Load data
 # ------------------------
-with open(ANOM_FILE, "r", encoding="utf-8") as f:
-    anomalies = json.load(f)
-
-with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-    history = json.load(f)
-
-df = pd.DataFrame(anomalies)
-df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+# Everything below is a projection of the anomaly index's rollup cube, which the
+# pipeline updates as each anomaly is written (rebuilt here in one pass if missing).
+anom_store = open_store("anomalies")
+index = load_anomaly_index(bootstrap=anom_store.iter_records(), last_ts=anom_store.last_ts())
 
 # ------------------------
 # Core summaries
 # ------------------------
 summary = {}
 
-summary["total_anomalies"] = len(df)
-summary["date_range"] = {
-    "start": df["timestamp"].min().isoformat(),
-    "end": df["timestamp"].max().isoformat()
-}
-
-# ------------------------
-# By type
-# ------------------------
-summary["by_type"] = (
-    df.groupby("type")
-      .size()
-      .sort_values(ascending=False)
-      .to_dict()
-)
+summary["total_anomalies"] = index.n
+summary["date_range"] = index.date_range()
 
 # ------------------------
-# By severity
+# By type / severity / persistence
 # ------------------------
-summary["by_severity"] = (
-    df.groupby("severity")
-      .size()
-      .sort_values(ascending=False)
-      .to_dict()
-)
+summary["by_type"] = index.breakdown("type")
+summary["by_severity"] = index.breakdown("severity")
+summary["by_persistence"] = index.breakdown("persistence")
 
 # ------------------------
-# Persistence analysis
+# Hour-of-day clustering
 # ------------------------
-if "persistence" in df.columns:
-    summary["by_persistence"] = (
-        df.groupby("persistence")
-          .size()
-          .sort_values(ascending=False)
-          .to_dict()
-    )
-else:
-    summary["by_persistence"] = {}
+hours = index.hour_counts()
+summary["peak_hours"] = {
+    h: hours[h] for h in sorted(range(24), key=lambda h: -hours[h])[:6] if hours[h]
+}
 
 # ------------------------
-# Hour-of-day clustering
+# Day-of-week / holiday phase
 # ------------------------
-df["hour"] = df["timestamp"].dt.hour
-summary["peak_hours"] = (
-    df.groupby("hour")
-      .size()
-      .sort_values(ascending=False)
-      .head(6)
-      .to_dict()
-)
+summary["by_day_of_week"] = {DAYS[d]: n for d, n in index.breakdown("dow").items()}
+summary["by_holiday_phase"] = index.breakdown("holiday_phase")
 
 # ------------------------
 # Drivers
 # ------------------------
-driver_counter = Counter()
-for drivers in df["drivers"]:
-    for d in drivers:
-        driver_counter[d] += 1
-
-summary["top_drivers"] = dict(driver_counter.most_common(10))
+summary["top_drivers"] = index.breakdown("driver", top=10)
 
 # ------------------------
 # Confidence bands
 # ------------------------
+conf = index.confidence()
 summary["confidence_stats"] = {
-    "avg": round(df["confidence"].mean(), 3),
-    "min": round(df["confidence"].min(), 3),
-    "max": round(df["confidence"].max(), 3)
+    k: (round(conf[k], 3) if conf[k] is not None else None) for k in ("avg", "std", "min", "max")
+}
+summary["confidence_by_type"] = {
+    t: round(index.confidence({"type": t})["avg"] or 0.0, 3) for t in summary["by_type"]
 }
 
 # ------------------------
 # Narrative helpers (machine-readable)
 # ------------------------
 summary["interpretation"] = {
-    "dominant_anomaly": df["type"].value_counts().idxmax(),
-    "most_common_driver": driver_counter.most_common(1)[0][0],
+    "dominant_anomaly": next(iter(summary["by_type"]), None),
+    "most_common_driver": next(iter(summary["top_drivers"]), None),
     "most_unstable_hours": list(summary["peak_hours"].keys())[:3],
     "data_quality_note": (
         "Confidence reflects signal agreement, not ground truth. "
@@ -110,10 +78,12 @@ summary["interpretation"] = {
 }
 
 # ------------------------
-# Save
+# Save (keeping the `python -m kx yoy` section)
 # ------------------------
-with open(OUT_FILE, "w", encoding="utf-8") as f:
-    json.dump(summary, f, indent=2)
+prev = codec.read(OUT_FILE, {})
+if isinstance(prev, dict) and "year_over_year" in prev:
+    summary["year_over_year"] = prev["year_over_year"]
+codec.write(OUT_FILE, summary)
 
 print("✅ Seasonal insights generated")
 print(f"📄 Output: {OUT_FILE}")
\ No newline at end of file
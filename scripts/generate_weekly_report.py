@@ -1,20 +1,18 @@
 # scripts/generate_weekly_report.py
-import json
+import os
+import sys
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kx import codec
+
 # Define paths to all data sources
 DATA_DIR = Path("data")
 DASHBOARD_FILE = DATA_DIR / "kingscross_dashboard.json"
 
 # Load JSON data safely
 def load_json(file_path):
-    try:
-        with open(file_path, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        return {}
+    return codec.read(file_path, {})
 
 def main():
     dashboard = {}
@@ -66,9 +64,7 @@ def main():
             })
 
     # --- Write dashboard ---
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with open(DASHBOARD_FILE, "w") as f:
-        json.dump(dashboard, f, indent=2)
+    codec.write(DASHBOARD_FILE, dashboard)
 
     print(f"Dashboard successfully saved to {DASHBOARD_FILE}")
 
@@ -8,13 +8,30 @@ Inputs (any one is enough):
 - data/weather_log.json (fallback – will generate weak targets)
 
 Outputs:
-- data/forecast.json  (always)
+- data/forecast.json  (always; next 12h view)
+- data/forecast_168h.json  (always; whole week, array form)
 - data/models/busyness_model.json (only if enough samples)
+
+Model:  --model ridge (default) | holt_winters
+- ridge keeps the lambda / feature groups of the last `python -m kx tune-ridge` run
+  (read back from busyness_model.json); extra groups are refitted from the history
+  store with kx.tune.fit, base features stream through the normal equations
+- holt_winters keeps its state in data/models/holt_winters.json and only feeds it
+  the history rows newer than the state (O(1) each)
 """
 
 from __future__ import annotations
-import os, json, math, datetime, statistics
-from typing import List, Dict, Any, Tuple
+import os, sys, math, datetime, itertools, argparse
+from typing import List, Dict, Any, Tuple, Iterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from kx import codec, timeutil
+from kx import calendar_table as cal
+from kx import forecast as forecast_engine
+from kx.intervals import ledger_entry, load_intervals
+from kx.holtwinters import HW_FILE, load_holt_winters
+from kx.store import open_store
+from kx.stream import iter_file
 
 DATA_DIR = "data"
 HIST_CANDIDATES = [
@@ -29,31 +46,22 @@ OUT_MODEL = os.path.join(DATA_DIR, "models", "busyness_model.json")
 # Kings Cross approx
 LAT, LON = 51.5308, -0.1238
 
+FEATURE_ORDER = forecast_engine.FEATURE_ORDER
+RIDGE_LAMBDA = 0.35  # until python -m kx tune-ridge picks one
+
 def _read_json(path: str):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
+    return codec.read(path)
 
 def _safe_iso_to_dt(s: str) -> datetime.datetime:
-    # Accept "Z" or "+00:00"
-    if not s:
+    # Accept "Z", "+00:00" or naive (memoised in kx.timeutil)
+    ts = timeutil.parse_ts(s)
+    if ts is None:
         return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
-    s = s.replace("Z", "+00:00")
-    try:
-        dt = datetime.datetime.fromisoformat(s)
-    except Exception:
-        dt = datetime.datetime.utcnow()
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=datetime.timezone.utc)
-    return dt.astimezone(datetime.timezone.utc)
+    return timeutil.to_datetime(ts)
 
 def _rush_hour(dt_utc: datetime.datetime) -> bool:
-    # London rush hours approx in UTC (works OK in winter; good enough as heuristic)
-    h = dt_utc.hour
-    # Morning 7-10, Evening 16-19
-    return (7 <= h <= 10) or (16 <= h <= 19)
+    # Morning 7-10, Evening 16-19, London local time (calendar table handles BST)
+    return cal.rush_hour(timeutil.epoch(dt_utc))
 
 def _clamp(x: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, x))
@@ -90,53 +98,42 @@ def _weather_from_dashboard(dash: Dict[str, Any]) -> Tuple[float, float]:
         wind = None
     return (temp if temp is not None else 10.0, wind if wind is not None else 10.0)
 
-def _load_history() -> List[Dict[str, Any]]:
-    raw = None
-    used = None
+def _iter_history() -> Iterator[Dict[str, Any]]:
+    # Stream rows from the first readable candidate; never holds the whole file in memory
     for p in HIST_CANDIDATES:
-        raw = _read_json(p)
-        if raw is not None:
-            used = p
-            break
-
-    if raw is None:
-        return []
-
-    # Normalize to a list of dicts with at least timestamp
-    hist: List[Dict[str, Any]] = []
-    if isinstance(raw, list):
-        # weather_log.json is list of dicts with timestamp/temp/wind/weather_code
-        for item in raw:
-            if isinstance(item, dict):
-                hist.append(item)
-    elif isinstance(raw, dict):
-        # Unexpected dict
-        hist = [raw]
-    else:
-        hist = []
+        if not os.path.exists(p):
+            continue
+        rows = iter_file(p)
+        try:
+            first = next(rows, None)
+        except Exception:
+            continue
+        if first is None:
+            continue
+        print(f"Streaming history from: {p}")
+        yield from _clean_rows(first, rows)
+        return
 
-    # Clean merge-conflict markers if present in kingscross_history.json (rare but you showed it)
-    cleaned: List[Dict[str, Any]] = []
-    for item in hist:
+def _clean_rows(first: Any, rest: Iterator[Any]) -> Iterator[Dict[str, Any]]:
+    for item in itertools.chain([first], rest):
         if not isinstance(item, dict):
             continue
+        # Skip merge-conflict markers if present in kingscross_history.json (rare but you showed it)
         ts = item.get("timestamp")
         if isinstance(ts, str) and ("<<<<<<" in ts or ">>>>>>" in ts or "=======" in ts):
             continue
-        cleaned.append(item)
-
-    print(f"Loaded history: {len(cleaned)} rows (source: {used})")
-    return cleaned
+        yield item
 
 def _make_row_features(dt: datetime.datetime, temp: float, wind: float, transport_stress: float, events_count: float) -> List[float]:
-    # Time cyclic features
-    hour = dt.hour + dt.minute/60.0
-    dow = dt.weekday()  # Mon=0
+    # Time cyclic features (London local clock, from the precomputed calendar)
+    day = cal.row(timeutil.epoch(dt))
+    hour = int(day["local_hour"]) + dt.minute/60.0
+    dow = int(day["local_dow"])  # Mon=0
     hour_sin = math.sin(2*math.pi*hour/24.0)
     hour_cos = math.cos(2*math.pi*hour/24.0)
     dow_sin = math.sin(2*math.pi*dow/7.0)
     dow_cos = math.cos(2*math.pi*dow/7.0)
-    rush = 1.0 if _rush_hour(dt) else 0.0
+    rush = 1.0 if int(day["local_hour"]) in cal.RUSH_HOURS else 0.0
 
     # Scale some signals lightly
     return [
@@ -150,20 +147,41 @@ def _make_row_features(dt: datetime.datetime, temp: float, wind: float, transpor
         events_count / 10.0,
     ]
 
-def _normal_eq_ridge(X: List[List[float]], y: List[float], lam: float = 0.2) -> List[float]:
-    # Solve (X^T X + lam I) w = X^T y
-    n = len(X)
-    m = len(X[0])
-    # Build XtX and Xty
-    XtX = [[0.0]*m for _ in range(m)]
-    Xty = [0.0]*m
-    for i in range(n):
-        xi = X[i]
-        yi = y[i]
+class _NormalEq:
+    """Running X^T X, X^T y and y^T y, so training is a single streaming pass."""
+
+    def __init__(self, m: int):
+        self.m = m
+        self.n = 0
+        self.XtX = [[0.0]*m for _ in range(m)]
+        self.Xty = [0.0]*m
+        self.yty = 0.0
+
+    def add(self, xi: List[float], yi: float):
+        m = self.m
         for a in range(m):
-            Xty[a] += xi[a]*yi
+            self.Xty[a] += xi[a]*yi
+            row = self.XtX[a]
+            xa = xi[a]
             for b in range(m):
-                XtX[a][b] += xi[a]*xi[b]
+                row[b] += xa*xi[b]
+        self.yty += yi*yi
+        self.n += 1
+
+    def resid_std(self, w: List[float]) -> float:
+        # SSR = y'y - 2 w'X'y + w'X'Xw ; bias column gives sum(resid) = sum(y) - w.sum(x)
+        m = self.m
+        wXy = sum(w[a]*self.Xty[a] for a in range(m))
+        wXXw = sum(w[a]*self.XtX[a][b]*w[b] for a in range(m) for b in range(m))
+        ssr = max(self.yty - 2*wXy + wXXw, 0.0)
+        mean = (self.Xty[0] - sum(w[b]*self.XtX[0][b] for b in range(m))) / self.n
+        return math.sqrt(max(ssr/self.n - mean*mean, 0.0))
+
+def _normal_eq_ridge(ne: _NormalEq, lam: float = 0.2) -> List[float]:
+    # Solve (X^T X + lam I) w = X^T y
+    m = ne.m
+    XtX = [row[:] for row in ne.XtX]
+    Xty = ne.Xty
 
     for j in range(m):
         XtX[j][j] += lam
@@ -196,9 +214,6 @@ def _normal_eq_ridge(X: List[List[float]], y: List[float], lam: float = 0.2) ->
     w = [A[i][m] for i in range(m)]
     return w
 
-def _predict(w: List[float], x: List[float]) -> float:
-    return sum(wi*xi for wi, xi in zip(w, x))
-
 def main():
     os.makedirs(DATA_DIR, exist_ok=True)
     dash = _read_json(DASHBOARD_FILE) or {}
@@ -208,17 +223,14 @@ def main():
     transport_stress_now = float(_transport_stress_from_dashboard(dash))
     events_count_now = float(_events_count_from_dashboard(dash))
 
-    history = _load_history()
 
-    # Build training set
-    X: List[List[float]] = []
-    y: List[float] = []
+    # Build training set (streamed: only the normal-equation sums are kept)
+    ne = _NormalEq(len(FEATURE_ORDER))
 
     # If history already contains "busyness", use it. Otherwise synthesize a weak target.
-    for item in history:
-        if not isinstance(item, dict):
-            continue
-        dt = _safe_iso_to_dt(str(item.get("timestamp", "")))
+    for item in _iter_history():
+        ep = timeutil.epoch_of(item)
+        dt = timeutil.to_datetime(ep) if ep is not None else _safe_iso_to_dt("")
 
         # Try to get signals from history row; else fallback to "now"
         t = item.get("temperature") or item.get("temperature_C")
@@ -263,87 +275,116 @@ def main():
         except Exception:
             continue
 
-        X.append(_make_row_features(dt, t, w, ts, ec))
-        y.append(target)
+        ne.add(_make_row_features(dt, t, w, ts, ec), target)
+
+    print(f"Loaded history: {ne.n} rows")
 
     # Train if enough data; else fallback forecast
     os.makedirs(os.path.dirname(OUT_MODEL), exist_ok=True)
 
+    # Tuned config (python -m kx tune-ridge): keep its lambda and feature groups
+    prev = _read_json(OUT_MODEL)
+    prev = prev if isinstance(prev, dict) else {}
+    lam = float(prev.get("lam", RIDGE_LAMBDA))
+    groups = list(prev.get("groups") or [])
+    lag = None
+
     trained = False
     w = None
-    if len(y) >= 24:
-        w = _normal_eq_ridge(X, y, lam=0.35)
+    if groups:
+        tuned = _fit_tuned(groups, lam, timeutil.epoch(now))
+        if tuned is not None:
+            model, lag = tuned
+            model["tuning"] = prev.get("tuning")
+            w, resid_std, trained = model["weights"], model["resid_std"], True
+            codec.write(OUT_MODEL, model)
+            print(f"✅ ML model saved: {OUT_MODEL} (n={model['n_samples']}, groups {'+'.join(groups)}, lambda {lam:g})")
+        else:
+            groups = []
+    if not trained and ne.n >= 24:
+        w = _normal_eq_ridge(ne, lam=lam)
         trained = True
         # Residual std for confidence band
-        preds = [_predict(w, X[i]) for i in range(len(y))]
-        resid = [y[i] - preds[i] for i in range(len(y))]
-        resid_std = statistics.pstdev(resid) if len(resid) > 1 else 10.0
+        resid_std = ne.resid_std(w) if ne.n > 1 else 10.0
         resid_std = float(_clamp(resid_std, 6.0, 18.0))
         model = {
             "trained_at": now.isoformat().replace("+00:00", "Z"),
-            "n_samples": len(y),
+            "n_samples": ne.n,
             "weights": w,
             "resid_std": resid_std,
-            "feature_order": [
-                "bias","hour_sin","hour_cos","dow_sin","dow_cos","rush",
-                "temp_scaled","wind_scaled","transport_scaled","events_scaled"
-            ],
+            "feature_order": FEATURE_ORDER,
+            "groups": [],
+            "lam": lam,
         }
-        with open(OUT_MODEL, "w", encoding="utf-8") as f:
-            json.dump(model, f, indent=2)
-        print(f"✅ ML model saved: {OUT_MODEL} (n={len(y)})")
-    else:
+        if prev.get("tuning"):
+            model["tuning"] = prev["tuning"]
+        codec.write(OUT_MODEL, model)
+        print(f"✅ ML model saved: {OUT_MODEL} (n={ne.n})")
+    elif not trained:
         resid_std = 12.0
-        print(f"⚠️ Not enough samples for ML (have {len(y)}). Using baseline forecast.")
-
-    # Confidence string
-    if len(y) >= 7*24:
-        conf_str = "high"
-    elif len(y) >= 24:
-        conf_str = "medium"
-    else:
-        conf_str = "low"
-
-    # Build forecast (next 12h)
-    forecast = []
-    for i in range(1, 13):
-        dt = (now + datetime.timedelta(hours=i))
-        rush = _rush_hour(dt)
-
-        # rush hour uplift heuristic (even for ML)
-        rush_uplift = 12.0 if rush else 0.0
-
-        if trained and w is not None:
-            xrow = _make_row_features(dt, temp_now, wind_now, transport_stress_now, events_count_now)
-            base = _predict(w, xrow)
-        else:
-            base = 48.0
-
-        bus = _clamp(base + rush_uplift, 0, 100)
-
-        # band width: std + extra if rush hour or low confidence
-        band = resid_std
-        if conf_str == "low":
-            band += 6.0
-        if rush:
-            band += 4.0
+        print(f"⚠️ Not enough samples for ML (have {ne.n}). Using baseline forecast.")
+
+    # Confidence string: from the rows the published model was fitted on (the store for a tuned model)
+    conf_str = _confidence(model["n_samples"] if trained else ne.n)
+
+    # Build forecast (next 168h in one matrix multiply; rush uplift and bands as before)
+    if not trained:
+        w = [48.0] + [0.0]*(len(FEATURE_ORDER)-1)  # flat baseline
+    exog = {"temp": temp_now, "wind": wind_now, "transport": transport_stress_now, "events": events_count_now}
+    fc = forecast_engine.ridge_forecast(timeutil.epoch(now), w, resid_std, exog, conf_str, groups=groups, lag=lag)
+    if not trained:
+        fc["model"] = "baseline"
+
+    _publish(fc)
+
+def _fit_tuned(groups: List[str], lam: float, now_ts: int):
+    # Extra feature groups need whole columns (calendar table, weekly lag): refit from the history store
+    from kx.backtest import load_history
+    from kx.tune import fit
+    d = load_history("history")
+    if len(d["ts"]) < 24:
+        return None
+    lag = forecast_engine.lagged(d["ts"], d["busyness"], forecast_engine.horizon_ts(now_ts))
+    return fit(d, groups, lam), lag
+
+def _confidence(n: int) -> str:
+    if n >= 7*24:
+        return "high"
+    if n >= 24:
+        return "medium"
+    return "low"
+
+def _publish(fc: Dict[str, Any]):
+    # Calibrated P10/P50/P90 from this model's scored residuals (the pipeline scores them hourly)
+    # (the state is a local cache of the forecasts store; the store gets this forecast too)
+    store = open_store("forecasts")
+    intervals = load_intervals(bootstrap=store.iter_records(), last_ts=store.last_ts())
+    fc = intervals.apply(fc)
+    forecast_engine.write_forecast(fc, OUT_FORECAST)
+    intervals.record(fc)
+    intervals.save()
+    issued = fc["start_ts"] - fc["step"]
+    store.append([{"timestamp": timeutil.iso(issued), "ts": issued, "published": ledger_entry(fc)}], timeutil.iso(issued))
 
-        low = int(_clamp(bus - band, 0, 100))
-        high = int(_clamp(bus + band, 0, 100))
+    print(f"✅ forecast.json written: {OUT_FORECAST}")
 
-        forecast.append({
-            "time": dt.isoformat(),
-            "busyness": int(round(bus)),
-            "low": low,
-            "high": high,
-            "confidence": conf_str,
-            "rush_hour": bool(rush),
-        })
+def main_holt_winters():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
 
-    with open(OUT_FORECAST, "w", encoding="utf-8") as f:
-        json.dump(forecast, f, indent=2)
+    # Persisted state; only rows newer than it are applied (first run replays everything)
+    hw = load_holt_winters()
+    n_new = hw.update_many(_iter_history())
+    print(f"Holt-Winters: {n_new} new rows, {hw.n} total, resid std {hw.resid_std:.1f}")
+    hw.save()
+    print(f"✅ Holt-Winters state saved: {HW_FILE}")
 
-    print(f"✅ forecast.json written: {OUT_FORECAST}")
+    _publish(hw.forecast(timeutil.epoch(now), _confidence(hw.n)))
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", choices=["ridge", "holt_winters"], default="ridge")
+    if ap.parse_args().model == "holt_winters":
+        main_holt_winters()
+    else:
+        main()
@@ -8,6 +8,7 @@ build_dashboard.py
 """
 
 import os
+import sys
 import json
 import datetime
 import csv
@@ -15,17 +16,16 @@ import csv
 # Optional OpenAI call
 import requests
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from kx import codec
+
 ROOT = os.path.abspath(os.getcwd())
 DATA_DIR = os.path.join(ROOT, "data")
 PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
 def load_json(path):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
+    return codec.read(path)
 
 # Load sources (if present)
 weather = load_json(os.path.join(DATA_DIR, "kingscross_weather.json")) or {}
@@ -46,8 +46,7 @@ dashboard = {
 }
 
 # Save dashboard
-with open(os.path.join(DATA_DIR, "kingscross_dashboard.json"), "w", encoding="utf-8") as f:
-    json.dump(dashboard, f, indent=2, ensure_ascii=False)
+codec.write(os.path.join(DATA_DIR, "kingscross_dashboard.json"), dashboard)
 
 # Build simple features.csv row for ML
 # Features: timestamp, temp, wind, tfl_issues_count, upcoming_event_count, avg_place_rating
@@ -164,8 +163,7 @@ if OPENAI_KEY:
         ai_insights["openai_error"] = str(e)
 
 # Save AI insights
-with open(os.path.join(DATA_DIR, "ai_insights.json"), "w", encoding="utf-8") as f:
-    json.dump(ai_insights, f, indent=2, ensure_ascii=False)
+codec.write(os.path.join(DATA_DIR, "ai_insights.json"), ai_insights)
 
 print("✅ Dashboard written to data/kingscross_dashboard.json")
 print("✅ Features appended to data/processed/features.csv")
@@ -1,27 +1,22 @@
 #!/usr/bin/env python3
-import json
+import os
+import sys
 import datetime
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from kx import codec
+
 DATA = Path("data")
 PROCESSED = DATA / "processed"
 PRED = DATA / "predictions"
 PRED.mkdir(parents=True, exist_ok=True)
 
 def read_json(path: Path, default):
-    try:
-        if not path.exists():
-            return default
-        txt = path.read_text(encoding="utf-8").strip()
-        if not txt:
-            return default
-        return json.loads(txt)
-    except Exception:
-        return default
+    return codec.read(path, default)
 
 def write_json(path: Path, obj):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
+    codec.write(path, obj)
 
 def utc_now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
-import json
 import os
+import sys
 import math
 import datetime
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from kx import codec, timeutil
+
 DATA = Path("data")
 PROCESSED = DATA / "processed"
 HISTORY = DATA / "history"
@@ -13,28 +16,20 @@ PROCESSED.mkdir(parents=True, exist_ok=True)
 HISTORY.mkdir(parents=True, exist_ok=True)
 
 def read_json(path: Path, default):
-    try:
-        if not path.exists():
-            return default
-        txt = path.read_text(encoding="utf-8").strip()
-        if not txt:
-            return default
-        return json.loads(txt)
-    except Exception:
-        return default
+    return codec.read(path, default)
 
 def write_json(path: Path, obj):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
+    codec.write(path, obj)
 
 def utc_now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 def parse_iso(ts: str):
-    try:
-        return datetime.datetime.fromisoformat(ts.replace("Z",""))
-    except Exception:
+    # naive UTC datetime, parsed once via the shared memoised parser
+    ep = timeutil.parse_ts(ts)
+    if ep is None:
         return None
+    return timeutil.to_datetime(ep).replace(tzinfo=None)
 
 # --- Weather fallback ---
 def get_weather():
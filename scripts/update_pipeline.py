@@ -1,16 +1,33 @@
 import os
-import json
+import sys
 import datetime
 import requests
 import statistics
 from math import radians, sin, cos, sqrt, atan2
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kx import codec, timeutil
+from kx import calendar_table as cal
+from kx import forecast as forecast_engine
+from kx.intervals import ledger_entry, load_intervals
+from kx.nowcast import load_nowcaster
+from kx.holtwinters import load_holt_winters
+from kx.ensemble import load_ensemble
+from kx.analogs import analog_forecast
+from kx.decompose import expected as seasonal_expectation, load_decomposition
+from kx.store import open_store
+from kx.baseline import load_baseline
+from kx.episodes import EPISODE_RETENTION, load_episodes
+from kx.anomaly import run_rules, load_detectors, WINDOW as ANOM_WINDOW
+from kx.anomaly_index import load_anomaly_index
+
 # ======================================================
 # CONFIG
 # ======================================================
 LAT, LON = 51.5308, -0.1238  # Kings Cross / Coal Drops Yard
-HISTORY_LIMIT = 600          # keep more during seasonal mode
-OBS_LIMIT = 3000             # observations for Christmas/NYE learning
+HISTORY_LIMIT = 600          # rows the models look back over (read from the store)
+HISTORY_VIEW_LIMIT = 168     # rows published in history/kingscross_history.json for the UI
+ANOM_VIEW_LIMIT = 50         # anomalies published in anomalies.json for the UI
 
 OPENWEATHER_KEY = os.getenv("OPENWEATHER_KEY")
 TFL_APP_KEY = os.getenv("TFL_APP_KEY")
@@ -24,26 +41,28 @@ os.makedirs(HISTORY_DIR, exist_ok=True)
 DASH_FILE = f"{DATA_DIR}/kingscross_dashboard.json"
 HISTORY_FILE = f"{HISTORY_DIR}/kingscross_history.json"
 FORECAST_FILE = f"{DATA_DIR}/forecast.json"
-OBS_FILE = f"{DATA_DIR}/observations.json"
+OBS_FILE = f"{DATA_DIR}/observations.json"  # legacy; frozen once the store is seeded
 ANOM_FILE = f"{DATA_DIR}/anomalies.json"
+RIDGE_MODEL_FILE = f"{DATA_DIR}/models/busyness_model.json"  # scripts/ml/train_and_forecast.py
+RF_MODEL_FILE = "models/model.joblib"                      # scripts/predict/train_model.py
+
+# Append-only segment stores (data/store/<name>/) are the source of truth;
+# the files above are small rolling views for the frontend.
+history_store = open_store("history")
+obs_store = open_store("observations")
+anom_store = open_store("anomalies")
+forecast_store = open_store("forecasts")  # each run's actual + what it published (rebuilds the ensemble / interval state)
 
 # ======================================================
 # HELPERS
 # ======================================================
 
 def safe_load_json(path, default):
-    if not os.path.exists(path):
-        return default
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return default
+    return codec.read(path, default)
 
 
 def safe_save_json(path, obj):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2)
+    codec.write(path, obj)
 
 
 def clamp(x, lo, hi):
@@ -55,15 +74,12 @@ def utc_iso(dt: datetime.datetime) -> str:
 
 
 def holiday_phase(dt: datetime.datetime) -> str:
-    if dt.month == 12 and dt.day == 31:
-        return "nye"
-    if dt.month == 12 and 27 <= dt.day <= 30:
-        return "pre_nye"
-    if dt.month == 12 and 20 <= dt.day <= 26:
-        return "christmas_period"
-    if dt.month == 1 and dt.day == 1:
-        return "new_year_day"
-    return "normal"
+    return cal.phase(timeutil.epoch(dt))
+
+
+def local_hour(dt: datetime.datetime) -> int:
+    # Europe/London wall-clock hour (BST-aware) from the precomputed calendar
+    return cal.local_hour(timeutil.epoch(dt))
 
 
 def haversine_km(lat1, lon1, lat2, lon2):
@@ -110,60 +126,23 @@ def lunch_signature_boost(hour, minute, venue):
     return 0
 
 
-# ---------------- ANOMALY HELPERS ----------------
-
-def anomaly_confidence(base=0.55, agreements=0, penalties=0):
-    c = base + 0.08 * agreements - 0.10 * penalties
-    return clamp(c, 0.40, 0.95)
-
-
-def anomaly_persistence(anoms, typ, window=6):
-    recent = [a for a in anoms[-window:] if a.get("type") == typ]
-    if len(recent) >= 4:
-        return "established"
-    if len(recent) >= 2:
-        return "emerging"
-    return "transient"
-
-
-def add_anomaly(anoms, *, ts, typ, severity, confidence, explanation, drivers):
-    persistence = anomaly_persistence(anoms, typ)
-
-    anoms.append({
-        "timestamp": ts,
-        "type": typ,
-        "severity": severity,
-        "confidence": round(float(confidence), 2),
-        "persistence": persistence,
-        "explanation": explanation,
-        "drivers": drivers,
-        "__debug": "NEW_WRITER_ACTIVE"
-    })
-
-
-def seasonal_baseline(history, hour_utc):
-    hist = history[-400:] if len(history) > 400 else history
-    same_hour = [
-        h for h in hist
-        if isinstance(h.get("timestamp"), str)
-        and datetime.datetime.fromisoformat(h["timestamp"].replace("Z","")).hour == hour_utc
-    ]
-    vals = [h["busyness"] for h in same_hour if isinstance(h.get("busyness"), (int, float))]
-    if len(vals) >= 8:
-        return vals[-80:]
-    return [h["busyness"] for h in hist if isinstance(h.get("busyness"), (int, float))][-120:]
-
 # ======================================================
 # TIME / CONTEXT
 # ======================================================
 now = datetime.datetime.utcnow()
 timestamp = utc_iso(now)
+epoch_now = timeutil.parse_ts(timestamp)
 phase = holiday_phase(now)
+hour_local = local_hour(now)
+day_cal = cal.features(epoch_now)
 
 context = {
     "holiday_phase": phase,
     "date": now.strftime("%Y-%m-%d"),
-    "hour": now.hour
+    "hour": now.hour,
+    "local_hour": hour_local,
+    "bank_holiday": bool(day_cal["bank_holiday"]),
+    "school_holiday": bool(day_cal["school_holiday"]),
 }
 
 print("🔑 Google Places key loaded:", bool(GOOGLE_PLACES_API_KEY))
@@ -174,6 +153,7 @@ print("🗓️ Seasonal context:", context)
 # ======================================================
 dashboard = {
     "timestamp": timestamp,
+    "ts": epoch_now,
     "context": context,
     "weather": None,
     "tfl": [],
@@ -319,7 +299,11 @@ dashboard["venues"] = venues
 # ======================================================
 # 5) HISTORY + BUSYNESS MODEL (seasonal mode)
 # ======================================================
-history = safe_load_json(HISTORY_FILE, [])
+history = history_store.tail(HISTORY_LIMIT)
+# Model state in data/models/ is a local cache of a replay of the stores (not committed):
+# it is rebuilt whenever it is missing or has not seen the stores' newest rows
+history_last_ts = history_store.last_ts()
+forecast_last_ts = forecast_store.last_ts()
 
 # choose "validator venue" (Morty & Bob's) if present, otherwise best-rated nearby
 validator = None
@@ -356,68 +340,144 @@ elif phase == "new_year_day":
     busyness += 3
 
 # lunch signature (venue-led)
-busyness += lunch_signature_boost(now.hour, now.minute, validator)
+busyness += lunch_signature_boost(hour_local, now.minute, validator)
 
 busyness = int(clamp(busyness, 0, 100))
 
-history.append({
+# Nowcast: Kalman filter (level + hour-of-week seasonal) fuses this run's heuristic with
+# its persisted prior; O(1) per run, replays the history store once if there is no state
+nowcaster = load_nowcaster(bootstrap=(
+    h for h in history_store.iter_records() if (timeutil.epoch_of(h) or 0) < epoch_now
+), last_ts=history_last_ts)
+nowcast = nowcaster.update(epoch_now, busyness) or {"busyness": busyness, "raw": busyness}
+nowcaster.save()
+dashboard["nowcast"] = nowcast
+
+# Seasonal expectation from the daily decomposition (trend + daily/weekly profile), if one exists
+decomposition = load_decomposition()
+if decomposition is not None:
+    seasonal_expected = clamp(float(seasonal_expectation(decomposition, [epoch_now])[0]), 0, 100)
+    dashboard["seasonal"] = {
+        "expected": round(seasonal_expected, 1),
+        "trend": decomposition["latest"]["trend"],
+        "deviation": round(busyness - seasonal_expected, 1),
+        "strength": {k: round(v, 2) for k, v in decomposition["strength"].items()},
+        "as_of": decomposition["generated_at"],
+    }
+
+history_row = {
     "timestamp": timestamp,
+    "ts": epoch_now,
     "busyness": busyness,
+    "busyness_smoothed": nowcast["busyness"],
     "temperature": temperature,
+    "weather_condition": condition,
     "transport_stress": transport_stress,
     "events_count": events_count,
     "holiday_phase": phase
-})
+}
+history.append(history_row)
 history = history[-HISTORY_LIMIT:]
-safe_save_json(HISTORY_FILE, history)
+history_store.append([history_row], timestamp)
+safe_save_json(HISTORY_FILE, history[-HISTORY_VIEW_LIMIT:])
 
 # ======================================================
-# 6) FORECAST (next 12 hours)
+# 6) FORECAST (next 168 hours; forecast.json keeps the 12h view)
 # ======================================================
 values = [h["busyness"] for h in history if isinstance(h.get("busyness"), (int, float))]
 avg = statistics.mean(values) if values else 55
 std = statistics.pstdev(values) if len(values) > 1 else 10
 
-forecast = []
-for i in range(1, 13):
-    t = now + datetime.timedelta(hours=i)
-    rush = t.hour in (7, 8, 9, 16, 17, 18)
-
-    base = avg + (12 if rush else 0)
-
-    # seasonal uplift in forecast too
-    ph = holiday_phase(t)
-    if ph == "christmas_period":
-        base += 4
-    elif ph == "pre_nye":
-        base += 6
-    elif ph == "nye":
-        base += 10
-    elif ph == "new_year_day":
-        base += 3
-
-    # lunch signature only around lunch hours
-    base += lunch_signature_boost(t.hour, 0, validator)
-
-    base = clamp(base, 0, 100)
-
-    forecast.append({
-        "time": utc_iso(t),
-        "busyness": int(base),
-        "low": int(clamp(base - std, 0, 100)),
-        "high": int(clamp(base + std, 0, 100)),
-        "rush_hour": rush,
-        "confidence": "medium" if len(values) >= 10 else "low"
-    })
-
-safe_save_json(FORECAST_FILE, forecast)
+# Score earlier forecasts against this run's actual (residual quantiles per hour-of-week x step)
+fc_intervals = load_intervals(bootstrap=forecast_store.iter_records(), last_ts=forecast_last_ts)
+fc_intervals.observe(epoch_now, busyness)
+
+# Ensemble members, each the whole horizon at once (kx.forecast array form)
+fc_conf = "medium" if len(values) >= 10 else "low"
+
+# heuristic: level + rush + holiday-phase uplift + lunch signature per local hour
+lunch_by_hour = [lunch_signature_boost(h, 0, validator) for h in range(24)]
+members = {"heuristic": forecast_engine.heuristic_forecast(epoch_now, avg, std, hour_boost=lunch_by_hour, confidence=fc_conf)}
+
+# ridge: weights from the last train_and_forecast.py / kx tune-ridge run, exogenous inputs from this run
+ridge_model = safe_load_json(RIDGE_MODEL_FILE, None)
+if isinstance(ridge_model, dict) and ridge_model.get("weights"):
+    exog = {
+        "temp": temperature if temperature is not None else 10.0,
+        "wind": windspeed if windspeed is not None else 10.0,
+        "transport": transport_stress,
+        "events": events_count,
+    }
+    # tuned models (python -m kx tune-ridge) may add feature groups; the weekly lag comes from recent history
+    ridge_groups = ridge_model.get("groups") or []
+    ridge_lag = None
+    if "lags" in ridge_groups:
+        lag_rows = [(timeutil.epoch_of(h), h["busyness"]) for h in history
+                    if isinstance(h.get("busyness"), (int, float)) and timeutil.epoch_of(h) is not None]
+        ridge_lag = forecast_engine.lagged([t for t, _ in lag_rows], [b for _, b in lag_rows],
+                                           forecast_engine.horizon_ts(epoch_now))
+    members["ridge"] = forecast_engine.ridge_forecast(
+        epoch_now, ridge_model["weights"], ridge_model.get("resid_std", 12.0), exog, fc_conf,
+        groups=ridge_groups, lag=ridge_lag)
+
+# Holt-Winters: one O(1) update with this run (replays the history store once if there is no state)
+hw = load_holt_winters(bootstrap=history_store.iter_records(), last_ts=history_last_ts)
+hw.update(epoch_now, busyness)
+hw.save()
+members["holt_winters"] = hw.forecast(epoch_now, fc_conf)
+
+# analogs: what followed the most similar past days (nearest trailing-day profiles + conditions)
+analog = analog_forecast(epoch_now)
+if analog is not None:
+    members["analog"] = analog
+
+# moving average of the last runs (forecast_busyness.py)
+recent = history[-6:]
+members["moving_average"] = forecast_engine.moving_average_forecast(
+    epoch_now,
+    [h["busyness"] for h in recent],
+    [h.get("events_count") or 0 for h in recent],
+    [h["temperature"] if isinstance(h.get("temperature"), (int, float)) else 10.0 for h in recent],
+    statistics.pstdev(values[-24:]) if len(values) > 1 else 10,
+)
+
+# RandomForest from scripts/predict/train_model.py, if it has been trained here
+if os.path.exists(RF_MODEL_FILE):
+    try:
+        import joblib
+        rf = joblib.load(RF_MODEL_FILE)
+        x = [temperature or 0, windspeed or 0, disrupted_lines, events_count,
+             float((validator or {}).get("rating") or 4.0)]
+        members["random_forest"] = forecast_engine.random_forest_forecast(rf, x, epoch_now)
+    except Exception as e:
+        print("RandomForest member skipped:", e)
+
+# Hedge: reweight the members by how well their previous forecasts matched this run, then combine
+ensemble = load_ensemble(bootstrap=forecast_store.iter_records(), last_ts=forecast_last_ts)
+ensemble.observe(epoch_now, busyness)
+forecast_week = ensemble.combine(members, base="heuristic")
+ensemble.remember(members)
+ensemble.save()
+
+# P10/P50/P90 from past residuals where there are enough; ±std otherwise
+forecast_week = fc_intervals.apply(forecast_week)
+forecast_engine.write_forecast(forecast_week, FORECAST_FILE)
+fc_intervals.record(forecast_week)
+fc_intervals.save()
+forecast_store.append([{
+    "timestamp": timestamp,
+    "ts": epoch_now,
+    "actual": busyness,
+    "published": ledger_entry(forecast_week),
+    "members": {name: ensemble.pending[name] for name in members},
+}], timestamp)
 
 # ======================================================
 # 7) CLUSTERS + TRANSIT PRESSURE (Coal Drops Yard story)
 # ======================================================
 clusters = {"transit": 40, "leisure": 35, "dining": 30}
 
-if now.hour in (7, 8, 9, 16, 17, 18):
+if hour_local in (7, 8, 9, 16, 17, 18):
     clusters["transit"] += 20
 
 clusters["transit"] += transport_stress
@@ -436,7 +496,7 @@ clusters = {k: int(clamp(v, 0, 100)) for k, v in clusters.items()}
 dashboard["clusters"] = clusters
 
 drivers = []
-if now.hour in (7, 8, 9, 16, 17, 18):
+if hour_local in (7, 8, 9, 16, 17, 18):
     drivers.append("Rush hour")
 if disrupted_lines:
     drivers.append(f"{disrupted_lines} disrupted lines")
@@ -457,9 +517,9 @@ dashboard["transit_pressure"] = {
 # ======================================================
 # 8) OBSERVATIONS (raw “truth log” for seasonal mode)
 # ======================================================
-observations = safe_load_json(OBS_FILE, [])
-observations.append({
+obs_store.append([{
     "timestamp": timestamp,
+    "ts": epoch_now,
     "context": context,
     "signals": {
         "busyness": busyness,
@@ -469,103 +529,64 @@ observations.append({
         "temperature_C": temperature,
         "weather_condition": condition
     }
-})
-observations = observations[-OBS_LIMIT:]
-safe_save_json(OBS_FILE, observations)
+}], timestamp)
 
 # ======================================================
 # 9) ANOMALY ENGINE (v1 explainable, taxonomy-friendly)
 # ======================================================
-anomalies = safe_load_json(ANOM_FILE, [])
-
-# baseline for this hour
-baseline_vals = seasonal_baseline(history, now.hour)
-b_avg = statistics.mean(baseline_vals) if baseline_vals else 55
-b_std = statistics.pstdev(baseline_vals) if len(baseline_vals) > 1 else 10
+# Counters + per-type / per-hour indexes over the whole anomaly log (rebuilt once if missing)
+anom_last_ts = anom_store.last_ts()
+anom_index = load_anomaly_index(bootstrap=anom_store.iter_records(), last_ts=anom_last_ts)
+anomalies = anom_store.tail(ANOM_VIEW_LIMIT)
+n_prev_anoms = len(anomalies)
+
+# baseline for this hour-of-week x holiday phase (decayed, with fallback to hour-of-day / global).
+# First run without saved state replays the history store once.
+baseline = load_baseline(bootstrap=(
+    h for h in history_store.iter_records() if (timeutil.epoch_of(h) or 0) < epoch_now
+), last_ts=history_last_ts)
+# Robust centre/spread (median, 1.4826*MAD from the bucket's t-digest) so a single
+# 100-busyness outlier run does not drag the baseline for days.
+b_avg, b_std, b_level = baseline.robust(epoch_now, phase)
+baseline.update(epoch_now, busyness, phase)
+baseline.save()
 
 # compare vs forecast (the run generates forecast; first point is next hour, so baseline is better here)
-z = (busyness - b_avg) / max(b_std, 1)
-
-drivers = []
-agreements = 0
-penalties = 0
-
-if phase != "normal":
-    drivers.append(f"holiday_phase:{phase}")
-    agreements += 1
-
-if transport_stress >= 16:
-    drivers.append("transport_disruption")
-    agreements += 1
-
-if events_count >= 2:
-    drivers.append("events")
-    agreements += 1
-
-if condition and str(condition).lower() in ("clear", "clouds"):
-    drivers.append("fair_weather")
-    agreements += 1
-
-# Demand anomalies
-if z >= 2.0:
-    sev = "high" if z >= 3.0 else "medium"
-    conf = anomaly_confidence(0.58, agreements=agreements, penalties=penalties)
-    add_anomaly(
-        anomalies,
-        ts=timestamp,
-        typ="unexpected_peak",
-        severity=sev,
-        confidence=conf,
-        explanation=f"Demand is significantly above baseline for this hour (z≈{z:.1f}).",
-        drivers=drivers
-    )
-
-if z <= -2.0:
-    sev = "high" if z <= -3.0 else "medium"
-    conf = anomaly_confidence(0.56, agreements=max(agreements-1, 0), penalties=penalties+1)
-    add_anomaly(
-        anomalies,
-        ts=timestamp,
-        typ="suppressed_demand",
-        severity=sev,
-        confidence=conf,
-        explanation=f"Demand is significantly below baseline for this hour (z≈{z:.1f}).",
-        drivers=drivers
-    )
-
-# Prolonged peak: last 3 points >= (baseline avg + 1 std)
-if len(history) >= 2:
-    last3 = [h.get("busyness") for h in history[-3:] if isinstance(h.get("busyness"), (int, float))]
-    if len(last3) == 3 and all(v >= (b_avg + b_std) for v in last3):
-        conf = anomaly_confidence(0.62, agreements=agreements+1, penalties=penalties)
-        add_anomaly(
-            anomalies,
-            ts=timestamp,
-            typ="prolonged_peak",
-            severity="medium",
-            confidence=conf,
-            explanation="Demand has stayed elevated for multiple consecutive runs, longer than baseline norm.",
-            drivers=drivers
-        )
-
-# Volatile demand: last 4 points range is large
-if len(history) >= 5:
-    last4 = [h.get("busyness") for h in history[-4:] if isinstance(h.get("busyness"), (int, float))]
-    if len(last4) == 4 and (max(last4) - min(last4)) >= 22:
-        conf = anomaly_confidence(0.55, agreements=max(agreements-1, 0), penalties=penalties+1)
-        add_anomaly(
-            anomalies,
-            ts=timestamp,
-            typ="volatile_demand",
-            severity="low",
-            confidence=conf,
-            explanation="Demand fluctuated sharply within a short window.",
-            drivers=drivers
-        )
-
-# Keep last ~500 anomalies
-anomalies = anomalies[-500:]
-safe_save_json(ANOM_FILE, anomalies)
+# kx.anomaly.run_rules is also what `python -m kx backfill` steps, warm-up gate included.
+window = [(timeutil.epoch_of(h), h.get("busyness")) for h in history[-ANOM_WINDOW:]]
+anom_sig = {
+    "busyness": busyness,
+    "transport_stress": transport_stress,
+    "events_count": events_count,
+    "temperature_C": temperature,
+    "weather_condition": condition,
+}
+recent_types = anom_index.recent_types()
+
+# timing (shifted/missing peak), signal mismatch and regime-shift (CUSUM + BOCPD) detectors
+# keep their rolling state on disk
+detectors = load_detectors(bootstrap=(
+    h for h in history_store.iter_records() if (timeutil.epoch_of(h) or 0) < epoch_now
+), last_ts=history_last_ts)
+anomalies.extend(run_rules(
+    timestamp=timestamp, ts=epoch_now, sig=anom_sig, phase=phase, b_avg=b_avg, b_std=b_std,
+    level=b_level, window=window, rolling=detectors, recent_types=recent_types,
+))
+detectors.save()
+
+# New anomalies go to the store and its index; the UI view keeps only the latest few
+new_anomalies = anomalies[n_prev_anoms:]
+anom_store.append(new_anomalies, timestamp)
+anom_index.add_many(new_anomalies)
+anom_index.save()
+safe_save_json(ANOM_FILE, anomalies[-ANOM_VIEW_LIMIT:])
+
+# Episodes (consecutive hits of one type merged): the log is local state, the UI downloads the latest few
+episodes = load_episodes(bootstrap=anom_store.iter_records(), last_ts=anom_last_ts)
+episodes.add_many(new_anomalies)
+episodes.prune(epoch_now - EPISODE_RETENTION)
+episodes.save()
+episodes.publish()
 
 # ======================================================
 # SAVE DASHBOARD (FINAL)
@@ -574,8 +595,9 @@ safe_save_json(DASH_FILE, dashboard)
 
 print("✅ Pipeline complete")
 print(f"📍 Venues loaded: {len(dashboard['venues'])}")
-print(f"🔥 Busyness now: {busyness}")
-print(f"🧠 Baseline avg/std: {b_avg:.1f}/{b_std:.1f} (hour={now.hour} UTC)")
-print(f"🚨 Anomalies total: {len(anomalies)} (latest written if triggered)")
-from collections import Counter
-print("🧾 Anomaly breakdown:", Counter(a["type"] for a in anomalies))
+print(f"🔥 Busyness now: {busyness} (nowcast {nowcast['busyness']} ± {nowcast.get('std', '?')})")
+print(f"🧠 Baseline median/robust-std: {b_avg:.1f}/{b_std:.1f} (level={b_level}, hour-of-week={cal.local_hour_of_week(epoch_now)} London)")
+print(f"🚨 Anomalies total: {anom_index.n} ({len(new_anomalies)} new this run)")
+print("🧾 Anomaly breakdown:", anom_index.breakdown("type"))
+print("🤝 Ensemble weights:", {k: v["weight"] for k, v in forecast_week["members"].items()})
+print(f"🧩 Anomaly episodes: {len(episodes)} ({len(episodes.active_at(epoch_now))} active now)")